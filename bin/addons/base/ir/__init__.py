@@ -36,6 +36,7 @@ import ir_rule
 import wizard
 import ir_config_parameter
 import osv_memory_autovacuum
+import ir_column_stats
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
 
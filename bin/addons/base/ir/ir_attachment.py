@@ -19,12 +19,279 @@
 #
 ##############################################################################
 
+import base64
+import hashlib
 import itertools
+import logging
+import os
+import tempfile
+import time
 
+import psycopg2
+
+import tools
 from osv import fields,osv
+from tools.translate import _
 # from osv.orm import except_orm
 
 class ir_attachment(osv.osv):
+    """ Attachments: their content is stored in the database, in the
+        db_datas column, unless [attachment] location is set in the
+        configuration. It is then stored in <location>/<database>/, in
+        files named after the SHA1 of their content, shared by the
+        attachments which have the same content.
+
+        Note that database dumps do not include the filestore.
+    """
+    _logger = logging.getLogger('ir.attachment')
+
+    # size of the chunks of read_chunk(), when not given
+    _chunk_size = 1024 * 1024
+    # the files unreferenced for less than that (in seconds) may belong
+    # to transactions in progress, and are not collected
+    _file_gc_delay = 3600
+
+    def _filestore(self, cr):
+        location = tools.config.get_misc('attachment', 'location', False)
+        if not location:
+            return None
+        return os.path.join(location, cr.dbname)
+
+    def _staging_dir(self, cr):
+        """ Where the contents uploaded by chunks are assembled """
+        return os.path.join(self._filestore(cr) or os.path.join(tempfile.gettempdir(), 'openerp-uploads', cr.dbname),
+                            'upload')
+
+    def _file_path(self, cr, fname):
+        return os.path.join(self._filestore(cr) or '', fname)
+
+    def _file_read(self, cr, fname, offset=0, size=None):
+        f = open(self._file_path(cr, fname), 'rb')
+        try:
+            f.seek(offset)
+            if size is None:
+                return f.read()
+            return f.read(size)
+        finally:
+            f.close()
+
+    def _file_store(self, cr, path, sha):
+        """ Moves the file at path to the filestore, as the content of the
+            given SHA1, and returns its name in the filestore """
+        fname = os.path.join(sha[:2], sha)
+        full_path = self._file_path(cr, fname)
+        if os.path.exists(full_path):
+            # already there: protect it from the garbage collector
+            os.utime(full_path, None)
+            os.unlink(path)
+        else:
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            os.rename(path, full_path)
+        return fname
+
+    def _file_write(self, cr, data):
+        """ Stores data in the filestore, unless it is there already, and
+            returns the name of its file """
+        store = self._filestore(cr)
+        if not os.path.isdir(store):
+            os.makedirs(store)
+        # written aside, then moved, so that the files are always complete
+        fd, path = tempfile.mkstemp(dir=store, prefix='.tmp')
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return self._file_store(cr, path, hashlib.sha1(data).hexdigest())
+
+    def _file_remove_old(self, path, limit):
+        """ Removes the file at path if it was not modified since limit,
+            returns whether it was removed """
+        try:
+            if os.path.getmtime(path) < limit:
+                os.unlink(path)
+                return True
+        except OSError:
+            pass
+        return False
+
+    def _file_gc(self, cr, uid, context=None):
+        """ Removes the files of the filestore which are no longer used by
+            any attachment, nor recently written, along with the temporary
+            files and the uploads left behind """
+        limit = time.time() - self._file_gc_delay
+        count = 0
+        # the uploads by chunks which were never completed
+        staging = self._staging_dir(cr)
+        if os.path.isdir(staging):
+            for fname in os.listdir(staging):
+                count += self._file_remove_old(os.path.join(staging, fname), limit)
+        store = self._filestore(cr)
+        if not store or not os.path.isdir(store):
+            self._logger.info('%d abandoned uploads removed for %s', count, cr.dbname)
+            return True
+        cr.execute('SELECT DISTINCT store_fname FROM ir_attachment WHERE store_fname IS NOT NULL')
+        used = set(x[0] for x in cr.fetchall())
+        for dirname in os.listdir(store):
+            path = os.path.join(store, dirname)
+            if dirname.startswith('.tmp'):
+                # written by a transaction which did not complete
+                count += self._file_remove_old(path, limit)
+                continue
+            if len(dirname) != 2 or not os.path.isdir(path):
+                continue
+            for fname in os.listdir(path):
+                if os.path.join(dirname, fname) not in used:
+                    count += self._file_remove_old(os.path.join(path, fname), limit)
+        self._logger.info('%d unused files removed from the filestore of %s', count, cr.dbname)
+        return True
+
+    def _data_get(self, cr, uid, ids, name, arg, context=None):
+        if context is None:
+            context = {}
+        res = dict.fromkeys(ids, False)
+        if not ids:
+            return res
+        if context.get('bin_size'):
+            # only the size is asked for, do not load the contents
+            cr.execute('SELECT id, file_size, length(db_datas) '
+                       'FROM ir_attachment WHERE id IN %s', (tuple(ids),))
+            for id, file_size, db_size in cr.fetchall():
+                if file_size is None:
+                    # stored before the size was recorded
+                    file_size = db_size
+                res[id] = file_size or False
+            return res
+        cr.execute('SELECT id, store_fname, db_datas FROM ir_attachment WHERE id IN %s', (tuple(ids),))
+        for id, fname, db_datas in cr.fetchall():
+            if fname:
+                try:
+                    res[id] = base64.b64encode(self._file_read(cr, fname))
+                except IOError:
+                    self._logger.error('Content of attachment %s is missing from the filestore: %s', id, fname)
+            elif db_datas:
+                res[id] = str(db_datas)
+        return res
+
+    def _data_set(self, cr, uid, id, name, value, arg, context=None):
+        # access rights were checked by write() or create()
+        if not value:
+            cr.execute('UPDATE ir_attachment SET store_fname=NULL, file_size=0, db_datas=NULL WHERE id=%s', (id,))
+            return True
+        data = base64.decodestring(value)
+        if self._filestore(cr):
+            cr.execute('UPDATE ir_attachment SET store_fname=%s, file_size=%s, db_datas=NULL WHERE id=%s',
+                       (self._file_write(cr, data), len(data), id))
+        else:
+            cr.execute('UPDATE ir_attachment SET store_fname=NULL, file_size=%s, db_datas=%s WHERE id=%s',
+                       (len(data), psycopg2.Binary(value), id))
+        return True
+
+    def _check_chunk_access(self, cr, uid, id, mode, context=None):
+        """ The checks of read() or write(), for the methods reading or
+            writing the content directly: the access rights and rules of
+            the attachments, then of the documents they are attached to """
+        self.pool.get('ir.model.access').check(cr, uid, self._name, mode, context=context)
+        self.check_access_rule(cr, uid, [id], mode, context=context)
+        self.check(cr, uid, [id], mode, context=context)
+
+    def read_chunk(self, cr, uid, id, offset=0, size=None, context=None):
+        """ Returns a slice of the content of an attachment, base64 encoded,
+            of at most size bytes from offset: the content can be downloaded
+            without loading it all at once, down to an empty slice. """
+        self._check_chunk_access(cr, uid, id, 'read', context=context)
+        size = size or self._chunk_size
+        cr.execute('SELECT store_fname, db_datas FROM ir_attachment WHERE id=%s', (id,))
+        row = cr.fetchone()
+        if not row:
+            return ''
+        fname, db_datas = row
+        if fname:
+            data = self._file_read(cr, fname, offset, size)
+        elif db_datas:
+            data = base64.decodestring(str(db_datas))[offset:offset + size]
+        else:
+            data = ''
+        return base64.b64encode(data)
+
+    def write_chunk(self, cr, uid, id, data, offset=0, last=True, context=None):
+        """ Uploads the content of an attachment by chunks: data is the base64
+            encoded slice of the content starting at offset. The chunks must
+            be sent in order, the one at offset 0 starting a new upload, and
+            the content of the attachment is replaced once the last one has
+            been received. """
+        self._check_chunk_access(cr, uid, id, 'write', context=context)
+        staging = self._staging_dir(cr)
+        if not os.path.isdir(staging):
+            os.makedirs(staging)
+        path = os.path.join(staging, '%d-%d' % (id, uid))
+        if offset:
+            if not os.path.exists(path) or os.path.getsize(path) != offset:
+                raise osv.except_osv(_('Error'), _('The chunks of the attachment must be sent in order!'))
+            f = open(path, 'ab')
+        else:
+            f = open(path, 'wb')
+        try:
+            f.write(base64.decodestring(data))
+        finally:
+            f.close()
+        if not last:
+            return True
+
+        if self._filestore(cr):
+            sha = hashlib.sha1()
+            f = open(path, 'rb')
+            try:
+                for chunk in iter(lambda: f.read(self._chunk_size), ''):
+                    sha.update(chunk)
+            finally:
+                f.close()
+            size = os.path.getsize(path)
+            fname = self._file_store(cr, path, sha.hexdigest())
+            # as write() would do, without loading the content
+            cr.execute('UPDATE ir_attachment SET store_fname=%s, file_size=%s, db_datas=NULL, '
+                       'write_uid=%s, write_date=now() WHERE id=%s',
+                       (fname, size, uid, id))
+        else:
+            f = open(path, 'rb')
+            try:
+                value = base64.b64encode(f.read())
+            finally:
+                f.close()
+            os.unlink(path)
+            self.write(cr, uid, [id], {'datas': value}, context=context)
+        return True
+
+    def migrate_storage(self, cr, uid, limit=100, context=None):
+        """ Moves the contents of the attachments to the storage set in the
+            configuration, the filestore or the database, by batches of
+            limit attachments, committed as they are done. Returns the
+            number of attachments moved. """
+        if uid != 1:
+            raise osv.except_osv(_('Error'), _('Only the administrator can move the attachments!'))
+        store = self._filestore(cr)
+        if store:
+            query = 'SELECT id, db_datas FROM ir_attachment WHERE db_datas IS NOT NULL LIMIT %s'
+        else:
+            query = 'SELECT id, store_fname FROM ir_attachment WHERE store_fname IS NOT NULL LIMIT %s'
+        count = 0
+        while True:
+            cr.execute(query, (limit,))
+            rows = cr.fetchall()
+            if not rows:
+                break
+            for id, content in rows:
+                if store:
+                    value = str(content)
+                else:
+                    value = base64.b64encode(self._file_read(cr, content))
+                self._data_set(cr, uid, id, 'datas', value, None, context=context)
+            cr.commit()
+            count += len(rows)
+            self._logger.info('%d attachments of %s moved to the %s', count, cr.dbname,
+                              store and 'filestore' or 'database')
+        return count
+
     def check(self, cr, uid, ids, mode, context=None, values=None):
         """Restricts the access to an ir.attachment, according to referred model
         In the 'document' module, it is overriden to relax this hard rule, since
@@ -151,7 +418,11 @@ class ir_attachment(osv.osv):
     _function_field_browse = True
     _columns = {
         'name': fields.char('Attachment Name',size=256, required=True),
-        'datas': fields.binary('Data'),
+        'datas': fields.function(_data_get, fnct_inv=_data_set, method=True, type='binary',
+                string='Data', nodrop=True),
+        'db_datas': fields.binary('Database Data', oldname='datas'),
+        'store_fname': fields.char('Stored Filename', size=256, readonly=True),
+        'file_size': fields.integer('File Size', readonly=True),
         'datas_fname': fields.char('Filename',size=256),
         'description': fields.text('Description'),
         'res_name': fields.function(_name_get_resname, type='char', size=128,
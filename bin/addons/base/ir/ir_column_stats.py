@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP s.a. (<http://openerp.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Persistent statistics of column usage, for the 'auto' prefetch of browse().
+"""
+
+import logging
+import time
+
+import psycopg2
+
+import netsvc
+import pooler
+from osv import fields, osv
+from tools.config import config
+
+class ir_column_stats(osv.osv):
+    """ Number of browse() fetches per column, shared by all the server
+        processes through the database.
+
+        Every process counts fetches in `_column_stats` of each model and
+        periodically adds them here, then reloads the merged figures. Scores
+        decay exponentially with time (see the 'column_stats.half_life'
+        option, in seconds), so that they follow the recent usage.
+    """
+    _name = 'ir.column.stats'
+    _description = 'Column usage statistics'
+    _log_access = False
+    _logger = logging.getLogger('orm.column_stats')
+
+    _columns = {
+        'model': fields.char('Object', size=64, required=True, select=1, readonly=True),
+        'field': fields.char('Field', size=64, required=True, readonly=True),
+        'score': fields.float('Score', readonly=True),
+        'date': fields.datetime('Last Update', readonly=True),
+    }
+
+    _sql_constraints = [
+        ('model_field_uniq', 'unique (model, field)', 'Statistics must be unique per field!'),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        # the values of the _column_stats of each model, at last load
+        self._loaded = {}
+        return super(ir_column_stats, self).__init__(*args, **kwargs)
+
+    def _half_life(self):
+        return float(config.get_misc('column_stats', 'half_life', 7 * 86400))
+
+    def _table_exists(self, cr):
+        cr.execute("SELECT 1 FROM pg_class WHERE relkind = 'r' AND relname = %s",
+                    (self._table,), debug=self._debug)
+        return bool(cr.rowcount)
+
+    def _read_scores(self, cr, model=None):
+        """ Fetch the scores, decayed up to now, as {model: {field: score}}
+        """
+        query = "SELECT model, field, " \
+                " score * power(0.5, extract(epoch FROM now() - date) / %s) " \
+                " FROM ir_column_stats"
+        params = [self._half_life()]
+        if model:
+            query += " WHERE model = %s"
+            params.append(model)
+        cr.execute(query, params, debug=self._debug)
+        res = {}
+        for model_name, field, score in cr.fetchall():
+            res.setdefault(model_name, {})[field] = score
+        return res
+
+    def load(self, cr):
+        """ Set the _column_stats of all the models of the pool from the db
+        """
+        if not self._table_exists(cr):
+            return False
+        scores = self._read_scores(cr)
+        for model_name in self.pool.obj_list():
+            obj = self.pool.get(model_name)
+            obj._column_stats = scores.get(model_name, {})
+            self._loaded[model_name] = obj._column_stats.copy()
+        return True
+
+    def flush(self, cr):
+        """ Add the fetches counted by this process since the last load to
+            the (decayed) scores of the db, and reload the merged scores
+        """
+        if not self._table_exists(cr):
+            return False
+        half_life = self._half_life()
+        for model_name in self.pool.obj_list():
+            stats = self.pool.get(model_name)._column_stats
+            loaded = self._loaded.get(model_name, {})
+            for field, score in stats.items():
+                delta = score - loaded.get(field, 0)
+                if delta <= 0:
+                    continue
+                self._add_score(cr, model_name, field, delta, half_life)
+        return self.load(cr)
+
+    def _add_score(self, cr, model_name, field, delta, half_life):
+        # another process may insert the row meanwhile, then update it
+        while True:
+            cr.execute("UPDATE ir_column_stats "
+                    "SET score = score * power(0.5, extract(epoch FROM now() - date) / %s) + %s, "
+                    "date = now() "
+                    "WHERE model = %s AND field = %s",
+                    (half_life, delta, model_name, field), debug=self._debug)
+            if cr.rowcount:
+                return
+            cr.execute("SAVEPOINT ir_column_stats_insert")
+            try:
+                cr.execute("INSERT INTO ir_column_stats (model, field, score, date) "
+                        "VALUES (%s, %s, %s, now())",
+                        (model_name, field, delta), debug=self._debug, log_exceptions=False)
+            except psycopg2.IntegrityError:
+                cr.execute("ROLLBACK TO SAVEPOINT ir_column_stats_insert")
+                continue
+            cr.execute("RELEASE SAVEPOINT ir_column_stats_insert")
+            return
+
+    def _flush_job(self, db_name):
+        try:
+            db, pool = pooler.get_db_and_pool(db_name)
+        except Exception:
+            return False
+        cr = db.cursor()
+        try:
+            try:
+                pool.get(self._name).flush(cr)
+                cr.commit()
+            except Exception:
+                cr.rollback()
+                self._logger.warning("Could not flush the column statistics of %s:", db_name, exc_info=True)
+        finally:
+            cr.close()
+        pool.get(self._name).restart(db_name)
+
+    def restart(self, db_name):
+        """ (Re)schedule the periodic flush of the statistics of this process
+        """
+        interval = int(config.get_misc('column_stats', 'flush_interval', 900))
+        netsvc.Agent.cancel(db_name, self._flush_job)
+        if interval > 0:
+            netsvc.Agent.setAlarm(self._flush_job, time.time() + interval, db_name, db_name)
+
+    def get_stats(self, cr, uid, model=None, context=None):
+        """ Return the current scores, as {model: {field: score}}
+
+            @param model if given, only return the scores of that model
+        """
+        self.pool.get('ir.model.access').check(cr, uid, self._name, 'read', context=context)
+        return self._read_scores(cr, model)
+
+ir_column_stats()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
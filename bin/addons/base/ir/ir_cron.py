@@ -19,9 +19,12 @@
 #
 ##############################################################################
 
+import threading
 import time
+import traceback
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import psycopg2
 import netsvc
 import tools
 from tools.safe_eval import safe_eval as eval
@@ -40,6 +43,13 @@ _intervalTypes = {
     'minutes': lambda interval: relativedelta(minutes=interval),
 }
 
+# The jobs run in threads of their own, at most [cron] workers of them at
+# a time, whatever their database
+_workers = threading.BoundedSemaphore(int(tools.config.get_misc('cron', 'workers', 4)))
+# (database, job id) of the jobs run by this process
+_running = set()
+_running_lock = threading.Lock()
+
 class ir_cron(osv.osv, netsvc.Agent):
     """ This is the ORM object that periodically executes actions.
     
@@ -60,7 +70,11 @@ class ir_cron(osv.osv, netsvc.Agent):
         'model': fields.char('Object', size=64, help="Name of object whose function will be called when this scheduler will run. e.g. 'res.partner'"),
         'function': fields.char('Function', size=64, help="Name of the method to be called on the object when this scheduler is executed."),
         'args': fields.text('Arguments', help="Arguments to be passed to the method. e.g. (uid,)"),
-        'priority': fields.integer('Priority', help='0=Very Urgent\n10=Not urgent')
+        'priority': fields.integer('Priority', help='0=Very Urgent\n10=Not urgent'),
+        'lastcall': fields.datetime('Last Execution Date', readonly=True),
+        'last_duration': fields.float('Last Duration', readonly=True, help="Duration of the last execution, in seconds"),
+        'last_error': fields.text('Last Error', readonly=True),
+        'failures': fields.integer('Failures', readonly=True, help="Number of consecutive executions which failed"),
     }
 
     _defaults = {
@@ -71,7 +85,8 @@ class ir_cron(osv.osv, netsvc.Agent):
         'interval_type' : 'months',
         'numbercall' : 1,
         'active' : 1,
-        'doall' : 1
+        'doall' : 1,
+        'failures' : 0,
     }
 
     def _check_args(self, cr, uid, ids, context=None):
@@ -87,6 +102,8 @@ class ir_cron(osv.osv, netsvc.Agent):
     ]
 
     def _callback(self, cr, uid, model, func, args):
+        """ Calls the method of a job, returns the traceback of its failure
+            or False """
         args = str2tuple(args)
         m = self.pool.get(model)
         if m and hasattr(m, func):
@@ -96,49 +113,124 @@ class ir_cron(osv.osv, netsvc.Agent):
             except Exception, e:
                 cr.rollback()
                 self._logger.exception("Job call of self.pool.get('%s').%s(cr, uid, *%r) failed" % (model, func, args))
+                return traceback.format_exc()
+        return False
 
+    def _run_job(self, db_name, job_id):
+        """ Runs a due job, while holding a lock on its row so that no
+            other worker, or server, runs it meanwhile.
 
-    def _poolJobs(self, db_name, check=False):
-        try:
-            db, pool = pooler.get_db_and_pool(db_name)
-        except:
-            return False
-        cr = db.cursor()
+            The job itself runs in a cursor of its own, as it may commit.
+        """
         try:
-            if not pool._init:
-                now = datetime.now()
-                cr.execute('SELECT * FROM ir_cron '
-                        'WHERE numbercall<>0 AND active AND nextcall<=now() '
-                        'ORDER BY priority', debug=self._debug)
-                for job in cr.dictfetchall():
-                    nextcall = datetime.strptime(job['nextcall'], '%Y-%m-%d %H:%M:%S')
-                    numbercall = job['numbercall']
+            db = pooler.get_db(db_name)
+            lock_cr = db.cursor()
+            try:
+                try:
+                    lock_cr.execute('SELECT * FROM ir_cron '
+                            'WHERE id=%s AND numbercall<>0 AND active AND nextcall<=now() '
+                            'FOR UPDATE NOWAIT', (job_id,), debug=self._debug, log_exceptions=False)
+                except psycopg2.OperationalError, e:
+                    if e.pgcode != '55P03':     # lock_not_available
+                        raise
+                    self._logger.debug("Job %s of %s is being run by another process", job_id, db_name)
+                    return
+                job = lock_cr.dictfetchone()
+                if not job:
+                    # run meanwhile
+                    return
 
+                now = datetime.now()
+                start = time.time()
+                nextcall = datetime.strptime(job['nextcall'], '%Y-%m-%d %H:%M:%S')
+                numbercall = job['numbercall']
+                error = False
+                cr = db.cursor()
+                try:
                     ok = False
                     while nextcall < now and numbercall:
                         if numbercall > 0:
                             numbercall -= 1
                         if not ok or job['doall']:
-                            self._callback(cr, job['user_id'], job['model'], job['function'], job['args'])
+                            error = self._callback(cr, job['user_id'], job['model'], job['function'], job['args']) or error
                         if numbercall:
                             nextcall += _intervalTypes[job['interval_type']](job['interval_number'])
                         ok = True
-                    addsql = ''
-                    if not numbercall:
-                        addsql = ', active=False'
-                    cr.execute("UPDATE ir_cron "
-                                "SET nextcall=%s, numbercall=%s"+addsql+ \
-                                " WHERE id=%s", 
-                                (nextcall.strftime('%Y-%m-%d %H:%M:%S'), numbercall, job['id']),
-                                debug=self._debug)
                     cr.commit()
+                finally:
+                    cr.close()
+
+                addsql = ''
+                if not numbercall:
+                    addsql = ', active=False'
+                lock_cr.execute("UPDATE ir_cron "
+                            "SET nextcall=%s, numbercall=%s, lastcall=%s, last_duration=%s, "
+                            "last_error=%s, failures=%s"+addsql+ \
+                            " WHERE id=%s",
+                            (nextcall.strftime('%Y-%m-%d %H:%M:%S'), numbercall,
+                             now.strftime('%Y-%m-%d %H:%M:%S'), time.time() - start,
+                             error or None, error and (job['failures'] or 0) + 1 or 0,
+                             job['id']),
+                            debug=self._debug)
+                lock_cr.commit()
+            finally:
+                lock_cr.close()
+        except Exception:
+            self._logger.warning('Exception in cron:', exc_info=True)
+        finally:
+            _running_lock.acquire()
+            try:
+                _running.discard((db_name, job_id))
+            finally:
+                _running_lock.release()
+            _workers.release()
+            # the job has a new nextcall, and its worker is free for
+            # the jobs waiting for one
+            self.restart(db_name)
+
+    def _start_job(self, db_name, job_id):
+        """ Runs the job in a new thread, unless this process is running
+            it already, if a worker is available. Returns False if none is.
+        """
+        _running_lock.acquire()
+        try:
+            if (db_name, job_id) in _running:
+                return True
+            if not _workers.acquire(False):
+                return False
+            _running.add((db_name, job_id))
+        finally:
+            _running_lock.release()
+        thr = threading.Thread(target=self._run_job, args=(db_name, job_id),
+                               name='ir.cron %s %s' % (db_name, job_id))
+        thr.start()
+        return True
 
+    def _poolJobs(self, db_name, check=False):
+        try:
+            db, pool = pooler.get_db_and_pool(db_name)
+        except:
+            return False
+        cr = db.cursor()
+        try:
+            if not pool._init:
+                cr.execute('SELECT id FROM ir_cron '
+                        'WHERE numbercall<>0 AND active AND nextcall<=now() '
+                        'ORDER BY priority', debug=self._debug)
+                for job_id, in cr.fetchall():
+                    if not self._start_job(db_name, job_id):
+                        # the next job to complete will call us back
+                        break
 
             cr.execute('SELECT min(nextcall) AS min_next_call FROM ir_cron '
                         'WHERE numbercall<>0 AND active ', debug=self._debug)
             next_call = cr.dictfetchone()['min_next_call']
             if next_call:
                 next_call = time.mktime(time.strptime(next_call, '%Y-%m-%d %H:%M:%S'))
+                if next_call <= time.time():
+                    # the jobs still due are running, waiting for a worker
+                    # or locked by another server: check them again later
+                    next_call = time.time() + 60
             else:
                 next_call = int(time.time()) + 3600   # if do not find active cron job from database, it will run again after 1 day
 
@@ -153,7 +245,7 @@ class ir_cron(osv.osv, netsvc.Agent):
             cr.close()
 
     def restart(self, dbname):
-        self.cancel(dbname)
+        self.cancel(dbname, self._poolJobs)
         # Reschedule cron processing job asap, but not in the current thread
         self.setAlarm(self._poolJobs, time.time(), dbname, dbname)
 
@@ -830,6 +830,7 @@ class ir_model_data(osv.osv):
             res = ir.ir_set(cr, uid, key, key2, name, models, value, replace, isobject, meta)
         elif xml_id:
             cr.execute('UPDATE ir_values set value=%s WHERE model=%s and key=%s and name=%s'+where,(value, model, key, name))
+            self.pool.get('ir.values')._values_written(cr)
         return True
 
     def _process_end(self, cr, uid, modules):
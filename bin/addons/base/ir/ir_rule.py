@@ -80,7 +80,12 @@ class ir_rule(osv.osv):
         'perm_read': fields.boolean('Apply For Read'),
         'perm_write': fields.boolean('Apply For Write'),
         'perm_create': fields.boolean('Apply For Create'),
-        'perm_unlink': fields.boolean('Apply For Delete')
+        'perm_unlink': fields.boolean('Apply For Delete'),
+        'materialize': fields.boolean('Cache Sub-searches',
+                help="If checked, the ids resolved by the sub-searches of this "
+                    "rule's domain (eg. child_of, names of many2one records) are "
+                    "cached together with the compiled SQL, until any rule is "
+                    "modified. Only use it when the related records seldom change."),
     }
 
     _order = 'model_id DESC'
@@ -91,6 +96,7 @@ class ir_rule(osv.osv):
         'perm_create': True,
         'perm_unlink': True,
         'global': True,
+        'materialize': False,
     }
     _sql_constraints = [
         ('no_access_rights', 'CHECK (perm_read!=False or perm_write!=False or perm_create!=False or perm_unlink!=False)', 'Rule must have at least one checked access right !'),
@@ -145,6 +151,43 @@ class ir_rule(osv.osv):
         
         return dom
 
+    @tools.cache()
+    def _compile_domain(self, cr, uid, model_name, mode="read"):
+        """ Compile the domain of _compute_domain() into SQL, for caching
+
+            Returns (where_clause, clause_params, tables), or None if the
+            SQL depends on sub-searches (which would resolve to different
+            ids when the data changes) and not all of the rules involved
+            are marked to be materialized.
+        """
+        dom = self._compute_domain(cr, uid, model_name, mode=mode)
+        if not dom:
+            return [], [], ['"'+self.pool.get(model_name)._table+'"']
+        qcount = cr.query_count
+        query = self.pool.get(model_name)._where_calc(cr, 1, dom, active_test=False)
+        if cr.query_count != qcount:
+            # Some sub-search hit the db, the result is only safe to keep
+            # if all the rules allow so
+            cr.execute("""SELECT bool_and(r.materialize)
+                FROM ir_rule r
+                    JOIN ir_model m ON (r.model_id = m.id)
+                WHERE m.model = %s
+                AND r.perm_""" + mode + """
+                AND (r.global OR EXISTS (SELECT 1
+                            FROM rule_group_rel g_rel
+                                JOIN res_groups_users_rel u_rel
+                                    ON (g_rel.group_id = u_rel.gid)
+                            WHERE g_rel.rule_group_id = r.id
+                                AND u_rel.uid = %s))
+                """, (model_name, uid), debug=self._debug)
+            if not cr.fetchone()[0]:
+                return None
+        return query.where_clause, query.where_clause_params, query.tables
+
+    def _clear_domain_cache(self, dbname, *args):
+        self._compute_domain.clear_cache(dbname, *args)
+        self._compile_domain.clear_cache(dbname, *args)
+
     def clear_cache(self, cr, uid):
         cr.execute("""SELECT DISTINCT m.model
                         FROM ir_rule r
@@ -159,7 +202,7 @@ class ir_rule(osv.osv):
                                         AND u_rel.uid = %s)
                     """, (uid,))
         models = map(itemgetter(0), cr.fetchall())
-        clear = partial(self._compute_domain.clear_cache, cr.dbname, uid)
+        clear = partial(self._clear_domain_cache, cr.dbname, uid)
         [clear(model, mode) for model in models for mode in self._MODES]
 
     def domain_get(self, cr, uid, model_name, mode='read', context=None):
@@ -169,6 +212,12 @@ class ir_rule(osv.osv):
             If needed, tables will contain any tables (including one for the
             model_name) needed in the FROM expression
         """
+        compiled = self._compile_domain(cr, uid, model_name, mode=mode)
+        if compiled is not None:
+            # copies, because callers are free to extend the lists
+            where_clause, where_params, tables = compiled
+            return list(where_clause), list(where_params), list(tables)
+
         dom = self._compute_domain(cr, uid, model_name, mode=mode)
         if dom:
             # _where_calc is called as superuser. This means that rules can
@@ -182,19 +231,19 @@ class ir_rule(osv.osv):
     def unlink(self, cr, uid, ids, context=None):
         res = super(ir_rule, self).unlink(cr, uid, ids, context=context)
         # Restart the cache on the _compute_domain method of ir.rule
-        self._compute_domain.clear_cache(cr.dbname)
+        self._clear_domain_cache(cr.dbname)
         return res
 
     def create(self, cr, user, vals, context=None):
         res = super(ir_rule, self).create(cr, user, vals, context=context)
         # Restart the cache on the _compute_domain method of ir.rule
-        self._compute_domain.clear_cache(cr.dbname)
+        self._clear_domain_cache(cr.dbname)
         return res
 
     def write(self, cr, uid, ids, vals, context=None):
         res = super(ir_rule, self).write(cr, uid, ids, vals, context=context)
         # Restart the cache on the _compute_domain method
-        self._compute_domain.clear_cache(cr.dbname)
+        self._clear_domain_cache(cr.dbname)
         return res
 
 ir_rule()
@@ -54,7 +54,13 @@ class ir_sequence(osv.osv):
         'padding' : fields.integer('Number padding', required=True, help="OpenERP will automatically adds some '0' on the left of the 'Next Number' to get the required padding size."),
         'company_id': fields.many2one('res.company', 'Company'),
         'condition': fields.char('Condition', size=250, help="If set, sequence will only be used in case this python expression matches, and will precede other sequences."),
-        'weight': fields.integer('Weight',required=True, help="If two sequences match, the highest weight will be used.")
+        'weight': fields.integer('Weight',required=True, help="If two sequences match, the highest weight will be used."),
+        'implementation': fields.selection([('no_gap', 'No gap'), ('standard', 'Standard')],
+            'Implementation', required=True,
+            help="With 'No gap', the numbers are taken in the transaction which uses "
+                 "them, which must complete before the next number can be taken. "
+                 "'Standard' takes them from a PostgreSQL sequence, without waiting, "
+                 "but the numbers of the transactions which fail are lost."),
     }
     _defaults = {
         'active': True,
@@ -63,8 +69,99 @@ class ir_sequence(osv.osv):
         'number_next': 1,
         'padding': 0,
         'weight': 10,
+        'implementation': 'no_gap',
     }
 
+    def _sequence_name(self, id):
+        return 'ir_sequence_%03d' % id
+
+    def _create_sequence(self, cr, id, number_increment, number_next):
+        cr.execute('CREATE SEQUENCE %s INCREMENT BY %%s START WITH %%s' % self._sequence_name(id),
+                   (number_increment, number_next))
+
+    def _alter_sequence(self, cr, id, number_increment, number_next=None):
+        query = 'ALTER SEQUENCE %s INCREMENT BY %%s' % self._sequence_name(id)
+        params = [number_increment]
+        if number_next is not None:
+            query += ' RESTART WITH %s'
+            params.append(number_next)
+        cr.execute(query, params)
+
+    def _drop_sequence(self, cr, id):
+        cr.execute('DROP SEQUENCE IF EXISTS %s' % self._sequence_name(id))
+
+    def _next_in_sequence(self, cr, id, number_increment):
+        """ The number that nextval() would return, without taking it.
+            The increment is the one of the ir_sequence row, which the
+            sequence is created and altered with: PostgreSQL 10 no longer
+            has it in the sequence relation. """
+        cr.execute('SELECT last_value, is_called FROM %s' % self._sequence_name(id))
+        last_value, is_called = cr.fetchone()
+        if is_called:
+            return last_value + number_increment
+        return last_value
+
+    def create(self, cr, uid, values, context=None):
+        res_id = super(ir_sequence, self).create(cr, uid, values, context=context)
+        cr.execute('SELECT implementation, number_increment, number_next FROM ir_sequence WHERE id=%s', (res_id,))
+        implementation, number_increment, number_next = cr.fetchone()
+        if implementation == 'standard':
+            self._create_sequence(cr, res_id, number_increment, number_next)
+        return res_id
+
+    def read(self, cr, uid, ids, fields=None, context=None, load='_classic_read'):
+        res = super(ir_sequence, self).read(cr, uid, ids, fields, context=context, load=load)
+        if fields and 'number_next' not in fields:
+            return res
+        # number_next is not kept up to date by the standard sequences
+        rows = isinstance(res, dict) and [res] or res
+        if rows:
+            cr.execute("SELECT id, number_increment FROM ir_sequence WHERE id IN %s AND implementation='standard'",
+                       (tuple(row['id'] for row in rows),))
+            increments = dict(cr.fetchall())
+            for row in rows:
+                if row['id'] in increments:
+                    row['number_next'] = self._next_in_sequence(cr, row['id'], increments[row['id']])
+        return res
+
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ('implementation' in values or 'number_next' in values \
+                or 'number_increment' in values):
+            return super(ir_sequence, self).write(cr, uid, ids, values, context=context)
+        rows = self.read(cr, uid, ids, ['implementation', 'number_increment', 'number_next'], context=context)
+        res = super(ir_sequence, self).write(cr, uid, ids, values, context=context)
+        new_implementation = values.get('implementation')
+        for row in rows:
+            number_increment = values.get('number_increment', row['number_increment'])
+            number_next = values.get('number_next', row['number_next'])
+            if row['implementation'] == 'standard':
+                if new_implementation in (None, 'standard'):
+                    if number_next == row['number_next']:
+                        # left as it is, do not restart the sequence
+                        number_next = None
+                    self._alter_sequence(cr, row['id'], number_increment, number_next)
+                else:
+                    # carry on from the number reached by the sequence
+                    cr.execute('UPDATE ir_sequence SET number_next=%s WHERE id=%s',
+                               (number_next, row['id']))
+                    self._drop_sequence(cr, row['id'])
+            elif new_implementation == 'standard':
+                self._create_sequence(cr, row['id'], number_increment, number_next)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        cr.execute("SELECT id FROM ir_sequence WHERE id IN %s AND implementation='standard'",
+                   (tuple(ids),))
+        standard_ids = [x[0] for x in cr.fetchall()]
+        res = super(ir_sequence, self).unlink(cr, uid, ids, context=context)
+        for id in standard_ids:
+            self._drop_sequence(cr, id)
+        return res
+
     def _process(self, s):
         if not s:
             return ''
@@ -97,7 +194,9 @@ class ir_sequence(osv.osv):
         log = logging.getLogger('orm')
         try:
             sql_test = self._get_test(test, context)
-            cr.execute("""SELECT id, number_next, prefix, suffix, padding, condition
+            # the candidates are not locked: only the sequence picked is,
+            # and only if it is gapless
+            cr.execute("""SELECT id, number_next, prefix, suffix, padding, condition, implementation
                 FROM ir_sequence
                 WHERE """ + sql_test + """
                   AND active=%s
@@ -110,7 +209,7 @@ class ir_sequence(osv.osv):
                                         WHERE user_id = %s
                                         ))
                 ORDER BY company_id, weight DESC, length(COALESCE(condition,'')) DESC
-                FOR UPDATE """, (sequence_id, True, uid, uid), debug=self._debug)
+                """, (sequence_id, True, uid, uid), debug=self._debug)
             for res in cr.dictfetchall():
                 if res['condition']:
                     if self._debug:
@@ -133,11 +232,25 @@ class ir_sequence(osv.osv):
                     if self._debug:
                         log.debug('ir_seq: %d matched' % res['id'])
 
-                cr.execute('UPDATE ir_sequence '
-                        'SET number_next=number_next+number_increment '
-                        'WHERE id=%s AND active=%s', 
-                        (res['id'], True),
-                        debug=self._debug)
+                if res['implementation'] == 'standard':
+                    cr.execute("SELECT nextval('%s')" % self._sequence_name(res['id']),
+                               debug=self._debug)
+                    res['number_next'] = cr.fetchone()[0]
+                else:
+                    cr.execute('SELECT number_next FROM ir_sequence '
+                            'WHERE id=%s AND active=%s FOR UPDATE',
+                            (res['id'], True),
+                            debug=self._debug)
+                    row = cr.fetchone()
+                    if not row:
+                        # deactivated meanwhile
+                        continue
+                    res['number_next'] = row[0]
+                    cr.execute('UPDATE ir_sequence '
+                            'SET number_next=number_next+number_increment '
+                            'WHERE id=%s AND active=%s', 
+                            (res['id'], True),
+                            debug=self._debug)
                 if res['number_next']:
                     return self._process(res['prefix']) + '%%0%sd' % res['padding'] % res['number_next'] + self._process(res['suffix'])
                 else:
@@ -53,50 +53,113 @@ class ir_ui_menu(osv.osv):
            visible in the menu hierarchy of the current user.
            Uses a cache for speeding up the computation.
         """
-        modelaccess = self.pool.get('ir.model.access')
-        user_groups = set(self.pool.get('res.users').read(cr, 1, uid, ['groups_id'])['groups_id'])
-        result = []
-        for menu in self.browse(cr, uid, ids, context=context):
-            # this key works because user access rights are all based on user's groups (cfr ir_model_access.check)
-            key = (cr.dbname, menu.id, tuple(user_groups))
-            if key in self._cache:
-                if self._cache[key]:
-                    result.append(menu.id)
-                #elif not menu.groups_id and not menu.action:
-                #    result.append(menu.id)
+        user_groups = self.pool.get('res.users').read(cr, 1, uid, ['groups_id'])['groups_id']
+        # this key works because user access rights are all based on user's
+        # groups (cfr ir_model_access.check), except for the superuser
+        key = (cr.dbname, tuple(sorted(user_groups)), uid == 1)
+        visible = self._cache.setdefault(key, {})
+        todo = [id for id in ids if id not in visible]
+        if todo:
+            self._compute_visible_menus(cr, uid, todo, set(user_groups), visible, context=context)
+        return [id for id in ids if visible[id]]
+
+    def _compute_visible_menus(self, cr, uid, ids, user_groups, visible, context=None):
+        """Adds to visible ({menu id: whether it is visible to the user})
+           the menus ids, and the descendants their visibility depends on.
+           The folders are only visible if one of their children is, so
+           the menus are computed level by level down the folders, then
+           the folders bottom-up.
+        """
+        own = {}
+        children = {}
+        todo = ids
+        while todo:
+            own.update(self._compute_own_visibility(cr, uid, todo, user_groups, context=context))
+            folder_ids = [id for id in todo if own[id] is None]
+            todo = []
+            if folder_ids:
+                cr.execute('SELECT parent_id, id FROM ir_ui_menu WHERE parent_id IN %s', (tuple(folder_ids),))
+                for parent_id, id in cr.fetchall():
+                    children.setdefault(parent_id, []).append(id)
+                    if id not in visible and id not in own:
+                        todo.append(id)
+
+        def is_visible(id):
+            if id not in visible:
+                if own[id] is None:
+                    # hidden until a child is found visible
+                    visible[id] = False
+                    visible[id] = any([is_visible(child) for child in children.get(id, [])])
+                else:
+                    visible[id] = own[id]
+            return visible[id]
+        for id in own:
+            is_visible(id)
+
+    def _compute_own_visibility(self, cr, uid, ids, user_groups, context=None):
+        """Returns a dict {menu id: whether it is visible to the user},
+           computed for all the menus at once: the ones restricted to groups
+           of which the user is not a member are hidden, and so are the ones
+           whose action is on a model the user cannot read. The visibility
+           of the folders, which depends on their children, is None.
+        """
+        result = dict.fromkeys(ids, True)
+
+        cr.execute('SELECT menu_id, gid FROM ir_ui_menu_group_rel WHERE menu_id IN %s', (tuple(ids),))
+        restricted = {}
+        for menu_id, gid in cr.fetchall():
+            restricted[menu_id] = restricted.get(menu_id, False) or gid in user_groups
+        for menu_id, allowed in restricted.iteritems():
+            if not allowed:
+                result[menu_id] = False
+
+        todo = [id for id in ids if result[id]]
+        if not todo:
+            return result
+
+        # the actions, by model of action
+        actions = self._action(cr, uid, todo, 'action', None, context=context)
+        action_ids = {}
+        for menu_id, action in actions.iteritems():
+            if action:
+                action_model, action_id = action.split(',')
+                action_ids.setdefault(action_model, {}).setdefault(int(action_id), []).append(menu_id)
+
+        for id in todo:
+            if not actions.get(id):
+                result[id] = None
+
+        # the models of the actions, and the menus which open them
+        model_field = { 'ir.actions.act_window':    'res_model',
+                        'ir.actions.report.xml':    'model',
+                        'ir.actions.wizard':        'model',
+                        'ir.actions.server':        'model_id',
+                      }
+        model_menus = {}
+        for action_model, menus_by_action in action_ids.iteritems():
+            field = model_field.get(action_model)
+            if not field:
                 continue
+            action_obj = self.pool.get(action_model)
+            for data in action_obj.read(cr, uid, menus_by_action.keys(), [field], context=context):
+                model = data[field]
+                if isinstance(model, (list, tuple)):
+                    # many2one to ir.model
+                    model = model[0]
+                if model:
+                    model_menus.setdefault(model, []).extend(menus_by_action[data['id']])
+
+        # ir.model ids, for the server actions
+        model_ids = [m for m in model_menus if isinstance(m, (int, long))]
+        if model_ids:
+            for data in self.pool.get('ir.model').read(cr, uid, model_ids, ['model'], context=context):
+                model_menus.setdefault(data['model'], []).extend(model_menus.pop(data['id']))
 
-            self._cache[key] = False
-            if menu.groups_id:
-                restrict_to_groups = [g.id for g in menu.groups_id]
-                if not user_groups.intersection(restrict_to_groups):
-                    continue
-                #result.append(menu.id)
-                #self._cache[key] = True
-                #continue
-
-            if menu.action:
-                # we check if the user has access to the action of the menu
-                data = menu.action
-                if data:
-                    model_field = { 'ir.actions.act_window':    'res_model',
-                                    'ir.actions.report.xml':    'model',
-                                    'ir.actions.wizard':        'model',
-                                    'ir.actions.server':        'model_id',
-                                  }
-
-                    field = model_field.get(menu.action._name)
-                    if field and data[field]:
-                        if not modelaccess.check(cr, uid, data[field], raise_exception=False):
-                            continue
-            else:
-                # if there is no action, it's a 'folder' menu
-                if not menu.child_id:
-                    # not displayed if there is no children
-                    continue
-
-            result.append(menu.id)
-            self._cache[key] = True
+        modelaccess = self.pool.get('ir.model.access')
+        for model, menu_ids in model_menus.iteritems():
+            if not modelaccess.check(cr, uid, model, raise_exception=False):
+                for menu_id in menu_ids:
+                    result[menu_id] = False
         return result
 
     def search(self, cr, uid, args, offset=0, limit=None, order=None, context=None, count=False):
@@ -19,9 +19,13 @@
 #
 ##############################################################################
 
+import copy
+import weakref
 from osv import osv,fields
 from osv.orm import except_orm
 import pickle
+import tools
+from tools.lru import LRU
 from tools.translate import _
 
 EXCLUDED_FIELDS = set((
@@ -32,6 +36,26 @@ class ir_values(osv.osv):
     _name = 'ir.values'
     _function_field_browse = True
 
+    def __init__(self, *args, **kwargs):
+        # cursors of the transactions which changed ir.values, see get()
+        self._writers = weakref.WeakKeyDictionary()
+        self._cache_generation = 0
+        self.clear_cache()
+        r = super(ir_values, self).__init__(*args, **kwargs)
+        self.pool.get('ir.model.access').register_cache_clearing_method(self._name, 'clear_cache')
+        return r
+
+    def clear_cache(self):
+        # the values found by get(), already unpickled
+        self._cache = LRU(int(tools.config.get_misc('ir_values', 'cache_size', 2048)))
+        self._cache_generation += 1
+
+    def _values_written(self, cr):
+        """ ir.values changed in the transaction of cr: the cache is
+            cleared, and not filled again until the transaction is over """
+        self._writers[cr] = True
+        self.clear_cache()
+
     def _value_unpickle(self, cursor, user, ids, name, arg, context=None):
         res = {}
         for report in self.browse(cursor, user, ids, context=context):
@@ -152,9 +176,24 @@ class ir_values(osv.osv):
             ids_res.append(self.create(cr, uid, vals, context={'__ignore_ir_values': True}))
         return ids_res
 
-    def get(self, cr, uid, key, key2, models, meta=False, context=None, res_id_req=False, without_user=True, key2_req=True):
+    def create(self, cr, *args, **kwargs):
+        self._values_written(cr)
+        return super(ir_values, self).create(cr, *args, **kwargs)
+
+    def write(self, cr, *args, **kwargs):
+        self._values_written(cr)
+        return super(ir_values, self).write(cr, *args, **kwargs)
+
+    def unlink(self, cr, *args, **kwargs):
+        self._values_written(cr)
+        return super(ir_values, self).unlink(cr, *args, **kwargs)
+
+    def _get_values(self, cr, uid, key, key2, models, meta, res_id_req, key2_req):
+        """ The values of the first model which has some, for get(), with
+            a single value per name: (id, name, value, object, meta), where
+            value and meta are unpickled, except the value of objects.
+        """
         result = []
-        assert isinstance(models, (list, tuple)), models
 
         for m in models:
             if isinstance(m, (list, tuple)):
@@ -195,13 +234,40 @@ class ir_values(osv.osv):
             if result:
                 break
 
+        values = []
+        keys = set()
+        for id, name, value, isobject, meta_value, dummy in result:
+            if name in keys:
+                continue
+            keys.add(name)
+            if not isobject:
+                value = pickle.loads(value.encode('utf-8'))
+            if meta:
+                meta_value = pickle.loads(meta_value)
+            values.append((id, name, value, isobject, meta_value))
+        return values
+
+    def get(self, cr, uid, key, key2, models, meta=False, context=None, res_id_req=False, without_user=True, key2_req=True):
+        assert isinstance(models, (list, tuple)), models
+
+        cache_key = (uid, key, key2,
+                     tuple([isinstance(m, list) and tuple(m) or m for m in models]),
+                     bool(meta), bool(res_id_req), bool(key2_req))
+        generation = self._cache_generation
+        try:
+            result = self._cache[cache_key]
+        except KeyError:
+            result = self._get_values(cr, uid, key, key2, models, meta, res_id_req, key2_req)
+            # while a transaction which changed ir.values is in progress,
+            # the values found may be its changes, which it could roll
+            # back, or the ones it replaces, once it commits
+            if not self._writers and generation == self._cache_generation:
+                self._cache[cache_key] = result
+
         if not result:
             return []
 
-        def _result_get(x, keys):
-            if x[1] in keys:
-                return False
-            keys.append(x[1])
+        def _result_get(x):
             if x[3]:
                 model,id = x[2].split(',')
                 # FIXME: It might be a good idea to opt-in that kind of stuff
@@ -225,20 +291,22 @@ class ir_values(osv.osv):
                     # rather than [id, name] (of many2one fields)
                     datas['search_view_id'] = datas['search_view_id'][0]
             else:
-                datas = pickle.loads(x[2].encode('utf-8'))
+                # the cached values must not be altered by the callers
+                datas = copy.deepcopy(x[2])
             if meta:
-                return (x[0], x[1], datas, pickle.loads(x[4]))
+                return (x[0], x[1], datas, copy.deepcopy(x[4]))
             return (x[0], x[1], datas)
-        keys = []
-        res = filter(None, map(lambda x: _result_get(x, keys), result))
+        res = filter(None, map(_result_get, result))
         res2 = res[:]
+        user_groups = None
         for r in res:
             if isinstance(r[2], dict) and r[2].get('type') in ('ir.actions.report.xml','ir.actions.act_window','ir.actions.wizard'):
                 groups = r[2].get('groups_id')
-                if groups: #TODO: optimize, perhaps get all groups and process pythonic
-                    cr.execute('SELECT COUNT(1) FROM res_groups_users_rel WHERE gid = ANY(%s) AND uid=%s',(groups, uid), debug=self._debug)
-                    cnt = cr.fetchone()[0]
-                    if not cnt:
+                if groups:
+                    if user_groups is None:
+                        cr.execute('SELECT gid FROM res_groups_users_rel WHERE uid=%s', (uid,), debug=self._debug)
+                        user_groups = set(x[0] for x in cr.fetchall())
+                    if not user_groups.intersection(groups):
                         res2.remove(r)
                     if r[1] == 'Menuitem' and not res2:
                         raise osv.except_osv('Error !','You do not have the permission to perform this operation!')
@@ -76,7 +76,7 @@ class res_partner_category(osv.osv):
         'active' : fields.boolean('Active', required=True, help="The active field allows you to hide the category without removing it."),
     }
     _constraints = [
-        (osv.osv._check_recursion, 'Error ! You can not create recursive categories.', ['parent_id'])
+        (osv.osv._check_recursion, 'Error ! You can not create recursive categories.', ['parent_id'], True)
     ]
     _defaults = {
         'active': True,
@@ -285,7 +285,7 @@ class res_company(osv.osv):
     }
 
     _constraints = [
-        (osv.osv._check_recursion, 'Error! You can not create recursive companies.', ['parent_id'])
+        (osv.osv._check_recursion, 'Error! You can not create recursive companies.', ['parent_id'], True)
     ]
 
 res_company()
@@ -36,6 +36,7 @@ from pprint import pformat
 import warnings
 import types
 import heapq
+import Queue
 
 #.apidoc title: Common Services: netsvc
 #.apidoc module-mods: member-order: bysource
@@ -493,126 +494,258 @@ class Agent(object):
 
         Implementation details:
         
-          - Tasks are stored as list, allowing the cancellation by setting
-            the timestamp to 0.
-          - A heapq is used to store tasks, so we don't need to sort
-            tasks ourself.
+          - A heapq of (timestamp, sequence, task) is used to store the
+            tasks, so we don't need to sort them ourself. The sequence
+            keeps the tasks of a same timestamp in their order, and
+            makes the tasks themselves never compared.
+          - Tasks are stored as lists, and indexed by database, allowing
+            their cancellation by setting their timestamp to 0. They are
+            dropped when they reach the top of the heap, or when more
+            than half of the heap is cancelled.
+          - The runner thread sleeps until the next timestamp, and hands
+            the due tasks to a pool of at most [agent] workers threads
+            (4 by default), started on demand and reused.
     """
     __tasks = []
     __tasks_by_db = {}
+    __cancelled = 0
+    __sequence = 0
     _logger = logging.getLogger('netsvc.agent')
     _lock = threading.Condition()
     _alive = True
+    _runner = None
+
+    _queue = Queue.Queue()
+    _workers = []
+    _idle_workers = 0
+    # read when the first worker starts, tools.config may not exist yet
+    # when this module is imported
+    _max_workers = None
 
     @classmethod
     def setAlarm(cls, function, timestamp, db_name, *args, **kwargs):
+        """ Schedules function(*args, **kwargs) at timestamp, returns the
+            task, which can be given to cancelAlarm()
+        """
+        cls._lock.acquire()
+        try:
+            cls.__sequence += 1
+            task = [timestamp, db_name, function, args, kwargs, cls.__sequence]
+            heapq.heappush(cls.__tasks, (timestamp, cls.__sequence, task))
+            cls.__tasks_by_db.setdefault(db_name, {})[cls.__sequence] = task
+            if cls._runner is None:
+                cls._start_runner()
+            elif cls.__tasks[0][2] is task:
+                # it is the next to run, wake the runner up
+                cls._lock.notify_all()
+        finally:
+            cls._lock.release()
+        return task
+
+    @classmethod
+    def _start_runner(cls):
+        """ Starts the runner thread, with the first task, so that no thread
+            runs before the server has started its processes. The lock must
+            be held """
+        cls._runner = threading.Thread(target=cls.runner, name="netsvc.Agent.runner")
+        # the agent runner is a typical daemon thread, that will never quit
+        # and must be terminated when the main process exits - with no
+        # consequence (the tasks being run by the workers are waited for by
+        # quit())
+        cls._runner.setDaemon(True)
+        cls._runner.start()
+
+    @classmethod
+    def _drop(cls, task):
+        """ Cancels a task, the lock must be held """
+        if task[0]:
+            task[0] = 0
+            cls.__cancelled += 1
+            by_db = cls.__tasks_by_db.get(task[1])
+            if by_db is not None:
+                by_db.pop(task[5], None)
+                if not by_db:
+                    del cls.__tasks_by_db[task[1]]
+
+    @classmethod
+    def _compact(cls):
+        """ Removes the cancelled tasks from the heap, when they are the
+            majority of it, the lock must be held """
+        if cls.__cancelled * 2 > len(cls.__tasks):
+            cls.__tasks = [t for t in cls.__tasks if t[2][0]]
+            heapq.heapify(cls.__tasks)
+            cls.__cancelled = 0
+
+    @classmethod
+    def cancelAlarm(cls, task):
+        """ Cancels a task returned by setAlarm(), if it has not run yet """
         cls._lock.acquire()
-        task = [timestamp, db_name, function, args, kwargs]
-        heapq.heappush(cls.__tasks, task)
-        cls.__tasks_by_db.setdefault(db_name, []).append(task)
-        cls._lock.notify_all()
-        cls._lock.release()
+        try:
+            cls._drop(task)
+            cls._compact()
+        finally:
+            cls._lock.release()
+
+    @staticmethod
+    def cancelled(task):
+        """ Tells whether a task returned by setAlarm() has been cancelled """
+        return not task[0]
 
     @classmethod
-    def cancel(cls, db_name):
-        """Cancel all tasks for a given database. If None is passed, all tasks are cancelled"""
+    def cancel(cls, db_name, function=None):
+        """Cancel all tasks for a given database. If None is passed, all tasks are cancelled
+        
+           If function is given, only the tasks calling that function are
+           cancelled. Methods match whatever instance they are bound to.
+        """
         cls._logger.debug("Cancel timers for %s db", db_name or 'all')
+        function = getattr(function, 'im_func', function)
         cls._lock.acquire()
         try:
             if db_name is None:
+                for _, _, task in cls.__tasks:
+                    task[0] = 0
                 cls.__tasks, cls.__tasks_by_db = [], {}
-            else:
-                if db_name in cls.__tasks_by_db:
-                    for task in cls.__tasks_by_db[db_name]:
-                        task[0] = 0
+                cls.__cancelled = 0
+            elif db_name in cls.__tasks_by_db:
+                for task in cls.__tasks_by_db[db_name].values():
+                    if function is None or \
+                            getattr(task[2], 'im_func', task[2]) is function:
+                        cls._drop(task)
+                cls._compact()
         finally:
             cls._lock.notify_all()
             cls._lock.release()
 
     @classmethod
     def quit(cls):
+        """ Stops the runner, and the workers once they have completed
+            the tasks they are running """
         cls._alive = False
         cls.cancel(None)
+        cls._lock.acquire()
+        try:
+            workers = list(cls._workers)
+        finally:
+            cls._lock.release()
+        for worker in workers:
+            cls._queue.put(None)
+        for worker in workers:
+            if worker is not threading.currentThread():
+                worker.join()
 
     @classmethod
-    def runner(cls):
-        """Neverending function (intended to be ran in a dedicated thread) that
-           checks every 60 seconds tasks to run. TODO: make configurable
+    def _pretty_args(cls, args, kwargs, trunc=None):
+        """ Format the arguments like we would write them at python
+            Truncate at {trunc} chars
         """
-        def pretty_args(args, kwargs, trunc=None):
-            """ Format the arguments like we would write them at python
-                Truncate at {trunc} chars
-            """
-            oout = []
-            olen = 0
-            if args:
-                for arg in args:
-                    try:
-                        ostr = repr(arg)
-                    except Exception:
-                        ostr = '<???>'
-                    if trunc and (olen >= trunc):
-                        break
-                    oout.append(ostr)
-                    olen += len(ostr) + 2
-            
-            if kwargs:
-                for kw, val in kwargs.items():
-                    if trunc and (olen >= trunc):
-                        break
-                    try:
-                        ostr = "%s=%r" %(kw, val)
-                    except Exception:
-                        ostr = "%s=??" % kw
-                    oout.append(ostr)
-                    olen += len(ostr) + 2
-
-            if trunc and (olen >= trunc):
-                oout += '...'
+        oout = []
+        olen = 0
+        if args:
+            for arg in args:
+                try:
+                    ostr = repr(arg)
+                except Exception:
+                    ostr = '<???>'
+                if trunc and (olen >= trunc):
+                    break
+                oout.append(ostr)
+                olen += len(ostr) + 2
         
-            return ', '.join(oout)
+        if kwargs:
+            for kw, val in kwargs.items():
+                if trunc and (olen >= trunc):
+                    break
+                try:
+                    ostr = "%s=%r" %(kw, val)
+                except Exception:
+                    ostr = "%s=??" % kw
+                oout.append(ostr)
+                olen += len(ostr) + 2
+
+        if trunc and (olen >= trunc):
+            oout += '...'
+    
+        return ', '.join(oout)
 
-        while cls._alive:
+    @classmethod
+    def _worker(cls):
+        """ Runs the tasks handed by the runner, until given None """
+        while True:
             cls._lock.acquire()
-            while cls.__tasks and cls.__tasks[0][0] < time.time():
-                task = heapq.heappop(cls.__tasks)
-                timestamp, dbname, function, args, kwargs = task
-                # dbname will be picked by the logger's stack inspection
-                cls.__tasks_by_db[dbname].remove(task)
-
-                if not timestamp:
-                    # null timestamp -> cancelled task
-                    continue
-                cls._lock.release()
+            cls._idle_workers += 1
+            cls._lock.release()
+            task = cls._queue.get()
+            cls._lock.acquire()
+            cls._idle_workers -= 1
+            cls._lock.release()
+            if task is None:
+                break
+            timestamp, dbname, function, args, kwargs = task[:5]
+            if cls._logger.isEnabledFor(logging.DEBUG):
                 cls._logger.debug("Run %s.%s(%s)",
-                                function.im_class.__name__, function.func_name,
-                                pretty_args(args, kwargs, 120))
-                thr = threading.Thread(target=function, args=args, kwargs=kwargs)
-                thr.setDaemon(True)
-                thr.start()
-                time.sleep(1)
-                thr = None
-                cls._lock.acquire()
-            
-            # This line must have the lock in acquired state
-            wtime = 600.0
-            if cls.__tasks:
-                wtime = cls.__tasks[0][0] - time.time()
-                if wtime < 1.0:
-                    wtime = 1.0
-                elif wtime > 600.0:
-                    wtime = 600.0
-            cls._logger.debug("sleeping for %.3f seconds", wtime)
-            cls._lock.wait(wtime)
+                                getattr(function, 'im_class', function).__name__,
+                                function.__name__,
+                                cls._pretty_args(args, kwargs, 120))
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                cls._logger.exception("Task %s failed", function.__name__)
+            task = function = args = kwargs = None
+        cls._lock.acquire()
+        try:
+            cls._workers.remove(threading.currentThread())
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def _hand_over(cls, task):
+        """ Gives the task to an idle worker, starting a new one if there
+            is none and there is room for it. The lock must be held """
+        cls._queue.put(task)
+        if cls._max_workers is None:
+            cls._max_workers = max(int(tools.config.get_misc('agent', 'workers', 4)), 1)
+        if cls._queue.qsize() > cls._idle_workers \
+                and len(cls._workers) < cls._max_workers:
+            worker = threading.Thread(target=cls._worker,
+                                      name="netsvc.Agent.worker-%d" % len(cls._workers))
+            # idle workers must not prevent the process from exiting, but
+            # quit() waits for the tasks being run
+            worker.setDaemon(True)
+            cls._workers.append(worker)
+            worker.start()
+        # otherwise the task waits for the first worker available
+
+    @classmethod
+    def runner(cls):
+        """Neverending function (intended to be ran in a dedicated thread)
+           that sleeps until the next task is due, and hands it over to
+           the workers
+        """
+        cls._lock.acquire()
+        try:
+            while cls._alive:
+                while cls.__tasks and cls.__tasks[0][0] <= time.time():
+                    task = heapq.heappop(cls.__tasks)[2]
+                    if not task[0]:
+                        # null timestamp -> cancelled task
+                        cls.__cancelled -= 1
+                        continue
+                    by_db = cls.__tasks_by_db[task[1]]
+                    del by_db[task[5]]
+                    if not by_db:
+                        del cls.__tasks_by_db[task[1]]
+                    cls._hand_over(task)
+
+                if cls.__tasks:
+                    wtime = cls.__tasks[0][0] - time.time()
+                else:
+                    wtime = None
+                cls._lock.wait(wtime)
+        finally:
             cls._lock.release()
         cls._logger.debug("thread ended")
 
-agent_runner = threading.Thread(target=Agent.runner, name="netsvc.Agent.runner")
-# the agent runner is a typical daemon thread, that will never quit and must be
-# terminated when the main process exits - with no consequence (the processing
-# threads it spawns are not marked daemon)
-agent_runner.setDaemon(True)
-agent_runner.start()
 
 import traceback
 
@@ -832,6 +965,13 @@ def replace_request_password(args):
         args[2] = '*'
     return args
 
+def profile_label(service_name, method, params):
+    """ The name of a RPC request in the profiles """
+    label = '%s.%s' % (service_name, method)
+    if service_name == 'object' and len(params) > 4:
+        label += ' %s.%s' % (params[3], params[4])
+    return label
+
 class OpenERPDispatcher:
     def log(self, title, msg):
         logger = logging.getLogger(title)
@@ -845,7 +985,8 @@ class OpenERPDispatcher:
             self.log('method', method)
             self.log('params', replace_request_password(params))
             auth = getattr(self, 'auth_proxy', None)
-            result = ExportService.getService(service_name).dispatch(method, auth, params)
+            result = tools.profiler.profile_call(profile_label(service_name, method, params),
+                    ExportService.getService(service_name).dispatch, method, auth, params)
             self.log('result', result)
             # We shouldn't marshall None,
             if result == None:
@@ -885,7 +1026,8 @@ class OpenERPDispatcher2:
             auth = getattr(self, 'auth_proxy', None)
             if not auth:
                 self._logger.warn("No Authentication!")
-            result = ExportService.getService(service_name).new_dispatch(method, auth, params)
+            result = tools.profiler.profile_call(profile_label(service_name, method, params),
+                    ExportService.getService(service_name).new_dispatch, method, auth, params)
             log('result', result)
             # We shouldn't marshall None,
             if result == None:
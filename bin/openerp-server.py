@@ -156,6 +156,10 @@ import service
 
 import addons
 
+# the report processes are forked before any thread is started
+import report.report_sxw
+report.report_sxw.start_pdf_workers()
+
 #----------------------------------------------------------
 # Load and update databases if requested
 #----------------------------------------------------------
@@ -85,6 +85,25 @@ def _symbol_set_long(symb):
     return long(symb)
 
 
+def _command_runs(values):
+    """ Group the command tuples written to a one2many or many2many field
+        into runs of consecutive commands of the same kind (and, for (1, ID,
+        { fields }), with the same values), so that each run can be applied
+        at once with the same result as one by one.
+
+        @return list of (code, [commands])
+    """
+    runs = []
+    for act in values:
+        if not isinstance(act, (list, tuple)) or not act:
+            continue
+        if runs and runs[-1][0] == act[0] \
+                and (act[0] != 1 or runs[-1][1][-1][2] == act[2]):
+            runs[-1][1].append(act)
+        else:
+            runs.append((act[0], [act]))
+    return runs
+
 class _column(object):
     """ Base of all fields, a database column
     
@@ -596,27 +615,31 @@ class one2many(_column):
             return
         _table = obj.pool.get(self._obj)._table
         obj = obj.pool.get(self._obj)
-        for act in values:
-            if act[0] == 0:
-                act[2][self._fields_id] = id
-                id_new = obj.create(cr, user, act[2], context=context)
-                result += obj._store_get_values(cr, user, [id_new], act[2].keys(), context)
-            elif act[0] == 1:
-                obj.write(cr, user, [act[1]], act[2], context=context)
-            elif act[0] == 2:
-                obj.unlink(cr, user, [act[1]], context=context)
-            elif act[0] == 3:
-                cr.execute('update '+_table+' set '+self._fields_id+'=null where id=%s', (act[1],), debug=obj._debug)
-            elif act[0] == 4:
-                cr.execute('update '+_table+' set '+self._fields_id+'=%s where id=%s', (id, act[1]), debug=obj._debug)
-            elif act[0] == 5:
+        for code, acts in _command_runs(values):
+            if code == 0:
+                fields_set = set()
+                for act in acts:
+                    act[2][self._fields_id] = id
+                    fields_set.update(act[2].keys())
+                ids_new = obj.create_multi(cr, user, [act[2] for act in acts], context=context)
+                result += obj._store_get_values(cr, user, ids_new, list(fields_set), context)
+            elif code == 1:
+                obj.write(cr, user, [act[1] for act in acts], acts[0][2], context=context)
+            elif code == 2:
+                obj.unlink(cr, user, [act[1] for act in acts], context=context)
+            elif code == 3:
+                cr.execute('update '+_table+' set '+self._fields_id+'=null where id = ANY(%s)', ([act[1] for act in acts],), debug=obj._debug)
+            elif code == 4:
+                cr.execute('update '+_table+' set '+self._fields_id+'=%s where id = ANY(%s)', (id, [act[1] for act in acts]), debug=obj._debug)
+            elif code == 5:
                 cr.execute('update '+_table+' set '+self._fields_id+'=null where '+self._fields_id+'=%s', (id,), debug=obj._debug)
-            elif act[0] == 6:
-                obj.write(cr, user, act[2], {self._fields_id:id}, context=context or {})
-                ids2 = act[2] or [0]
-                cr.execute('select id from '+_table+' where '+self._fields_id+'=%s and id <> ALL (%s)', (id,ids2), debug=obj._debug)
-                ids3 = map(lambda x:x[0], cr.fetchall())
-                obj.write(cr, user, ids3, {self._fields_id:False}, context=context or {})
+            elif code == 6:
+                for act in acts:
+                    obj.write(cr, user, act[2], {self._fields_id:id}, context=context or {})
+                    ids2 = act[2] or [0]
+                    cr.execute('select id from '+_table+' where '+self._fields_id+'=%s and id <> ALL (%s)', (id,ids2), debug=obj._debug)
+                    ids3 = map(lambda x:x[0], cr.fetchall())
+                    obj.write(cr, user, ids3, {self._fields_id:False}, context=context or {})
         return result
 
     def search(self, cr, obj, args, name, value, offset=0, limit=None, uid=None, operator='like', context=None):
@@ -742,42 +765,51 @@ class many2many(_column):
             res[r[1]].append(r[0])
         return res
 
+    def _link(self, cr, obj, id, ids):
+        """ Relate id to each of ids, skipping the pairs that already exist
+        """
+        new_ids = []
+        for id2 in ids:
+            if id2 not in new_ids:
+                new_ids.append(id2)
+        for sub_ids in tools.misc.split_every(cr.IN_MAX, new_ids):
+            cr.execute('insert into '+self._rel+' ('+self._id1+','+self._id2+') '
+                       'select %s, new_rel.id2 from (values '+','.join(['(%s)'] * len(sub_ids))+') as new_rel(id2) '
+                       'where not exists (select 1 from '+self._rel+' where '+self._id1+'=%s and '+self._id2+'=new_rel.id2)',
+                       [id] + list(sub_ids) + [id], debug=obj._debug)
+
     def set(self, cr, obj, id, name, values, user=None, context=None):
+        """ Apply the command tuples of ``values`` (see the class doc), each
+            run of consecutive commands of the same kind in one go
+        """
         if not context:
             context = {}
         if not values:
             return
         obj = obj.pool.get(self._obj)
-        for act in values:
-            if not (isinstance(act, list) or isinstance(act, tuple)) or not act:
-                continue
-            if act[0] == 0:
-                idnew = obj.create(cr, user, act[2])
-                cr.execute('insert into '+self._rel+' ('+self._id1+','+self._id2+') values (%s,%s)', (id, idnew), debug=obj._debug)
-            elif act[0] == 1:
-                obj.write(cr, user, [act[1]], act[2], context=context)
-            elif act[0] == 2:
-                obj.unlink(cr, user, [act[1]], context=context)
-            elif act[0] == 3:
-                cr.execute('delete from '+self._rel+' where ' + self._id1 + '=%s and '+ self._id2 + '=%s', (id, act[1]), debug=obj._debug)
-            elif act[0] == 4:
-                # following queries are in the same transaction - so should be relatively safe
-                cr.execute('SELECT 1 FROM '+self._rel+' WHERE '+self._id1+' = %s and '+self._id2+' = %s', (id, act[1]), debug=obj._debug)
-                if not cr.fetchone():
-                    cr.execute('insert into '+self._rel+' ('+self._id1+','+self._id2+') values (%s,%s)', (id, act[1]), debug=obj._debug)
-            elif act[0] == 5:
+        for code, acts in _command_runs(values):
+            if code == 0:
+                ids_new = obj.create_multi(cr, user, [act[2] for act in acts])
+                self._link(cr, obj, id, ids_new)
+            elif code == 1:
+                obj.write(cr, user, [act[1] for act in acts], acts[0][2], context=context)
+            elif code == 2:
+                obj.unlink(cr, user, [act[1] for act in acts], context=context)
+            elif code == 3:
+                cr.execute('delete from '+self._rel+' where ' + self._id1 + '=%s and '+ self._id2 + ' = ANY(%s)', (id, [act[1] for act in acts]), debug=obj._debug)
+            elif code == 4:
+                self._link(cr, obj, id, [act[1] for act in acts])
+            elif code == 5:
                 cr.execute('DELETE FROM '+self._rel+' WHERE ' + self._id1 + ' = %s', (id,), debug=obj._debug)
-            elif act[0] == 6:
-
+            elif code == 6:
                 d1, d2,tables = obj.pool.get('ir.rule').domain_get(cr, user, obj._name, context=context)
                 if d1:
                     d1 = ' and ' + ' and '.join(d1)
                 else:
                     d1 = ''
-                cr.execute('delete from '+self._rel+' where '+self._id1+'=%s AND '+self._id2+' IN (SELECT '+self._rel+'.'+self._id2+' FROM '+self._rel+', '+','.join(tables)+' WHERE '+self._rel+'.'+self._id1+'=%s AND '+self._rel+'.'+self._id2+' = '+obj._table+'.id '+ d1 +')', [id, id]+d2, debug=obj._debug)
-
-                for act_nbr in act[2]:
-                    cr.execute('insert into '+self._rel+' ('+self._id1+','+self._id2+') values (%s, %s)', (id, act_nbr), debug=obj._debug)
+                for act in acts:
+                    cr.execute('delete from '+self._rel+' where '+self._id1+'=%s AND '+self._id2+' IN (SELECT '+self._rel+'.'+self._id2+' FROM '+self._rel+', '+','.join(tables)+' WHERE '+self._rel+'.'+self._id1+'=%s AND '+self._rel+'.'+self._id2+' = '+obj._table+'.id '+ d1 +')', [id, id]+d2, debug=obj._debug)
+                    self._link(cr, obj, id, act[2] or [])
 
     #
     # TODO: use a name_search
@@ -44,6 +44,7 @@
 import calendar
 import copy
 import datetime
+import heapq
 import logging
 import warnings
 import operator
@@ -124,6 +125,10 @@ _logger = logging.getLogger('orm')
 """ Persistent logger to be used throughout ORM
 """
 
+# (database, model) of the trees waiting for a renumbering of their gaps,
+# with the agent task scheduled for it
+_parent_store_pending = {}
+
 class browse_null(object):
     """ Readonly python database object browser
     """
@@ -161,6 +166,19 @@ class browse_null(object):
 #
 # TODO: execute an object method on browse_record_list
 #
+class browse_cache(dict):
+    """ The cache shared by the browse records of a browse session, a dict
+        of model -> id -> field values, which also holds the counters of
+        the session in `stats`, and by model the ids registered by the
+        prefetching whose read rules are not checked yet, in `prefetched`,
+        and the ones the user may not read, in `unreadable`
+    """
+    def __init__(self, *args, **kwargs):
+        super(browse_cache, self).__init__(*args, **kwargs)
+        self.stats = {'reads': 0, 'queries': 0}
+        self.prefetched = {}
+        self.unreadable = {}
+
 class browse_record_list(list):
     """ Collection of browse objects
     
@@ -262,7 +280,7 @@ class browse_record(object):
                     self.__logger.debug("%s.%s is virtual, fetching for %s", 
                             self._table._name, name, self._id)
                 if '_vptr' not in self._data[self._id]:
-                    ids_v = filter(lambda id: '_vptr' not in self._data[id], self._data.keys())
+                    ids_v = self._ids_to_read(filter(lambda id: '_vptr' not in self._data[id], self._data.keys()))
                     vptrs = self._table.read(self._cr, self._uid, ids_v, ['_vptr'],
                             context=self._context, load="_classic_write")
                     for data in vptrs:
@@ -349,7 +367,7 @@ class browse_record(object):
             # otherwise we fetch only that field
             else:
                 fields_to_fetch = [(name, col)]
-            ids = filter(lambda id: name not in self._data[id], self._data.keys())
+            ids = self._ids_to_read(filter(lambda id: name not in self._data[id], self._data.keys()))
             # read the results
             field_names = map(lambda x: x[0], fields_to_fetch)
 
@@ -357,7 +375,13 @@ class browse_record(object):
                 field_names.append('_vptr')
             if self._table._debug:
                 self.__logger.debug("Reading ids: %r/ %r", ids, self._data.keys())
+            qcount = self._cr.query_count
             field_values = self._table.read(self._cr, self._uid, ids, field_names, context=self._context, load="_classic_write")
+            # caches given by the callers may be plain dicts, without stats
+            stats = getattr(self._cache, 'stats', None)
+            if stats is not None:
+                stats['reads'] += 1
+                stats['queries'] += self._cr.query_count - qcount
             # if self._table._debug: # too much now, please enable if really needed
             #     self.__logger.debug("Got result %r", field_values)
 
@@ -388,6 +412,10 @@ class browse_record(object):
                 res_id = result_line['id']
                 del result_line['id']
                 self._data[res_id].update(result_line)
+
+            self._prefetch_relations(fields_to_fetch, field_values)
+            if self._table._debug:
+                self.__logger.debug("Browse session stats: %r", stats)
         
         if not name in self._data[self._id]:
             # How did this happen? Could be a missing model due to custom fields used too soon, see above.
@@ -471,6 +499,83 @@ class browse_record(object):
                 ret = browse_null()
         return ret
 
+    def _prefetch_relations(self, fields_to_fetch, field_values):
+        """ Register the targets of the relational fields just read in the
+            shared cache, so that the first access to any of them fetches
+            all of them, in one read()
+
+            The read rules of the targets are only checked when they are
+            first read, see _ids_to_read(). Caches given by the callers,
+            which may be plain dicts, get no prefetching.
+        """
+        prefetched = getattr(self._cache, 'prefetched', None)
+        if prefetched is None:
+            return
+        for field_name, col in fields_to_fetch:
+            if col._type not in ('many2one', 'one2one', 'one2many', 'many2many'):
+                continue
+            obj = self._table.pool.get(col._obj)
+            if obj is None:
+                continue
+            target_data = self._cache.setdefault(obj._name, {})
+            new_ids = set()
+            for result_line in field_values:
+                value = result_line.get(field_name)
+                if not value:
+                    continue
+                if col._type in ('many2one', 'one2one'):
+                    if isinstance(value, (list, tuple)):
+                        value = value[0]
+                    value = [value]
+                for id in value:
+                    if isinstance(id, (int, long)) and id not in target_data:
+                        new_ids.add(id)
+            for id in new_ids:
+                target_data[id] = {'id': id}
+            if new_ids:
+                prefetched.setdefault(obj._name, set()).update(new_ids)
+
+    def _ids_to_read(self, ids):
+        """ The ids among ids to read with this record: the ones registered
+            by the prefetching which the user may not read are left out,
+            as a read() would fail for all of them. They are checked now,
+            the first time they are read. """
+        prefetched = getattr(self._cache, 'prefetched', {}).get(self._table_name)
+        if prefetched:
+            todo = prefetched.intersection(ids)
+            if todo:
+                prefetched.difference_update(todo)
+                unreadable = todo.difference(self._readable_ids(self._table, todo))
+                if unreadable:
+                    self._cache.unreadable.setdefault(self._table_name, set()).update(unreadable)
+        unreadable = getattr(self._cache, 'unreadable', {}).get(self._table_name)
+        if unreadable:
+            # this record is read anyway, to fail as it would have
+            ids = [id for id in ids if id == self._id or id not in unreadable]
+        return ids
+
+    def _readable_ids(self, obj, ids):
+        """ The ids among ids which pass the read rules of obj for the user """
+        if not ids or not isinstance(obj, orm):
+            return ids
+        rule_clause, rule_params, tables = obj.pool.get('ir.rule').domain_get(
+                self._cr, self._uid, obj._name, 'read', context=self._context)
+        if not rule_clause:
+            return ids
+        res = []
+        for sub_ids in tools.misc.split_every(self._cr.IN_MAX, list(ids)):
+            self._cr.execute('SELECT "%s".id FROM %s WHERE "%s".id IN %%s AND (%s)' % \
+                    (obj._table, ','.join(tables), obj._table, ' OR '.join(rule_clause)),
+                    [tuple(sub_ids)] + rule_params)
+            res.extend(x[0] for x in self._cr.fetchall())
+        return res
+
+    def _get_browse_stats(self):
+        """ Return the counters of read() calls and queries issued so far,
+            by all the browse records that share the cache of this one
+        """
+        return dict(getattr(self._cache, 'stats', None) or {'reads': 0, 'queries': 0})
+
     def __getattr__(self, name):
         try:
             return self[name]
@@ -584,6 +689,11 @@ class orm_template(object):
     _parent_name = 'parent_id'
     _parent_store = False
     _parent_order = False
+    # with _parent_store, space left between consecutive parent_left and
+    # parent_right numbers: a new or moved node usually fits in the gaps
+    # and does not shift the rest of the table, which gets renumbered in
+    # the background when a gap runs out. 0 numbers the nodes densely.
+    _parent_store_gap = 0
     _date_name = 'date'
     _order = 'id'
     _sequence = None
@@ -793,7 +903,7 @@ class orm_template(object):
         """
         self._list_class = list_class or browse_record_list
         if cache is None:
-            cache = {}
+            cache = browse_cache()
         # need to accepts ints and longs because ids coming from a method
         # launched by button in the interface have a type long...
         if isinstance(select, (int, long)):
@@ -1218,13 +1328,51 @@ class orm_template(object):
     def get_invalid_fields(self, cr, uid):
         return list(self._invalids)
 
-    def _validate(self, cr, uid, ids, context=None):
+    def _constraint_needed(self, names, fields_written):
+        """ Tell if a constraint on the fields ``names`` must be checked
+            after a write of ``fields_written``. Constraints on function
+            fields or on fields unknown to the model are always checked. """
+        if not names or set(names).intersection(fields_written):
+            return True
+        for name in names:
+            if name in self._columns:
+                column = self._columns[name]
+            elif name in self._inherit_fields:
+                column = self._inherit_fields[name][2]
+            else:
+                return True
+            if isinstance(column, fields.function):
+                return True
+        return False
+
+    def _validate(self, cr, uid, ids, context=None, fields_written=None, set_based_only=False):
+        """ Check the python constraints of the model on ``ids``
+
+            :param fields_written: names of the fields just written, if
+                given only the constraints depending on them are checked
+            :param set_based_only: only check the set-based constraints
+
+            A constraint may have a fourth element, set to True to declare
+            it set-based: while ``create_multi`` creates records one by one,
+            such a constraint is checked once over all of them rather than
+            after each ``create``.
+        """
         context = context or {}
         lng = context.get('lang', False)
         trans = self.pool.get('ir.translation')
+        deferred = context.get('__deferred_constraints', {}).get(self._name)
         error_msgs = []
         for constraint in self._constraints:
-            fun, msg, fields = constraint
+            fun, msg, fields = constraint[:3]
+            set_based = len(constraint) > 3 and constraint[3]
+            if set_based_only and not set_based:
+                continue
+            if fields_written is not None \
+                    and not self._constraint_needed(fields, fields_written):
+                continue
+            if set_based and deferred is not None:
+                deferred.update(ids)
+                continue
             if not fun(self, cr, uid, ids):
                 # Check presence of __call__ directly instead of using
                 # callable() because it will be deprecated as of Python 3.0
@@ -1383,6 +1531,22 @@ class orm_template(object):
     def create(self, cr, user, vals, context=None):
         raise NotImplementedError(_('The create method is not implemented on this object !'))
 
+    def create_multi(self, cr, user, vals_list, context=None):
+        """ Create one record per dictionary of ``vals_list``
+
+            :return: the list of new ids, in the order of ``vals_list``
+        """
+        if context is None:
+            context = {}
+        # set-based constraints are checked once, after all the creations
+        deferred = set()
+        ctx = dict(context, __deferred_constraints=dict(
+                context.get('__deferred_constraints', {}), **{self._name: deferred}))
+        ids = [self.create(cr, user, vals, context=ctx) for vals in vals_list]
+        if deferred:
+            self._validate(cr, user, list(deferred), context, set_based_only=True)
+        return ids
+
     def fields_get_keys(self, cr, user, context=None):
         res = self._columns.keys()
         for parent in self._inherits:
@@ -2388,6 +2552,12 @@ class orm_memory(orm_template):
     def __init__(self, cr):
         super(orm_memory, self).__init__(cr)
         self.datas = {}
+        # ids of the records of each user
+        self._uid_ids = {}
+        # heap of (access time, id), with the access time of the record
+        # when it was pushed: the records accessed since are pushed back
+        # when they reach the top, see _pop_oldest()
+        self._access_heap = []
         self.next_id = 0
         self.check_id = 0
         # Do we need that? can't be groupped outside ?
@@ -2431,12 +2601,35 @@ class orm_memory(orm_template):
         if uid != 1 and self.datas[object_id]['internal.create_uid'] != uid:
             raise except_orm(_('AccessError'), '%s access is only allowed on your own records for osv_memory objects except for the super-user' % mode.capitalize())
 
+    def _pop_oldest(self, max_time=None):
+        """Remove the least recently accessed record from the access heap,
+        if it was accessed before max_time, and return its id (None if
+        there is no such record)"""
+        heap = self._access_heap
+        while heap:
+            date_access, id = heap[0]
+            record = self.datas.get(id)
+            if record is None:
+                # unlinked meanwhile
+                heapq.heappop(heap)
+            elif record['internal.date_access'] > date_access:
+                heapq.heapreplace(heap, (record['internal.date_access'], id))
+            elif max_time is not None and date_access >= max_time:
+                return None
+            else:
+                heapq.heappop(heap)
+                return id
+        return None
+
     def vaccum(self, cr, uid, force=False):
         """Run the vaccuum cleaning system, expiring and removing old records from the
         virtual osv_memory tables if the "max count" or "max age" conditions are enabled
         and have been reached. This method can be called very often (e.g. everytime a record
         is created), but will only actually trigger the cleanup process once out of
-        "_check_time" times (by default once out of 20 calls)."""
+        "_check_time" times (by default once out of 20 calls).
+
+        The records are taken from the access heap, oldest first, so only the
+        records to remove are looked at."""
         self.check_id += 1
         if (not force) and (self.check_id % self._check_time):
             return True
@@ -2445,18 +2638,27 @@ class orm_memory(orm_template):
         # Age-based expiration
         if self._max_hours:
             max = time.time() - self._max_hours * 60 * 60
-            for k,v in self.datas.iteritems():
-                if v['internal.date_access'] < max:
-                    tounlink.append(k)
-            self.unlink(cr, 1, tounlink)
+            id = self._pop_oldest(max)
+            while id is not None:
+                tounlink.append(id)
+                id = self._pop_oldest(max)
+
+        # Count-based expiration, in LRU fashion
+        if self._max_count:
+            for i in xrange(len(self.datas) - len(tounlink) - self._max_count):
+                id = self._pop_oldest()
+                if id is None:
+                    break
+                tounlink.append(id)
 
-        # Count-based expiration
-        if self._max_count and len(self.datas) > self._max_count:
-            # sort by access time to remove only the first/oldest ones in LRU fashion
-            records = self.datas.items()
-            records.sort(key=lambda x:x[1]['internal.date_access'])
-            self.unlink(cr, 1, [x[0] for x in records[:len(self.datas)-self._max_count]])
+        if tounlink:
+            self.unlink(cr, 1, tounlink)
 
+        # forget the records unlinked meanwhile, once they are the majority
+        if len(self._access_heap) > 2 * len(self.datas) + 64:
+            self._access_heap = [(v['internal.date_access'], k) for k, v in self.datas.iteritems()
+                                 if 'internal.date_access' in v]
+            heapq.heapify(self._access_heap)
         return True
 
     def read(self, cr, user, ids, fields_to_read=None, context=None, load='_classic_read'):
@@ -2474,13 +2676,13 @@ class orm_memory(orm_template):
             for id in ids:
                 if not id in self.datas:
                     continue
+                self._check_access(user, id, 'read')
                 r = {'id': id}
                 record = self.datas[id]
                 for f in fields_to_read:
                     if f == '_vptr':
                         r[f] = record.get(f, None)
                         continue
-                    self._check_access(user, id, 'read')
                     r[f] = record.get(f, False)
                     if r[f] and isinstance(self._columns[f], fields.binary) and context.get('bin_size', False):
                         r[f] = len(r[f])
@@ -2530,7 +2732,7 @@ class orm_memory(orm_template):
             self.datas[object_id]['internal.date_access'] = time.time()
             for field in upd_todo:
                 self._columns[field].set_memory(cr, self, object_id, field, vals[field], user, context)
-        self._validate(cr, user, [object_id], context) # FIXME
+        self._validate(cr, user, [object_id], context, fields_written=vals.keys()) # FIXME
         wf_service = netsvc.LocalService("workflow")
         wf_service.trg_write(user, self._name, object_id, cr)
         return object_id
@@ -2562,8 +2764,10 @@ class orm_memory(orm_template):
                         ( column.string, self._description )) # TODO: translate!
 
         self.datas[id_new] = vals2
-        self.datas[id_new]['internal.date_access'] = time.time()
+        self.datas[id_new]['internal.date_access'] = now = time.time()
         self.datas[id_new]['internal.create_uid'] = user
+        self._uid_ids.setdefault(user, set()).add(id_new)
+        heapq.heappush(self._access_heap, (now, id_new))
 
         for field in upd_todo:
             self._columns[field].set_memory(cr, self, id_new, field, vals[field], user, context)
@@ -2608,20 +2812,26 @@ class orm_memory(orm_template):
 
         # implicit filter on current user except for superuser
         if user != 1:
-            if not args:
-                args = []
-            args.insert(0, ('internal.create_uid', '=', user))
+            ids = sorted(self._uid_ids.get(user, ()))
+        else:
+            ids = sorted(self.datas)
 
         result = self._where_calc(cr, user, args, context=context)
         if result==[]:
-            return self.datas.keys()
+            ids = ids[int(offset or 0):]
+            if limit:
+                ids = ids[:int(limit)]
+            if count:
+                return len(ids)
+            return ids
 
         res=[]
         counter = 1
         #Find the value of dict
         f=False
         if result:
-            for id, data in self.datas.items():
+            for id in ids:
+                data = self.datas[id]
                 data['id'] = id
                 if limit and (counter > int(limit) + int(offset)):
                     break
@@ -2646,7 +2856,12 @@ class orm_memory(orm_template):
     def unlink(self, cr, uid, ids, context=None):
         for id in ids:
             self._check_access(uid, id, 'unlink')
-            self.datas.pop(id, None)
+            record = self.datas.pop(id, None)
+            if record is not None and 'internal.create_uid' in record:
+                user_ids = self._uid_ids[record['internal.create_uid']]
+                user_ids.discard(id)
+                if not user_ids:
+                    del self._uid_ids[record['internal.create_uid']]
         if len(ids):
             cr.execute('DELETE FROM wkf_instance '
                        'WHERE res_type=%s AND res_id = ANY (%s)',
@@ -2863,26 +3078,133 @@ class orm(orm_template):
         if not self._parent_store:
             return
         _logger.info('Computing parent left and right for table %s...' % (self._table, ))
-        def browse_rec(root, pos=0):
-# TODO: set order
-            where = self._parent_name+'='+str(root)
-            if not root:
-                where = self._parent_name+' IS NULL'
-            if self._parent_order:
-                where += ' order by '+self._parent_order
-            cr.execute('SELECT id FROM '+self._table+' WHERE '+where)
-            pos2 = pos + 1
-            for id in cr.fetchall():
-                pos2 = browse_rec(id[0], pos2)
-            cr.execute('update '+self._table+' set parent_left=%s, parent_right=%s where id=%s', (pos,pos2,root))
-            return pos2+1
-        query = 'SELECT id FROM '+self._table+' WHERE '+self._parent_name+' IS NULL'
-        if self._parent_order:
-            query += ' order by '+self._parent_order
+        # load the whole tree at once, children come in _parent_order
+        cr.execute('SELECT id, "%s" FROM "%s" ORDER BY %s' % \
+                (self._parent_name, self._table, self._parent_order or 'id'))
+        children = {}
+        for id, parent_id in cr.fetchall():
+            children.setdefault(parent_id, []).append(id)
+
+        # number the nodes with a depth-first walk: a node takes the next
+        # number as parent_left when entered, and the next one after all
+        # its children as parent_right
+        step = self._parent_store_gap or 1
+        values = []
         pos = 0
-        cr.execute(query)
-        for (root,) in cr.fetchall():
-            pos = browse_rec(root, pos)
+        for root in children.get(None, []):
+            lefts = {root: pos}
+            pos += step
+            stack = [(root, iter(children.get(root, [])))]
+            while stack:
+                node, todo = stack[-1]
+                for child in todo:
+                    lefts[child] = pos
+                    pos += step
+                    stack.append((child, iter(children.get(child, []))))
+                    break
+                else:
+                    stack.pop()
+                    values.append((node, lefts.pop(node), pos))
+                    pos += step
+
+        # and write everything back with a single UPDATE
+        tmp_table = '%s_parent_store' % self._table
+        cr.execute('CREATE TEMPORARY TABLE "%s" (id integer, parent_left integer, parent_right integer)' % tmp_table)
+        for sub_values in tools.misc.split_every(cr.IN_MAX, values):
+            cr.execute('INSERT INTO "%s" VALUES %s' % \
+                    (tmp_table, ','.join(['(%s,%s,%s)'] * len(sub_values))),
+                    tuple(v for row in sub_values for v in row))
+        cr.execute('UPDATE "%s" SET parent_left=t.parent_left, parent_right=t.parent_right '
+                   'FROM "%s" t WHERE "%s".id=t.id' % (self._table, tmp_table, self._table))
+        cr.execute('DROP TABLE "%s"' % tmp_table)
+        return True
+
+    def _parent_store_bound(self, cr, lo, parent, exclude=None):
+        """ Return the first number used after ``lo`` within ``parent``,
+            or None if there is none (last root)
+
+            :param exclude: (parent_left, parent_right) of a subtree to ignore
+        """
+        query = 'SELECT min(parent_left) FROM "%s" WHERE parent_left > %%s' % (self._table,)
+        params = [lo]
+        if exclude:
+            query += ' AND NOT (parent_left BETWEEN %s AND %s)'
+            params += exclude
+        cr.execute(query, params)
+        hi = cr.fetchone()[0]
+        if parent:
+            cr.execute('SELECT parent_right FROM "%s" WHERE id=%%s' % (self._table,), (parent,))
+            parent_right = cr.fetchone()[0]
+            if hi is None or parent_right < hi:
+                hi = parent_right
+        return hi
+
+    def _parent_store_place(self, lo, hi, size=None):
+        """ Place an interval of ``size`` (parent_right - parent_left)
+            in the free numbers between ``lo`` and ``hi``, in the middle so
+            that there is some room left on both sides. With no size, a
+            new leaf gets at most _parent_store_gap numbers.
+
+            :return: (parent_left, parent_right), or None if it cannot fit
+        """
+        gap = self._parent_store_gap
+        if hi is None:
+            left = lo + gap
+            return left, left + (size or gap)
+        free = hi - lo - 1
+        if size is None:
+            size = min(gap, free // 3)
+            if size < 1:
+                return None
+        elif free < size + 1:
+            return None
+        left = lo + 1 + (free - size - 1) // 2
+        return left, left + size
+
+    def _parent_store_renumber_later(self, cr):
+        """ Schedule a renumbering of the tree, to restore the gaps """
+        key = (cr.dbname, self._name)
+        task = _parent_store_pending.get(key)
+        # the task is cancelled when the database is closed or dropped
+        if task is not None and not netsvc.Agent.cancelled(task):
+            return
+        delay = int(config.get_misc('parent_store', 'renumber_delay', 60))
+        _parent_store_pending[key] = netsvc.Agent.setAlarm(
+                self._parent_store_renumber, time.time() + delay,
+                cr.dbname, cr.dbname)
+
+    def _parent_store_lock(self, cr):
+        """ Serialize the placements in the tree until the end of the
+            transaction: the free numbers are read, not locked, so two
+            transactions could otherwise take the same ones """
+        if cr.server_version >= 90100:
+            cr.execute('SELECT pg_advisory_xact_lock(%s::regclass::oid::bigint)',
+                       ('"%s"' % (self._table,),))
+        else:
+            # no transaction-level advisory lock before PostgreSQL 9.1, and
+            # locking the table would deadlock with the transactions which
+            # already wrote to it: lock the row of the model instead
+            cr.execute('SELECT id FROM ir_model WHERE model=%s FOR UPDATE', (self._name,))
+
+    def _parent_store_renumber(self, db_name):
+        import pooler
+        _parent_store_pending.pop((db_name, self._name), None)
+        try:
+            db, pool = pooler.get_db_and_pool(db_name)
+        except Exception:
+            return False
+        cr = db.cursor()
+        try:
+            try:
+                # no insert nor move while the tree is renumbered
+                cr.execute('LOCK TABLE "%s" IN EXCLUSIVE MODE' % (self._table,))
+                pool.get(self._name)._parent_store_compute(cr)
+                cr.commit()
+            except Exception:
+                cr.rollback()
+                _logger.warning('Could not renumber the tree of %s', self._name, exc_info=True)
+        finally:
+            cr.close()
         return True
 
     def _update_store(self, cr, f, k):
@@ -3854,6 +4176,14 @@ class orm(orm_template):
         # all non inherited fields for which the attribute whose name is in load is False
         fields_post = filter(lambda x: x in self._columns and not getattr(self._columns[x], load), fields_to_read)
 
+        # plain many2one fields get their names with one name_get() per
+        # target model, for all the fields at once
+        fields_m2o = [f for f in fields_post if isinstance(self._columns[f], fields.many2one) \
+                        and self._columns[f].get.im_func is fields.many2one.get.im_func]
+        if fields_m2o:
+            self._read_many2one_names(cr, res, fields_m2o, context)
+            fields_post = [f for f in fields_post if f not in fields_m2o]
+
         # Compute POST fields
         todo = {}
         for f in fields_post:
@@ -3930,6 +4260,32 @@ class orm(orm_template):
                             vals[field] = False
         return res
 
+    def _read_many2one_names(self, cr, res, field_names, context):
+        """ Replace the ids of the many2one fields ``field_names`` in the rows
+            of ``res`` by (id, name) tuples, like many2one.get() does, but with
+            one name_get() per target model for all of these fields
+        """
+        ids_by_model = {}
+        for f in field_names:
+            model_ids = ids_by_model.setdefault(self._columns[f]._obj, set())
+            for r in res:
+                if isinstance(r[f], (int, long)):
+                    model_ids.add(r[f])
+
+        names = {}
+        for model, model_ids in ids_by_model.items():
+            # we use uid=1 because the visibility of a many2one field value (just id and name)
+            # must be the access right of the parent form and not the linked object itself.
+            names[model] = dict(self.pool.get(model).name_get(cr, 1, list(model_ids), context=context))
+
+        for f in field_names:
+            records = names[self._columns[f]._obj]
+            for r in res:
+                if r[f] in records:
+                    r[f] = (r[f], records[r[f]])
+                else:
+                    r[f] = False
+
     def perm_read(self, cr, user, ids, context=None, details=True):
         """
         Returns some metadata about the given records.
@@ -4286,7 +4642,7 @@ class orm(orm_template):
             if v:
                 self.pool.get(table).write(cr, user, nids, v, context)
 
-        self._validate(cr, user, ids, context)
+        self._validate(cr, user, ids, context, fields_written=vals.keys())
 
         # TODO: use _order to set dest at the right position and not first node of parent
         # We can't defer parent_store computation because the stored function
@@ -4303,6 +4659,8 @@ class orm(orm_template):
                 else:
                     clause, params = '%s IS NULL' % (self._parent_name,), ()
 
+                if self._parent_store_gap:
+                    self._parent_store_lock(cr)
                 for id in parents_changed:
                     cr.execute('SELECT parent_left, parent_right FROM %s WHERE id=%%s' % (self._table,), (id,))
                     pleft, pright = cr.fetchone()
@@ -4333,6 +4691,19 @@ class orm(orm_template):
                     if pleft < position <= pright:
                         raise except_orm(_('UserError'), _('Recursivity Detected.'))
 
+                    if self._parent_store_gap:
+                        lo = position - 1
+                        hi = self._parent_store_bound(cr, lo, parent_val, exclude=(pleft, pright))
+                        if lo < pleft and (hi is None or pright < hi):
+                            # already at its place
+                            continue
+                        place = self._parent_store_place(lo, hi, pright - pleft)
+                        if place:
+                            offset = place[0] - pleft
+                            cr.execute('UPDATE '+self._table+' SET parent_left=parent_left+%s, parent_right=parent_right+%s WHERE parent_left >= %s AND parent_left < %s', (offset, offset, pleft, pright))
+                            continue
+                        self._parent_store_renumber_later(cr)
+
                     if pleft < position:
                         cr.execute('UPDATE '+self._table+' SET parent_left=parent_left+%s WHERE parent_left >= %s', (distance, position))
                         cr.execute('UPDATE '+self._table+' SET parent_right=parent_right+%s where parent_right >= %s', (distance, position))
@@ -4391,6 +4762,98 @@ class orm(orm_template):
             context = {}
         self.pool.get('ir.model.access').check(cr, user, self._name, 'create', context=context)
 
+        vals, upd0, upd1, upd2, upd_todo = self._create_prepare(cr, user, vals, context)
+        cr.execute('INSERT INTO "%s" (%s) VALUES (%s) RETURNING id' % \
+                    (self._table, ', '.join(upd0), ','.join(upd1)), tuple(upd2), debug=self._debug)
+        id_new = cr.fetchone()[0]
+        self.check_access_rule(cr, user, [id_new], 'create', context=context)
+        result = self._create_relations(cr, user, id_new, vals, upd_todo, context)
+        self._validate(cr, user, [id_new], context)
+
+        if not context.get('no_store_function', False):
+            result += self._store_get_values(cr, user, [id_new], vals.keys(), context)
+            self._create_store_set(cr, user, result, context)
+
+        self._create_log(cr, user, id_new, context)
+        wf_service = netsvc.LocalService("workflow")
+        wf_service.trg_create(user, self._name, id_new, cr)
+        return id_new
+
+    def create_multi(self, cr, user, vals_list, context=None):
+        """ Create one record per dictionary of ``vals_list``, inserting
+            them with as few queries as possible.
+
+            Models that override create(), or use _parent_store, get their
+            records created one by one, through create().
+
+            :return: the list of new ids, in the order of ``vals_list``
+        """
+        if not context:
+            context = {}
+        if getattr(self.create, 'im_func', None) is not orm.create.im_func \
+                or (self._parent_store and not context.get('defer_parent_store_computation')):
+            return super(orm, self).create_multi(cr, user, vals_list, context=context)
+        if not vals_list:
+            return []
+        self.pool.get('ir.model.access').check(cr, user, self._name, 'create', context=context)
+
+        prepared = [self._create_prepare(cr, user, vals, context) for vals in vals_list]
+
+        new_ids = self._insert_prepared(cr, prepared)
+        self.check_access_rule(cr, user, new_ids, 'create', context=context)
+
+        result = []
+        all_fields = set()
+        for id_new, (vals, upd0, upd1, upd2, upd_todo) in zip(new_ids, prepared):
+            result += self._create_relations(cr, user, id_new, vals, upd_todo, context)
+            all_fields.update(vals.keys())
+        self._validate(cr, user, new_ids, context)
+
+        if not context.get('no_store_function', False):
+            result += self._store_get_values(cr, user, new_ids, list(all_fields), context)
+            self._create_store_set(cr, user, result, context)
+
+        wf_service = netsvc.LocalService("workflow")
+        for id_new in new_ids:
+            self._create_log(cr, user, id_new, context)
+            wf_service.trg_create(user, self._name, id_new, cr)
+        return new_ids
+
+    def _insert_prepared(self, cr, prepared):
+        """ Insert the records prepared by _create_prepare(), with one INSERT
+            per run of consecutive records with the same columns, for up to
+            IN_MAX records
+
+            :return: the list of new ids, in the order of ``prepared``
+        """
+        new_ids = []
+        start = 0
+        while start < len(prepared):
+            columns = prepared[start][1]
+            end = start + 1
+            while end < len(prepared) and prepared[end][1] == columns:
+                end += 1
+            row_format = '(%s)' % ','.join(prepared[start][2])
+            for sub_pos in tools.misc.split_every(cr.IN_MAX, range(start, end)):
+                params = []
+                for pos in sub_pos:
+                    params += prepared[pos][3]
+                cr.execute('INSERT INTO "%s" (%s) VALUES %s RETURNING id' % \
+                            (self._table, ', '.join(columns), ','.join([row_format] * len(sub_pos))),
+                            tuple(params), debug=self._debug)
+                # the ids are taken from the sequence in the order of the
+                # rows, but RETURNING does not guarantee that order
+                new_ids += sorted(x[0] for x in cr.fetchall())
+            start = end
+        return new_ids
+
+    def _create_prepare(self, cr, user, vals, context):
+        """ Compute the column values of a record to create, creating (or
+            writing) its _inherits parents on the way
+
+            :return: (vals, columns, formats, params, upd_todo), where
+                     upd_todo are the fields to be set after the INSERT
+        """
         vals = self._add_missing_default_values(cr, user, vals, context)
 
         tocreate = {}
@@ -4484,16 +4947,22 @@ class orm(orm_template):
             upd0 += ['create_uid', 'create_date']
             upd1 += ['%s', 'now()']
             upd2.append(user)
-        cr.execute('INSERT INTO "%s" (%s) VALUES (%s) RETURNING id' % \
-                    (self._table, ', '.join(upd0), ','.join(upd1)), tuple(upd2), debug=self._debug)
-        id_new = cr.fetchone()[0]
-        self.check_access_rule(cr, user, [id_new], 'create', context=context)
-        upd_todo.sort(lambda x, y: self._columns[x].priority-self._columns[y].priority)
+        return vals, upd0, upd1, upd2, upd_todo
+
+    def _create_relations(self, cr, user, id_new, vals, upd_todo, context):
+        """ Place a new record in the parent tree and set its non-classic
+            fields (one2many, many2many...)
+
+            :return: the function fields to store, like _store_get_values()
+        """
+        upd_todo = sorted(upd_todo, lambda x, y: self._columns[x].priority-self._columns[y].priority)
 
         if self._parent_store and not context.get('defer_parent_store_computation'):
             if self.pool._init:
                 self.pool._init_parent[self._name]=True
             else:
+                if self._parent_store_gap:
+                    self._parent_store_lock(cr)
                 parent = vals.get(self._parent_name, False)
                 if parent:
                     cr.execute('SELECT parent_right FROM '+self._table+' WHERE '+self._parent_name+'=%s ORDER BY '+(self._parent_order or self._order), (parent,))
@@ -4510,9 +4979,18 @@ class orm(orm_template):
                 else:
                     cr.execute('SELECT max(parent_right) FROM '+self._table)
                     pleft = cr.fetchone()[0] or 0
-                cr.execute('UPDATE '+self._table+' SET parent_left=parent_left+2 WHERE parent_left > %s', (pleft,))
-                cr.execute('UPDATE '+self._table+' SET parent_right=parent_right+2 WHERE parent_right > %s', (pleft,))
-                cr.execute('UPDATE '+self._table+' SET parent_left=%s,parent_right=%s WHERE id=%s', (pleft+1,pleft+2,id_new))
+                place = None
+                if self._parent_store_gap:
+                    place = self._parent_store_place(pleft,
+                            self._parent_store_bound(cr, pleft, parent))
+                    if not place:
+                        self._parent_store_renumber_later(cr)
+                if place:
+                    cr.execute('UPDATE '+self._table+' SET parent_left=%s,parent_right=%s WHERE id=%s', (place[0], place[1], id_new))
+                else:
+                    cr.execute('UPDATE '+self._table+' SET parent_left=parent_left+2 WHERE parent_left > %s', (pleft,))
+                    cr.execute('UPDATE '+self._table+' SET parent_right=parent_right+2 WHERE parent_right > %s', (pleft,))
+                    cr.execute('UPDATE '+self._table+' SET parent_left=%s,parent_right=%s WHERE id=%s', (pleft+1,pleft+2,id_new))
 
         # default element in context must be removed when call a one2many or many2many
         rel_context = context.copy()
@@ -4523,26 +5001,23 @@ class orm(orm_template):
         result = []
         for field in upd_todo:
             result += self._columns[field].set(cr, self, id_new, field, vals[field], user, rel_context) or []
-        self._validate(cr, user, [id_new], context)
+        return result
 
-        if not context.get('no_store_function', False):
-            result += self._store_get_values(cr, user, [id_new], vals.keys(), context)
-            result.sort()
-            done = []
-            for order, object, ids, fields2 in result:
-                if not (object, ids, fields2) in done:
-                    self.pool.get(object)._store_set_values(cr, user, ids, fields2, context)
-                    done.append((object, ids, fields2))
+    def _create_store_set(self, cr, user, result, context):
+        result.sort()
+        done = []
+        for order, object, ids, fields2 in result:
+            if not (object, ids, fields2) in done:
+                self.pool.get(object)._store_set_values(cr, user, ids, fields2, context)
+                done.append((object, ids, fields2))
 
+    def _create_log(self, cr, user, id_new, context):
         if self._log_create and not (context and context.get('no_store_function', False)):
             message = self._description + \
                 " '" + \
                 self.name_get(cr, user, [id_new], context=context)[0][1] + \
                 "' " + _("created.")
             self.log(cr, user, id_new, message, True, context=context)
-        wf_service = netsvc.LocalService("workflow")
-        wf_service.trg_create(user, self._name, id_new, cr)
-        return id_new
 
     def _store_get_values(self, cr, uid, ids, fields, context):
         """Returns an ordered list of fields.functions to call due to
@@ -19,6 +19,8 @@
 #
 ##############################################################################
 
+import time
+
 pool_dic = {}
 
 def get_db_and_pool(db_name, force_demo=False, status=None, update_module=False, pooljobs=True, languages=False):
@@ -46,6 +48,8 @@ def get_db_and_pool(db_name, force_demo=False, status=None, update_module=False,
         log.info("Starting pooler of database: %s" % db_name)
         
         pool = osv.osv.osv_pool()
+        # lets the pdf report workers notice that their registry is stale
+        pool.loaded_at = time.time()
         pool_dic[db_name] = pool
 
         try:
@@ -59,12 +63,14 @@ def get_db_and_pool(db_name, force_demo=False, status=None, update_module=False,
         try:
             pool.init_set(cr, False)
             pool.get('ir.actions.report.xml').register_all(cr)
+            pool.get('ir.column.stats').load(cr)
             cr.commit()
         finally:
             cr.close()
 
         if pooljobs:
             pool.get('ir.cron').restart(db.dbname)
+            pool.get('ir.column.stats').restart(db.dbname)
         log.info('Successfuly loaded database \"%s\"' % db_name)
     return db, pool
 
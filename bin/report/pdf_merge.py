@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2004-2009 Tiny SPRL (<http://tiny.be>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+""" Concatenation of pdf documents without rebuilding them in memory
+
+    pyPdf's PdfFileWriter keeps every object of every input in memory
+    and sweeps the whole tree again before writing. PdfMerger instead
+    copies the objects of each page as soon as the document is appended,
+    rewriting only their object numbers: content streams are written
+    back exactly as they were read, compressed. Objects that come out
+    byte-identical (fonts, logos, ...) are written only once and shared
+    by all the documents that use them.
+"""
+
+import tempfile
+from hashlib import md5
+from cStringIO import StringIO
+
+from pyPdf import PdfFileReader
+from pyPdf.generic import ArrayObject, DictionaryObject, IndirectObject, \
+        NameObject, NumberObject, createStringObject
+
+
+class PdfMerger(object):
+    """ Append pdf documents to a file, page after page
+
+        >>> merger = PdfMerger()
+        >>> for data in documents:
+        ...     merger.append(data)
+        >>> pdf = merger.getvalue()
+    """
+
+    def __init__(self, stream=None, max_size=4*1024*1024):
+        if stream is None:
+            stream = tempfile.SpooledTemporaryFile(max_size)
+        self.stream = stream
+        self.version = '1.4'
+        self._offsets = {}
+        self._digests = {}
+        self._kids = ArrayObject()
+        # the catalog and page tree root are written last, in close()
+        self._root = self._alloc()
+        self._pages = self._alloc()
+        self.stream.write('%%PDF-%s\n%%\xe2\xe3\xcf\xd3\n' % self.version)
+        self._closed = False
+
+    def _alloc(self):
+        self._offsets[len(self._offsets) + 1] = None
+        return IndirectObject(len(self._offsets), 0, self)
+
+    def _write(self, ref, data):
+        self._offsets[ref.idnum] = self.stream.tell()
+        self.stream.write('%d 0 obj\n' % ref.idnum)
+        self.stream.write(data)
+        self.stream.write('\nendobj\n')
+
+    def _serialize(self, obj):
+        buf = StringIO()
+        obj.writeToStream(buf, None)
+        return buf.getvalue()
+
+    def append(self, data):
+        """ Append all the pages of a pdf document, given as a string """
+        assert not self._closed, 'document already closed'
+        if data[:5] == '%PDF-':
+            self.version = max(self.version, data[5:8])
+        reader = PdfFileReader(StringIO(data))
+        refs = {}
+        pending = {}
+        pages = [reader.getPage(i) for i in range(reader.getNumPages())]
+        # pages are known in advance so that annotations pointing back
+        # to their page end up on the copy
+        for page in pages:
+            if page.indirectRef is not None:
+                refs[page.indirectRef.generation, page.indirectRef.idnum] = self._alloc()
+        for page in pages:
+            if page.indirectRef is not None:
+                ref = refs[page.indirectRef.generation, page.indirectRef.idnum]
+            else:
+                ref = self._alloc()
+            page[NameObject('/Parent')] = self._pages
+            page = self._remap(reader, page, refs, pending)
+            self._write(ref, self._serialize(page))
+            self._kids.append(ref)
+
+    def _remap(self, reader, obj, refs, pending):
+        """ Point the indirect references of obj to the merged document,
+            copying the referenced objects when first met """
+        if isinstance(obj, DictionaryObject):
+            for key, value in obj.items():
+                obj[key] = self._remap(reader, value, refs, pending)
+        elif isinstance(obj, ArrayObject):
+            for i in range(len(obj)):
+                obj[i] = self._remap(reader, obj[i], refs, pending)
+        elif isinstance(obj, IndirectObject) and obj.pdf is not self:
+            return self._copy(reader, obj, refs, pending)
+        return obj
+
+    def _copy(self, reader, ref, refs, pending):
+        key = ref.generation, ref.idnum
+        if key in refs:
+            return refs[key]
+        if key in pending:
+            # a cycle back to an object being copied: it needs its
+            # number now, and will not be shared
+            if pending[key] is None:
+                pending[key] = self._alloc()
+            return pending[key]
+        pending[key] = None
+        obj = self._remap(reader, reader.getObject(ref), refs, pending)
+        new_ref = pending.pop(key)
+        data = self._serialize(obj)
+        if new_ref is None:
+            digest = md5(data).digest()
+            new_ref = self._digests.get(digest)
+            if new_ref is not None:
+                refs[key] = new_ref
+                return new_ref
+            new_ref = self._digests[digest] = self._alloc()
+        self._write(new_ref, data)
+        refs[key] = new_ref
+        return new_ref
+
+    def close(self):
+        """ Write the page tree, cross-reference table and trailer """
+        if self._closed:
+            return
+        self._closed = True
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Count'): NumberObject(len(self._kids)),
+            NameObject('/Kids'): self._kids,
+        })
+        self._write(self._pages, self._serialize(pages))
+        root = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): self._pages,
+        })
+        if self.version > '1.4':
+            root[NameObject('/Version')] = NameObject('/' + self.version)
+        self._write(self._root, self._serialize(root))
+        info = self._alloc()
+        self._write(info, self._serialize(DictionaryObject({
+            NameObject('/Producer'): createStringObject(u'OpenERP'),
+        })))
+
+        xref = self.stream.tell()
+        self.stream.write('xref\n0 %d\n' % (len(self._offsets) + 1))
+        self.stream.write('%010d %05d f \n' % (0, 65535))
+        for idnum in range(1, len(self._offsets) + 1):
+            offset = self._offsets[idnum]
+            if offset is None:
+                # number reserved for a shared object, never written
+                self.stream.write('%010d %05d f \n' % (0, 0))
+            else:
+                self.stream.write('%010d %05d n \n' % (offset, 0))
+        self.stream.write('trailer\n')
+        self.stream.write(self._serialize(DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self._offsets) + 1),
+            NameObject('/Root'): self._root,
+            NameObject('/Info'): info,
+        })))
+        self.stream.write('\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+    def getvalue(self):
+        """ Close the document and return it as a string """
+        self.close()
+        self.stream.seek(0)
+        return self.stream.read()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
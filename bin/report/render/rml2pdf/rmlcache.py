@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2004-2009 Tiny SPRL (<http://tiny.be>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+#.apidoc title: Decoded image and font cache
+
+""" Process-wide cache of what the RML renderers decode over and over
+
+    The same company logo comes base64-encoded in every document (and
+    often on every page) of a report run. Decoded images are kept here
+    keyed by a hash of their content, up to a total size of [reports]
+    image_cache_size bytes. The ImageReader objects are not shared: when
+    drawing, reportlab reads and seeks their file, which threads cannot
+    do at once.
+    Font mappings are global to reportlab, they are only applied when
+    they differ from its current ones, which another document may have
+    changed.
+"""
+
+import base64
+import threading
+from hashlib import md5
+
+from reportlab.lib.utils import ImageReader
+
+try:
+    from tools import config
+except ImportError:
+    class config(object):
+        @staticmethod
+        def get_misc(k, k2, default):
+            return default
+
+
+class SizedCache(object):
+    """ LRU mapping bounded by the total size of its values """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = {}
+        self._tick = 0
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tick += 1
+            entry[0] = self._tick
+            return entry[2]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value, size):
+        self._lock.acquire()
+        try:
+            if size > self.max_size:
+                return value
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+            self._tick += 1
+            self._data[key] = [self._tick, size, value]
+            self.size += size
+            if self.size > self.max_size:
+                # evict the least recently used entries, down to 3/4
+                # of the limit so that this does not happen on each put
+                for tick, k in sorted((e[0], k) for k, e in self._data.items()):
+                    self.size -= self._data.pop(k)[1]
+                    if self.size <= self.max_size * 3 // 4:
+                        break
+            return value
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return '%d entries, %dkB, %d%% hits (%d/%d)' % (len(self._data),
+                self.size // 1024, total and 100 * self.hits // total,
+                self.hits, total)
+
+_images = SizedCache(int(config.get_misc('reports', 'image_cache_size', 16*1024*1024)))
+
+def decode_image(text):
+    """ Return the binary content of a base64 encoded image """
+    if not text:
+        return text
+    key = md5(text).digest()
+    data = _images.get(('b64', key))
+    if data is None:
+        data = _images.put(('b64', key), base64.decodestring(text), len(text))
+    return data
+
+def image_reader(data):
+    """ Return a new ImageReader for the binary content of an image """
+    from cStringIO import StringIO
+    return ImageReader(StringIO(data))
+
+# (bold, italic) styles of the modes of the font mappings
+_font_styles = {
+    'all': [(0, 0), (0, 1), (1, 0), (1, 1)],
+    'normal': [(0, 0)],
+    'regular': [(0, 0)],
+    'italic': [(0, 1)],
+    'bold': [(1, 0)],
+    'bolditalic': [(1, 1)],
+}
+_font_lock = threading.Lock()
+_font_hits = [0, 0]
+
+def map_font(face, fontname, mode='all'):
+    """ Map the styles of face given by mode to the registered font
+        fontname, where reportlab does not map them to it already """
+    from reportlab.lib.fonts import addMapping, tt2ps
+    _font_lock.acquire()
+    try:
+        for bold, italic in _font_styles.get(mode, ()):
+            try:
+                current = tt2ps(face, bold, italic)
+            except ValueError:
+                current = None
+            if current == fontname:
+                _font_hits[0] += 1
+            else:
+                _font_hits[1] += 1
+                addMapping(face, bold, italic, fontname)
+    finally:
+        _font_lock.release()
+
+def stats():
+    """ Readable hit rates of the caches """
+    total = sum(_font_hits)
+    return 'images: %s; font mappings: %d%% already applied (%d/%d)' % (
+            _images.stats(), total and 100 * _font_hits[0] // total,
+            _font_hits[0], total)
+
+#eof
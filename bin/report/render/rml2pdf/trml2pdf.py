@@ -29,6 +29,7 @@ from reportlab.pdfgen import canvas
 from reportlab import platypus
 import utils
 import color
+import rmlcache
 import os
 import threading
 import logging
@@ -301,24 +302,13 @@ class _rml_doc(object):
                 addMapping(name, 1, 1, name)    #italic and bold
 
     def setTTFontMapping(self,face, fontname, filename, mode='all'):
-        from reportlab.lib.fonts import addMapping
         from reportlab.pdfbase.ttfonts import TTFont
 
+        # the fonts are loaded once, the mappings are global to reportlab
+        # and only changed when another document remapped them
         if fontname not in pdfmetrics._fonts:
             pdfmetrics.registerFont(TTFont(fontname, filename))
-        if (mode == 'all'):
-            addMapping(face, 0, 0, fontname)    #normal
-            addMapping(face, 0, 1, fontname)    #italic
-            addMapping(face, 1, 0, fontname)    #bold
-            addMapping(face, 1, 1, fontname)    #italic and bold
-        elif (mode== 'normal') or (mode == 'regular'):
-            addMapping(face, 0, 0, fontname)    #normal
-        elif (mode == 'italic'):
-            addMapping(face, 0, 1, fontname)    #italic
-        elif (mode == 'bold'):
-            addMapping(face, 1, 0, fontname)    #bold
-        elif (mode == 'bolditalic'):
-            addMapping(face, 1, 1, fontname)    #italic and bold
+        rmlcache.map_font(face, fontname, mode)
 
     def _textual_image(self, node):
         rc = ''
@@ -330,7 +320,7 @@ class _rml_doc(object):
         result = {}
         for node in el.findall('.//image'):
             rc =( node.text or '')
-            result[node.get('name')] = base64.decodestring(rc)
+            result[node.get('name')] = rmlcache.decode_image(rc)
         return result
 
     def render(self, out):
@@ -490,13 +480,11 @@ class _rml_canvas(object):
     def _image(self, node):
         import urllib
         import urlparse
-        from reportlab.lib.utils import ImageReader
         nfile = node.get('file')
         if not nfile:
             if node.get('name'):
                 image_data = self.images[node.get('name')]
                 self._logger.debug("Image %s used", node.get('name'))
-                s = StringIO(image_data)
             else:
                 if self.localcontext:
                     res = utils._regex.findall(node.text)
@@ -505,16 +493,13 @@ class _rml_canvas(object):
                         node.text = newtext or ''
                 image_data = None
                 if node.text:
-                    image_data = base64.decodestring(node.text)
-                if image_data:
-                    s = StringIO(image_data)
-                else:
+                    image_data = rmlcache.decode_image(node.text)
+                if not image_data:
                     self._logger.debug("No image data!")
                     return False
         else:
-            if nfile in self.images:
-                s = StringIO(self.images[nfile])
-            else:
+            image_data = self.images.get(nfile)
+            if image_data is None:
                 try:
                     up = urlparse.urlparse(str(nfile))
                 except ValueError:
@@ -528,26 +513,27 @@ class _rml_canvas(object):
                 else:
                     self._logger.debug("Open image file %s ", nfile)
                     s = _open_image(nfile, path=self.path)
-        try:
-            img = ImageReader(s)
-            (sx,sy) = img.getSize()
-            self._logger.debug("Image is %dx%d", sx, sy)
-            args = { 'x': 0.0, 'y': 0.0 }
-            for tag in ('width','height','x','y'):
-                if node.get(tag):
-                    args[tag] = utils.unit_get(node.get(tag))
-            if ('width' in args) and (not 'height' in args):
-                args['height'] = sy * args['width'] / sx
-            elif ('height' in args) and (not 'width' in args):
+                try:
+                    image_data = s.read()
+                finally:
+                    s.close()
+        img = rmlcache.image_reader(image_data)
+        (sx,sy) = img.getSize()
+        self._logger.debug("Image is %dx%d", sx, sy)
+        args = { 'x': 0.0, 'y': 0.0 }
+        for tag in ('width','height','x','y'):
+            if node.get(tag):
+                args[tag] = utils.unit_get(node.get(tag))
+        if ('width' in args) and (not 'height' in args):
+            args['height'] = sy * args['width'] / sx
+        elif ('height' in args) and (not 'width' in args):
+            args['width'] = sx * args['height'] / sy
+        elif ('width' in args) and ('height' in args):
+            if (float(args['width'])/args['height'])>(float(sx)>sy):
                 args['width'] = sx * args['height'] / sy
-            elif ('width' in args) and ('height' in args):
-                if (float(args['width'])/args['height'])>(float(sx)>sy):
-                    args['width'] = sx * args['height'] / sy
-                else:
-                    args['height'] = sy * args['width'] / sx
-            self.canvas.drawImage(img, **args)
-        finally:
-            s.close()
+            else:
+                args['height'] = sy * args['width'] / sx
+        self.canvas.drawImage(img, **args)
 #        self.canvas._doc.SaveToFile(self.canvas._filename, self.canvas)
 
     def _path(self, node):
@@ -854,7 +840,7 @@ class _rml_flowable(object):
                     if self.localcontext:
                         newtext = utils._process_text(self, node.text or '')
                         node.text = newtext
-                    image_data = base64.decodestring(node.text)
+                    image_data = rmlcache.decode_image(node.text)
                 if not image_data:
                     self._logger.debug("No inline image data")
                     return False
@@ -47,7 +47,12 @@ import sys
 if 'openerp-server' in sys.modules['__main__'].__file__:
     from tools.safe_eval import safe_eval as eval
     from tools import ustr
+    from tools.lru import LRU
 else:
+    def LRU(count):
+        # a single document is rendered, the cache needs no bound
+        return {}
+
     def ustr(value):
         if isinstance(value, unicode):
             return value
@@ -66,6 +71,20 @@ else:
 
 _regex = re.compile('\[\[(.+?)\]\]')
 
+_split_cache = LRU(8192)
+
+def _split_text(txt):
+    """ Split a text into alternating literal and [[ expression ]] parts
+
+        Template texts are rendered for each record, the result of the
+        split is kept instead of scanning them again every time.
+    """
+    try:
+        return _split_cache[txt]
+    except KeyError:
+        sps = _split_cache[txt] = tuple(_regex.split(txt))
+        return sps
+
 def str2xml(s):
     return (s or '').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
@@ -133,15 +152,15 @@ def _process_text(self, txt):
         if not txt:
             return ''
         result = ''
-        sps = _regex.split(txt)
-        while sps:
+        sps = _split_text(txt)
+        for i in range(0, len(sps), 2):
             # This is a simple text to translate
-            to_translate = ustr(sps.pop(0))
+            to_translate = ustr(sps[i])
             result += ustr(self.localcontext.get('translate', lambda x:x)(to_translate))
-            if sps:
+            if i + 1 < len(sps):
                 try:
                     txt = None
-                    expr = sps.pop(0)
+                    expr = sps[i + 1]
                     txt = eval(expr, self.localcontext)
                     if txt and (isinstance(txt, basestring)):
                         txt = ustr(txt)
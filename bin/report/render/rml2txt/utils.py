@@ -24,6 +24,7 @@ import reportlab
 import reportlab.lib.units
 from tools import copy
 from tools.safe_eval import safe_eval as eval
+from report.render.rml2pdf.utils import _split_text
 
 _regex = re.compile('\[\[(.+?)\]\]')
 
@@ -70,13 +71,13 @@ def _process_text(self, txt):
         if not txt:
             return ''
         result = ''
-        sps = _regex.split(txt)
-        while sps:
+        sps = _split_text(txt)
+        for i in range(0, len(sps), 2):
             # This is a simple text to translate
-            result += self.localcontext.get('translate', lambda x:x)(sps.pop(0))
-            if sps:
+            result += self.localcontext.get('translate', lambda x:x)(sps[i])
+            if i + 1 < len(sps):
                 try:
-                    txt2 = eval(sps.pop(0),self.localcontext)
+                    txt2 = eval(sps[i + 1],self.localcontext)
                 except Exception:
                     txt2 = ''
                 if type(txt2) == type(0) or type(txt2) == type(0.0):
@@ -20,6 +20,7 @@
 ##############################################################################
 from lxml import etree
 import StringIO
+import cPickle
 import cStringIO
 import base64
 from datetime import datetime
@@ -27,10 +28,15 @@ import os
 import re
 import time
 from interface import report_rml
+from render.rml2pdf import rmlcache
 import preprocess
 import logging
+import multiprocessing
+import netsvc
 import pooler
+import threading
 import tools
+from tools.lru import LRU
 import zipfile
 import common
 from osv.fields import float as float_class, function as function_class
@@ -143,6 +149,59 @@ _fields_process = {
     'datetime' : _dttime_format
 }
 
+#
+# Rendering of multi-record pdf reports in worker processes.
+#
+# The workers are forked once, at server start-up, before any thread is
+# running: a process forked later could inherit a lock held by another
+# thread (logging, connection pool, import lock) and deadlock on it. So
+# the jobs are sent to them, and each worker loads the registry of the
+# databases it renders for, with its own connections.
+#
+_pdf_workers = None
+_pdf_processes = 0
+
+# rml templates with their header added and preprocessed, as strings
+_compiled_rml = LRU(int(tools.config.get_misc('reports', 'template_cache_size', 64)))
+
+def start_pdf_workers():
+    """ Start the [reports] pdf_processes rendering processes, if set
+        above 1; must be called before any thread is started
+    """
+    global _pdf_workers, _pdf_processes
+    processes = int(tools.config.get_misc('reports', 'pdf_processes', 0))
+    if processes < 2 or not hasattr(os, 'fork') or _pdf_workers is not None:
+        return False
+    if threading.activeCount() > 1:
+        logging.getLogger('report').warning("Threads are already running, "
+                "the pdf reports will be rendered in the server process")
+        return False
+    _pdf_workers = multiprocessing.Pool(processes)
+    _pdf_processes = processes
+    return True
+
+class _report_xml_values(object):
+    """ The fields of a report_xml used by create_single_pdf() """
+    def __init__(self, report_xml):
+        for field in ('name', 'report_rml_content', 'header', 'report_type'):
+            setattr(self, field, getattr(report_xml, field))
+
+def _render_pdf_worker(job):
+    report_name, dbname, loaded_at, uid, id, data, report_xml, context = job
+    pool = pooler.pool_dic.get(dbname)
+    if pool is not None and pool.loaded_at < loaded_at:
+        # the registry was reloaded by the server since
+        del pooler.pool_dic[dbname]
+    db, pool = pooler.get_db_and_pool(dbname, pooljobs=False)
+    report = netsvc.Service._services[report_name]
+    cr = db.cursor()
+    try:
+        return report.create_single_pdf(cr, uid, [id], data, report_xml, context)
+    finally:
+        # rendering is read-only, never commit from a worker
+        cr.rollback()
+        cr.close()
+
 #
 # Context: {'node': node.dom}
 #
@@ -463,9 +522,9 @@ class report_sxw(report_rml, preprocess.report):
         results = []
         if ids and attach:
             objs = self.getObjects(cr, uid, ids, context)
+            todo = []
             for obj in objs:
                 aname = eval(attach, {'object':obj, 'time':time})
-                result = False
                 if report_xml.attachment_use and aname and context.get('attachment_use', True):
                     aids = pool.get('ir.attachment').search(cr, uid, [('datas_fname','=',aname+'.pdf'),('res_model','=',self.table),('res_id','=',obj.id)])
                     if aids:
@@ -476,7 +535,10 @@ class report_sxw(report_rml, preprocess.report):
                         results.append((d,'pdf'))
                         continue
                 # else, create the pdf again
-                result = self.create_single_pdf(cr, uid, [obj.id], data, report_xml, context)
+                results.append(False)
+                todo.append((len(results) - 1, obj, aname))
+            rendered = self.create_pdfs(cr, uid, [obj.id for _, obj, _ in todo], data, report_xml, context)
+            for (index, obj, aname), result in zip(todo, rendered):
                 if not result:
                     continue
                 if aname:
@@ -493,13 +555,11 @@ class report_sxw(report_rml, preprocess.report):
                     except Exception:
                         #TODO: should probably raise a proper osv_except instead, shouldn't we? see LP bug #325632
                         logging.getLogger('report').error('Could not create saved report attachment', exc_info=True)
-                results.append(result)
+                results[index] = result
+            results = filter(None, results)
         else:
             if ids:
-                for id in ids:
-                    result = self.create_single_pdf(cr, uid, [id], data, report_xml, context)
-                    if result:
-                        results.append(result)
+                results = filter(None, self.create_pdfs(cr, uid, ids, data, report_xml, context))
             else:
                 # we could have a report with no ids specified
                 result = self.create_single_pdf(cr, uid, ids, data, report_xml, context)
@@ -507,17 +567,37 @@ class report_sxw(report_rml, preprocess.report):
                     results.append(result)
         if results:
             if results[0][1] == 'pdf':
-                from pyPdf import PdfFileWriter, PdfFileReader
-                output = PdfFileWriter()
+                from pdf_merge import PdfMerger
+                output = PdfMerger()
                 for r in results:
-                    reader = PdfFileReader(cStringIO.StringIO(r[0]))
-                    for page in range(reader.getNumPages()):
-                        output.addPage(reader.getPage(page))
-                s = cStringIO.StringIO()
-                output.write(s)
-                return s.getvalue(), results[0][1]
+                    output.append(r[0])
+                return output.getvalue(), results[0][1]
         return False
 
+    def create_pdfs(self, cr, uid, ids, data, report_xml, context=None):
+        """ Render one document per id, in the order of ids
+
+            With [reports] pdf_processes set above 1, pdf documents are
+            rendered by the worker processes started with the server, each
+            with its own cursor: they only see what is committed in the
+            database.
+        """
+        if _pdf_workers is None or len(ids) < 2 or report_xml.report_type != 'pdf':
+            return [self.create_single_pdf(cr, uid, [id], data, report_xml, context)
+                    for id in ids]
+        report_xml = _report_xml_values(report_xml)
+        loaded_at = pooler.get_pool(cr.dbname).loaded_at
+        jobs = [(self.name, cr.dbname, loaded_at, uid, id, data, report_xml, context)
+                for id in ids]
+        try:
+            cPickle.dumps(jobs[0], cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # the job cannot be sent to the workers
+            return [self.create_single_pdf(cr, uid, [id], data, report_xml, context)
+                    for id in ids]
+        return _pdf_workers.map(_render_pdf_worker, jobs,
+                chunksize=max(len(ids) // (_pdf_processes * 4), 1))
+
     def create_single_pdf(self, cr, uid, ids, data, report_xml, context=None):
         if not context:
             context={}
@@ -531,15 +611,36 @@ class report_sxw(report_rml, preprocess.report):
         rml_parser = self.parser(cr, uid, self.name2, context=context)
         objs = self.getObjects(cr, uid, ids, context)
         rml_parser.set_context(objs, data, ids, report_xml.report_type)
+        processed_rml = self.compile_rml(rml, report_xml, rml_parser)
+        if rml_parser.logo:
+            logo = rmlcache.decode_image(rml_parser.logo)
+        create_doc = self.generators[report_xml.report_type]
+        pdf = create_doc(processed_rml,rml_parser.localcontext,logo,title.encode('utf8'))
+        return (pdf, report_xml.report_type)
+
+    def compile_rml(self, rml, report_xml, rml_parser):
+        """ Return the rml template with its header added and preprocessed
+
+            The result only depends on the template and the company
+            headers, it is cached on their content, so that editing the
+            report or the company invalidates it.
+        """
+        key = (self.name, report_xml.report_type, rml,
+               report_xml.header and (self.header,
+                    getattr(rml_parser, 'rml_header', None),
+                    getattr(rml_parser, 'rml_header2', None),
+                    getattr(rml_parser, 'rml_header3', None)))
+        try:
+            return _compiled_rml[key]
+        except KeyError:
+            pass
         processed_rml = etree.XML(rml)
         if report_xml.header:
             rml_parser._add_header(processed_rml, self.header)
         processed_rml = self.preprocess_rml(processed_rml,report_xml.report_type)
-        if rml_parser.logo:
-            logo = base64.decodestring(rml_parser.logo)
-        create_doc = self.generators[report_xml.report_type]
-        pdf = create_doc(etree.tostring(processed_rml),rml_parser.localcontext,logo,title.encode('utf8'))
-        return (pdf, report_xml.report_type)
+        processed_rml = etree.tostring(processed_rml)
+        _compiled_rml[key] = processed_rml
+        return processed_rml
 
     def create_single_odt(self, cr, uid, ids, data, report_xml, context=None):
         if not context:
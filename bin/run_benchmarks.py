@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+""" Benchmarks of the ORM hot paths
+
+    Creates a throwaway database on the PostgreSQL server given by the
+    usual server options, installs base in it, generates partners,
+    partner category trees and translations, then times the main ORM
+    calls. The results are printed as JSON: for each benchmark the wall
+    times of the runs, and the queries they issued, also per SQL verb
+    (from the cursor's sql_stats_log), so that they can be compared
+    from one revision to the next.
+
+    python run_benchmarks.py [benchmark options] [server options]
+
+    Each run is rolled back to a savepoint, so all of them see the same
+    data. The database is dropped at the end, unless --bench-keep.
+
+    The concurrent benchmarks commit their work, and are run last, with
+    --bench-threads threads, followed by the marshalling of the XML-RPC
+    response of a large read().
+"""
+
+import gzip
+import optparse
+import StringIO
+import sys
+import threading
+import time
+import xmlrpclib
+
+parser = optparse.OptionParser(usage="%prog [benchmark options] [server options]")
+parser.disable_interspersed_args()
+parser.add_option("--bench-db", dest="db_name", default="openerp_benchmark",
+        help="name of the database to create (default: %default)")
+parser.add_option("--bench-reuse", dest="reuse", action="store_true", default=False,
+        help="use the database as it is if it already exists")
+parser.add_option("--bench-keep", dest="keep", action="store_true", default=False,
+        help="do not drop the database at the end")
+parser.add_option("--bench-partners", dest="partners", type="int", default=100000,
+        help="number of partners to generate (default: %default)")
+parser.add_option("--bench-depth", dest="depth", type="int", default=5,
+        help="depth of the partner category trees (default: %default)")
+parser.add_option("--bench-width", dest="width", type="int", default=4,
+        help="children of each partner category (default: %default)")
+parser.add_option("--bench-repeat", dest="repeat", type="int", default=5,
+        help="runs of each benchmark (default: %default)")
+parser.add_option("--bench-batch", dest="batch", type="int", default=1000,
+        help="records handled by each benchmark (default: %default)")
+parser.add_option("--bench-only", dest="only", default="",
+        help="comma-separated names of the benchmarks to run")
+parser.add_option("--bench-threads", dest="threads", type="int", default=8,
+        help="threads of the concurrent benchmarks (default: %default)")
+parser.add_option("--bench-output", dest="output", default="-",
+        help="file to write the JSON results to (default: stdout)")
+
+# the remaining arguments are for the server configuration, which is
+# parsed when tools is imported
+bench_args = []
+while len(sys.argv) > 1 and sys.argv[1].startswith('--bench-'):
+    bench_args.append(sys.argv.pop(1))
+    if '=' not in bench_args[-1] and bench_args[-1] not in ('--bench-reuse', '--bench-keep'):
+        bench_args.append(sys.argv.pop(1))
+(opt, args) = parser.parse_args(bench_args)
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import netsvc
+import tools
+import pooler
+import sql_db
+from service import xmlrpc_marshal
+
+
+
+def create_database(db_name):
+    db = sql_db.db_connect('template1')
+    cr = db.cursor()
+    try:
+        cr.autocommit(True)
+        cr.execute("SELECT 1 FROM pg_database WHERE datname=%s", (db_name,))
+        if cr.fetchone():
+            if opt.reuse:
+                return False
+            raise Exception("Database %s already exists, drop it or use --bench-reuse" % db_name)
+        cr.execute("""CREATE DATABASE "%s" ENCODING 'unicode' TEMPLATE "template0" """ % db_name)
+    finally:
+        cr.close()
+    cr = sql_db.db_connect(db_name).cursor()
+    try:
+        tools.init_db(cr)
+        cr.commit()
+    finally:
+        cr.close()
+    return True
+
+def drop_database(db_name):
+    sql_db.close_db(db_name)
+    if db_name in pooler.pool_dic:
+        del pooler.pool_dic[db_name]
+    cr = sql_db.db_connect('template1').cursor()
+    try:
+        cr.autocommit(True)
+        cr.execute('DROP DATABASE "%s"' % db_name)
+    finally:
+        cr.close()
+
+def generate_data(cr, pool):
+    """ Partner category trees with translated names, and partners in
+        some of these categories """
+    category_obj = pool.get('res.partner.category')
+    partner_obj = pool.get('res.partner')
+
+    level = category_obj.create_multi(cr, 1, [{'name': 'Bench %d' % i} for i in range(opt.width)])
+    categories = list(level)
+    for depth in range(1, opt.depth):
+        level = category_obj.create_multi(cr, 1, [
+                {'name': 'Bench %d.%d.%d' % (depth, parent, i), 'parent_id': parent}
+                for parent in level for i in range(opt.width)])
+        categories += level
+    cr.execute("SELECT id, name FROM res_partner_category WHERE id = ANY(%s)", (categories,))
+    rows = cr.fetchall()
+    for sub_rows in tools.misc.split_every(cr.IN_MAX, rows):
+        params = []
+        for id, name in sub_rows:
+            params += ['res.partner.category,name', id, 'fr_FR', 'model', name, 'FR ' + name]
+        cr.execute('INSERT INTO ir_translation (name, res_id, lang, type, src, value) VALUES %s' % \
+                ','.join(['(%s,%s,%s,%s,%s,%s)'] * len(sub_rows)), params)
+
+    leaves = level
+    for start in range(0, opt.partners, 1000):
+        partner_obj.create_multi(cr, 1, [{
+                'name': 'Bench Partner %d' % i,
+                'ref': 'GRP%d' % (i % 50),
+                'customer': bool(i % 2),
+                'category_id': [(6, 0, [leaves[i % len(leaves)], categories[i % opt.width]])],
+            } for i in range(start, min(start + 1000, opt.partners))])
+    cr.commit()
+
+def setup():
+    created = create_database(opt.db_name)
+    db, pool = pooler.restart_pool(opt.db_name, update_module=created)
+    if created:
+        cr = db.cursor()
+        try:
+            start = time.time()
+            generate_data(cr, pool)
+            netsvc.Logger().notifyChannel('benchmark', netsvc.LOG_INFO,
+                    'data generated in %.1fs' % (time.time() - start))
+        finally:
+            cr.close()
+    return db, pool
+
+
+class Benchmarks(object):
+    """ The benchmarks: each bench_* method runs once, on the records
+        of self.ids, and is rolled back afterwards """
+
+    def __init__(self, cr, pool):
+        self.cr = cr
+        self.pool = pool
+        self.partner = pool.get('res.partner')
+        self.category = pool.get('res.partner.category')
+        cr.execute("SELECT id FROM res_partner WHERE name LIKE 'Bench Partner %%' ORDER BY id LIMIT %s", (opt.batch,))
+        self.ids = [x[0] for x in cr.fetchall()]
+        cr.execute("SELECT id FROM res_partner_category WHERE parent_id IS NULL AND name LIKE 'Bench %%' ORDER BY id")
+        self.roots = [x[0] for x in cr.fetchall()]
+
+    def bench_read(self):
+        self.partner.read(self.cr, 1, self.ids, ['name', 'ref', 'customer', 'category_id'])
+
+    def bench_read_translated(self):
+        category_ids = self.category.search(self.cr, 1, [('name', 'like', 'Bench')], limit=opt.batch)
+        self.category.read(self.cr, 1, category_ids, ['name', 'parent_id'], context={'lang': 'fr_FR'})
+
+    def bench_search_read(self):
+        self.partner.search_read(self.cr, 1, [('ref', '=', 'GRP7')], limit=opt.batch,
+                                 fields=['name', 'ref'])
+
+    def bench_search_child_of(self):
+        self.partner.search(self.cr, 1, [('category_id', 'child_of', self.roots[0])], limit=opt.batch)
+
+    def bench_browse(self):
+        for partner in self.partner.browse(self.cr, 1, self.ids):
+            partner.name
+            for category in partner.category_id:
+                category.name
+                category.parent_id.name
+
+    def bench_write(self):
+        self.partner.write(self.cr, 1, self.ids, {'ref': 'BENCH', 'customer': True})
+
+    def bench_create(self):
+        for i in range(opt.batch):
+            self.partner.create(self.cr, 1, {'name': 'Created %d' % i,
+                    'category_id': [(6, 0, self.roots)]})
+
+    def bench_create_multi(self):
+        self.partner.create_multi(self.cr, 1, [{'name': 'Created %d' % i,
+                'category_id': [(6, 0, self.roots)]} for i in range(opt.batch)])
+
+    def bench_unlink(self):
+        self.partner.unlink(self.cr, 1, self.ids)
+
+    def bench_name_search(self):
+        for i in range(0, 100):
+            self.partner.name_search(self.cr, 1, 'Bench Partner %d' % i, limit=8)
+
+    def bench_read_group(self):
+        self.partner.read_group(self.cr, 1, [], ['ref', 'customer'], ['ref'])
+
+    def bench_fields_view_get(self):
+        for view_type in ('form', 'tree', 'search'):
+            self.partner.fields_view_get(self.cr, 1, view_type=view_type, toolbar=True)
+
+    def bench_export_data(self):
+        self.partner.export_data(self.cr, 1, self.ids, ['name', 'ref', 'category_id/name'])
+
+    def names(self):
+        names = sorted(name[6:] for name in dir(self) if name.startswith('bench_'))
+        if opt.only:
+            names = [name for name in names if name in opt.only.split(',')]
+        return names
+
+    def run(self, name):
+        cr = self.cr
+        fn = getattr(self, 'bench_' + name)
+        times = []
+        queries = []
+        for i in range(opt.repeat):
+            cr.execute('SAVEPOINT benchmark')
+            count = cr.query_count
+            start = time.time()
+            fn()
+            times.append(time.time() - start)
+            queries.append(cr.query_count - count)
+            cr.execute('ROLLBACK TO SAVEPOINT benchmark')
+        # the statistics per table and verb are only kept when sql_log is
+        # set, which logs every query: they come from one more run, not
+        # timed. sql_log is not set around the savepoints, which would be
+        # logged as stray queries
+        cr.execute('SAVEPOINT benchmark')
+        cr.sql_stats_log = {}
+        cr.sql_log = True
+        try:
+            fn()
+        finally:
+            cr.sql_log = False
+        stats = cr.sql_stats_log
+        cr.sql_stats_log = {}
+        cr.execute('ROLLBACK TO SAVEPOINT benchmark')
+        by_kind = {}
+        for (table, kind), st in stats.items():
+            by_kind[kind] = by_kind.get(kind, 0) + st[0]
+        times.sort()
+        return {
+            'runs': times,
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'queries': queries[-1],
+            'queries_by_kind': by_kind,
+        }
+
+
+def concurrent_sequences(db, pool):
+    """ Numbers taken concurrently from one ir.sequence, by opt.threads
+        threads, in transactions which last 10ms after taking their
+        number, for each implementation of the sequences """
+    sequence_obj = pool.get('ir.sequence')
+    results = {}
+    for implementation in ('no_gap', 'standard'):
+        cr = db.cursor()
+        try:
+            seq_id = sequence_obj.create(cr, 1, {'name': 'Benchmark', 'code': 'benchmark',
+                                                 'implementation': implementation})
+            cr.commit()
+        finally:
+            cr.close()
+
+        def worker():
+            cr = db.cursor()
+            try:
+                for i in range(opt.batch // opt.threads):
+                    sequence_obj.get_id(cr, 1, seq_id)
+                    time.sleep(0.01)
+                    cr.commit()
+            finally:
+                cr.close()
+
+        threads = [threading.Thread(target=worker) for i in range(opt.threads)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        count = opt.batch // opt.threads * opt.threads
+        results['concurrent_sequence_' + implementation] = {
+            'threads': opt.threads,
+            'numbers': count,
+            'time': elapsed,
+            'numbers_per_second': count / elapsed,
+        }
+
+        cr = db.cursor()
+        try:
+            sequence_obj.unlink(cr, 1, [seq_id])
+            cr.commit()
+        finally:
+            cr.close()
+    return results
+
+def xmlrpc_responses(db, pool):
+    """ Marshalling of the XML-RPC response of a read() of 10000 partners,
+        by xmlrpclib and gzip as the server did before, and by
+        xmlrpc_marshal, plain and compressed """
+    cr = db.cursor()
+    try:
+        partner_obj = pool.get('res.partner')
+        ids = partner_obj.search(cr, 1, [], limit=10000)
+        rows = partner_obj.read(cr, 1, ids, ['name', 'ref', 'customer', 'supplier',
+                'category_id', 'parent_id', 'date', 'website', 'comment'])
+    finally:
+        cr.close()
+
+    def stock(compress):
+        response = xmlrpclib.dumps((rows,), methodresponse=1)
+        if compress:
+            buf = StringIO.StringIO()
+            output = gzip.GzipFile(mode='wb', fileobj=buf)
+            output.write(response)
+            output.close()
+            response = buf.getvalue()
+        return len(response)
+
+    def fast(compress):
+        writer = xmlrpc_marshal.ResponseWriter(compress=compress)
+        xmlrpc_marshal.dump_response((rows,), writer.write)
+        return sum(map(len, writer.close()))
+
+    results = {}
+    for name, fn in (('stock', stock), ('fast', fast)):
+        for compress in (False, True):
+            times = []
+            for i in range(opt.repeat):
+                start = time.time()
+                size = fn(compress)
+                times.append(time.time() - start)
+            times.sort()
+            results['xmlrpc_response_%s%s' % (name, compress and '_gzip' or '')] = {
+                'rows': len(rows),
+                'bytes': size,
+                'runs': times,
+                'min': times[0],
+                'median': times[len(times) // 2],
+            }
+    return results
+
+def main():
+    db, pool = setup()
+    results = {}
+    cr = db.cursor()
+    try:
+        benchmarks = Benchmarks(cr, pool)
+        for name in benchmarks.names():
+            results[name] = benchmarks.run(name)
+        cr.rollback()
+    finally:
+        cr.close()
+    if not opt.only or 'concurrent_sequences' in opt.only.split(','):
+        results.update(concurrent_sequences(db, pool))
+    if not opt.only or 'xmlrpc_responses' in opt.only.split(','):
+        results.update(xmlrpc_responses(db, pool))
+    if not opt.keep:
+        drop_database(opt.db_name)
+    output = json.dumps({
+        'database': opt.db_name,
+        'partners': opt.partners,
+        'batch': opt.batch,
+        'repeat': opt.repeat,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if opt.output == '-':
+        print output
+    else:
+        f = open(opt.output, 'w')
+        try:
+            f.write(output)
+        finally:
+            f.close()
+
+if __name__ == '__main__':
+    main()
+    netsvc.Agent.quit()
@@ -51,7 +51,9 @@ import select
 import socket
 import re
 import xmlrpclib
-import StringIO
+import zlib
+
+import xmlrpc_marshal
 
 from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 
@@ -402,7 +404,6 @@ def list_http_services(protocol=None):
     raise Exception("Incorrect protocol or no http services")
 
 import SimpleXMLRPCServer
-import gzip
 
 class xrBaseRequestHandler(FixSendError, HttpLogHandler, SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
     rpc_paths = []
@@ -443,27 +444,23 @@ class xrBaseRequestHandler(FixSendError, HttpLogHandler, SimpleXMLRPCServer.Simp
             max_chunk_size = 10*1024*1024
             clen = int(self.headers["content-length"])
             rbuffer = BoundStream(self.rfile, clen, chunk_size=max_chunk_size)
-            data = ''
+            decompressor = None
             if self.headers.get('content-encoding',False) == 'gzip':
-                rbuffer = gzip.GzipFile(mode='rb', fileobj=rbuffer)
-
-            try:
-                while True:
-                    chunk = rbuffer.read()
-                    if not chunk:
-                        break
-                    data += chunk
-            except EOFError:
-                pass
-
-            # In previous versions of SimpleXMLRPCServer, _dispatch
-            # could be overridden in this class, instead of in
-            # SimpleXMLRPCDispatcher. To maintain backwards compatibility,
-            # check to see if a subclass implements _dispatch and dispatch
-            # using that method if present.
-            response = self.server._marshaled_dispatch(
-                    data, getattr(self, '_dispatch', None)
-                )
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks = []
+            while True:
+                chunk = rbuffer.read()
+                if not chunk:
+                    break
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                chunks.append(chunk)
+
+            accept = [x.split(';')[0].strip() for x in self.headers.get('Accept-Encoding', '').split(',')]
+            writer = xmlrpc_marshal.ResponseWriter(compress='gzip' in accept)
+            xmlrpc_marshal.marshaled_dispatch(chunks, self._dispatch, writer,
+                    allow_none=self.server.allow_none, encoding=self.server.encoding)
+            response = writer.close()
 
         except Exception, e: # This should only happen if the module is buggy
             # internal error, report as HTTP server error
@@ -481,25 +478,12 @@ class xrBaseRequestHandler(FixSendError, HttpLogHandler, SimpleXMLRPCServer.Simp
             # got a valid XML RPC response
             self.send_response(200)
             self.send_header("Content-type", "text/xml")
-            
-            if response \
-                    and 'gzip' in self.headers.get('Accept-Encoding', '').split(',') \
-                    and len(response) > 512:
-                buffer = StringIO.StringIO()
-                output = gzip.GzipFile(mode='wb', fileobj=buffer)
-                if isinstance(response, (str, unicode)):
-                    output.write(response)
-                else:
-                    for buf in response:
-                        output.write(buf)
-                output.close()
-                buffer.seek(0)
-                response = buffer.getvalue()
+            if writer.compressed:
                 self.send_header('Content-Encoding', 'gzip')
-
-            self.send_header("Content-length", str(len(response)))
+            self.send_header("Content-length", str(sum(map(len, response))))
             self.end_headers()
-            self.wfile.write(response)
+            for chunk in response:
+                self.wfile.write(chunk)
             self.wfile.flush()
 
 class XMLRPCRequestHandler(netsvc.OpenERPDispatcher,xrBaseRequestHandler):
@@ -26,6 +26,7 @@
     
 """
 import logging
+import Queue
 import select
 import socket
 import sys
@@ -46,6 +47,13 @@ class TinySocketClientThread(threading.Thread, netsvc.OpenERPDispatcher):
         # clients connection when they're idle for 20min.
         self.sock.settimeout(1200)
         self.threads = threads
+        # workers of the pipelined requests, see _pipeline()
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._inflight = threading.BoundedSemaphore(
+            max(int(tools.config.get_misc('netrpcd', 'max_inflight', 8)), 1))
 
     def __del__(self):
         if self.sock:
@@ -60,7 +68,8 @@ class TinySocketClientThread(threading.Thread, netsvc.OpenERPDispatcher):
     def run(self):
         self.running = True
         try:
-            ts = tiny_socket.mysocket(self.sock)
+            ts = tiny_socket.mysocket(self.sock, max_size=int(tools.config.get_misc(
+                    'netrpcd', 'max_frame_size', tiny_socket.MAX_FRAME_SIZE)))
         except Exception:
             self.threads.remove(self)
             self.running = False
@@ -69,35 +78,102 @@ class TinySocketClientThread(threading.Thread, netsvc.OpenERPDispatcher):
         while self.running:
             try:
                 msg = ts.myreceive()
-                result = self.dispatch(msg[0], msg[1], msg[2:])
-                ts.mysend(result)
             except socket.timeout:
                 #terminate this channel because other endpoint is gone
                 break
-            except netsvc.OpenERPDispatcherException, e:
-                try:
-                    new_e = Exception(e.compat_string()) # avoid problems of pickeling
-                    logging.getLogger('web-services').debug("netrpc: rpc-dispatching exception", exc_info=True)
-                    ts.mysend(new_e, exception=True, traceback=e.traceback)
-                except Exception:
-                    #terminate this channel if we can't properly send back the error
-                    logging.getLogger('web-services').exception("netrpc: cannot deliver exception message to client")
-                    break
+            except tiny_socket.ProtocolError, e:
+                # tell the client why, then terminate the channel: the rest
+                # of the stream cannot be read
+                self._send_exception(ts, e, ts.request_id)
+                break
             except Exception, e:
-                try:
-                    tb = getattr(e, 'traceback', sys.exc_info())
-                    tb_s = "".join(traceback.format_exception(*tb))
-                    logging.getLogger('web-services').debug("netrpc: communication-level exception", exc_info=True)
-                    ts.mysend(e, exception=True, traceback=tb_s)
-                except Exception, ex:
-                    #terminate this channel if we can't properly send back the error
-                    logging.getLogger('web-services').exception("netrpc: cannot deliver exception message to client")
+                if not self._send_exception(ts, e, ts.request_id):
                     break
+                continue
+            if ts.version >= 3:
+                # the client may pipeline its requests
+                self._pipeline(ts, msg, ts.request_id)
+            elif not self._handle(ts, msg):
+                break
 
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
         self.threads.remove(self)
         self.running = False
         return True
 
+    def _handle(self, ts, msg, request_id=0):
+        """ Dispatches the request msg and sends its result back, returns
+            False if the channel must be terminated """
+        try:
+            result = self.dispatch(msg[0], msg[1], msg[2:])
+            ts.mysend(result, request_id=request_id)
+        except socket.timeout:
+            #terminate this channel because other endpoint is gone
+            return False
+        except netsvc.OpenERPDispatcherException, e:
+            try:
+                new_e = Exception(e.compat_string()) # avoid problems of pickeling
+                logging.getLogger('web-services').debug("netrpc: rpc-dispatching exception", exc_info=True)
+                ts.mysend(new_e, exception=True, traceback=e.traceback, request_id=request_id)
+            except Exception:
+                #terminate this channel if we can't properly send back the error
+                logging.getLogger('web-services').exception("netrpc: cannot deliver exception message to client")
+                return False
+        except Exception, e:
+            return self._send_exception(ts, e, request_id)
+        return True
+
+    def _send_exception(self, ts, e, request_id):
+        try:
+            tb = getattr(e, 'traceback', sys.exc_info())
+            tb_s = "".join(traceback.format_exception(*tb))
+            logging.getLogger('web-services').debug("netrpc: communication-level exception", exc_info=True)
+            ts.mysend(e, exception=True, traceback=tb_s, request_id=request_id)
+        except Exception, ex:
+            #terminate this channel if we can't properly send back the error
+            logging.getLogger('web-services').exception("netrpc: cannot deliver exception message to client")
+            return False
+        return True
+
+    def _pipeline(self, ts, msg, request_id):
+        """ Hands the request over to the workers of this channel, waiting
+            while max_inflight requests are already being processed """
+        self._inflight.acquire()
+        self._lock.acquire()
+        try:
+            self._pending += 1
+            if self._pending > len(self._workers):
+                worker = threading.Thread(target=self._worker,
+                        name="%s-worker-%d" % (self.name, len(self._workers)))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        finally:
+            self._lock.release()
+        self._queue.put((ts, msg, request_id))
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                if not self._handle(*job):
+                    self.running = False
+                    # wake the reader up
+                    try:
+                        self.sock.shutdown(getattr(socket, 'SHUT_RDWR', 2))
+                    except Exception:
+                        pass
+            finally:
+                self._lock.acquire()
+                self._pending -= 1
+                self._lock.release()
+                self._inflight.release()
+
     def stop(self):
         self.running = False
 
@@ -21,6 +21,7 @@
 
 import addons
 import base64
+import heapq
 import ir
 import locale
 import logging
@@ -32,10 +33,12 @@ import release
 import security
 import sql_db
 import sys
+import tempfile
 import threading
 import time
 import tools
 from tools.translate import _
+from report.render.rml2pdf import rmlcache
 from cStringIO import StringIO
 
 #.apidoc title: Exported Service methods
@@ -441,7 +444,8 @@ class common(_ObjectService):
                         'get_loglevel', 'get_sqlcount', 'get_sql_stats',
                         'reset_sql_stats',
                         'get_garbage_stats',
-                        'get_os_time']
+                        'get_os_time', 'get_rpc_profiles',
+                        'set_rpc_profiler']
                 }
     def __init__(self,name="common"):
         _ObjectService.__init__(self,name)
@@ -733,6 +737,17 @@ GNU Public Licence.
         sql_db._Pool.sql_stats = {}
         return True
 
+    def exp_get_rpc_profiles(self, limit=None):
+        """Return the last profiles of the sampled RPC requests, most
+        recent first, see tools.profiler
+        """
+        return tools.profiler.get_profiles(limit)
+
+    def exp_set_rpc_profiler(self, rate):
+        """Set the fraction of the RPC requests to profile, 0 to stop"""
+        tools.profiler.set_rate(rate)
+        return True
+
     def exp_get_garbage_stats(self):
         import gc
         garbage_count = {}
@@ -910,6 +925,12 @@ wizard()
 # Report state:
 #     False -> True
 #
+# Report jobs are not threads of their own any more: they are queued into
+# a report_scheduler, which runs them on a bounded pool of worker threads.
+# Finished documents are spooled to temporary files until the client
+# fetches them with report_get, and forgotten after [reports] expiry
+# seconds if it never does.
+#
 
 class ExceptionWithTraceback(Exception):
     def __init__(self, msg, tb):
@@ -917,8 +938,8 @@ class ExceptionWithTraceback(Exception):
         self.traceback = tb
         self.args = (msg, tb)
 
-class _report_spool_job(threading.Thread):
-    def __init__(self, id, db, uid, obj, ids, datas=None, context=None):
+class _report_spool_job(object):
+    def __init__(self, id, db, uid, obj, ids, datas=None, context=None, priority=10):
         """A report job, that should be spooled in the background
 
         @param id the index at the parent spool list, shall not be trusted,
@@ -928,8 +949,8 @@ class _report_spool_job(threading.Thread):
         @param obj the report orm object (string w/o the 'report.' prefix)
         @param ids of the obj model
         @param datas dictionary of input to report
+        @param priority jobs with a lower value are started first
         """
-        threading.Thread.__init__(self)
         self.id = id
         self.uid = uid
         self.db = db
@@ -939,13 +960,22 @@ class _report_spool_job(threading.Thread):
         self.context = context
         if self.context is None:
             self.context = {}
+        self.priority = priority
         self.result = False
         self.format = None
         self.state = False
         self.exception = None
+        self.cr = None
+        self.must_stop = False
+        self.spool_file = None
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
         self.name = "report-%s-%s" % (self.report_obj, self.id)
 
     def run(self):
+        self.started = time.time()
         try:
             self.cr = pooler.get_db(self.db).cursor()
             self.go()
@@ -966,15 +996,31 @@ class _report_spool_job(threading.Thread):
             self.exception = ExceptionWithTraceback('KeyboardInterrupt of report: %r' % self, tb)
             self.state = True
             # we don't need to raise higher, because we already printed the tb
-            # and are exiting the thread loop.
+            # and are exiting the worker loop.
             return
         finally:
             if self.cr:
                 self.cr.close()
                 self.cr = None
+            self.finished = time.time()
+            self._done.set()
         return True
-        
-        
+
+    def is_alive(self):
+        """True while a worker is rendering this job"""
+        return bool(self.started) and not self._done.isSet()
+
+    def join(self, timeout=None):
+        """Wait until the job is finished (or cancelled)"""
+        self._done.wait(timeout)
+
+    def cancel(self):
+        """Mark a job that never reached a worker as finished and failed"""
+        self.exception = ExceptionWithTraceback('Report %r was stopped before it started' % self, None)
+        self.state = True
+        self.finished = time.time()
+        self._done.set()
+
     def stop(self):
         """Try to kill the job.
         
@@ -999,11 +1045,162 @@ class _report_spool_job(threading.Thread):
         if not result:
             tb = sys.exc_info()
             self.exception = ExceptionWithTraceback('RML is not available at specified location or not enough data to print!', tb)
-        self.result = result
+        #CHECKME: why is this needed???
+        if isinstance(result, unicode):
+            result = result.encode('latin1', 'replace')
+        self._spool(result)
         self.format = format
         self.state = True
         return True
 
+    def _spool(self, result):
+        """Keep the rendered document on disk rather than in memory"""
+        if not result:
+            self.result = result
+            return
+        fd, self.spool_file = tempfile.mkstemp(prefix='openerp-report-')
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(result)
+        finally:
+            f.close()
+        self.result = len(result)
+
+    def get_result(self):
+        """Return the rendered document, reading it back from the spool"""
+        if not self.spool_file:
+            return self.result
+        f = open(self.spool_file, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def discard(self):
+        """Release the spooled document, if any"""
+        if self.spool_file:
+            try:
+                os.unlink(self.spool_file)
+            except OSError:
+                pass
+            self.spool_file = None
+
+class report_scheduler(object):
+    """ Runs report jobs on a bounded pool of worker threads
+
+        Jobs wait in one queue per user, where the job with the lowest
+        priority value comes first. A free worker takes the first job of
+        the user that has the fewest jobs running, then of the oldest
+        one: the priorities, given by the clients, only order the jobs of
+        a same user. A user never occupies more than [reports]
+        max_per_user workers (0 means no limit).
+    """
+    _logger = logging.getLogger('web-services')
+
+    def __init__(self, workers=4, max_per_user=0):
+        self.workers = max(int(workers), 1)
+        self.max_per_user = int(max_per_user)
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._running = {}
+        self._threads = []
+        self._seq = 0
+        # finished jobs, total wait and total run time, longest wait
+        self.done_count = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.wait_max = 0.0
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker,
+                        name="report-worker-%d" % len(self._threads))
+            t.setDaemon(True)
+            self._threads.append(t)
+            t.start()
+
+    def push(self, job):
+        self._cond.acquire()
+        try:
+            self._seq += 1
+            heapq.heappush(self._queues.setdefault(job.uid, []),
+                           (job.priority, self._seq, job))
+            self._start_workers()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def remove(self, job):
+        """Take a job out of its queue, return False if it already left it"""
+        self._cond.acquire()
+        try:
+            queue = self._queues.get(job.uid, [])
+            for i, item in enumerate(queue):
+                if item[2] is job:
+                    queue.pop(i)
+                    heapq.heapify(queue)
+                    return True
+            return False
+        finally:
+            self._cond.release()
+
+    def _pick(self):
+        best = None
+        for uid, queue in self._queues.items():
+            if not queue:
+                continue
+            running = self._running.get(uid, 0)
+            if self.max_per_user and running >= self.max_per_user:
+                continue
+            key = (running, queue[0][1])
+            if best is None or key < best[0]:
+                best = (key, uid)
+        if best is None:
+            return None
+        return heapq.heappop(self._queues[best[1]])[2]
+
+    def _worker(self):
+        while True:
+            self._cond.acquire()
+            try:
+                job = self._pick()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick()
+                self._running[job.uid] = self._running.get(job.uid, 0) + 1
+            finally:
+                self._cond.release()
+            try:
+                job.run()
+            except Exception:
+                self._logger.exception('Report worker failed on %r', job)
+            self._cond.acquire()
+            try:
+                self._running[job.uid] -= 1
+                wait = (job.started or job.queued) - job.queued
+                self.done_count += 1
+                self.wait_total += wait
+                self.run_total += (job.finished or time.time()) - (job.started or job.queued)
+                self.wait_max = max(self.wait_max, wait)
+                self._cond.notify()
+            finally:
+                self._cond.release()
+
+    def depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def running(self):
+        return sum(self._running.values())
+
+    def stats(self):
+        ret = '%d queued, %d running on %d workers' % \
+                (self.depth(), self.running(), self.workers)
+        if self.done_count:
+            ret += ', %d done: wait avg %.2fs max %.2fs, run avg %.2fs' % \
+                (self.done_count, self.wait_total / self.done_count,
+                 self.wait_max, self.run_total / self.done_count)
+        return ret
+
 class report_spool(dbExportDispatch, baseExportService):
     _auth_commands = { 'db': ['report','report_get', 'report_stop'] }
     def __init__(self, name='report'):
@@ -1012,6 +1209,10 @@ class report_spool(dbExportDispatch, baseExportService):
         self._reports = {}
         self.id = 0
         self.id_protect = threading.Semaphore()
+        self.scheduler = report_scheduler(
+                workers=tools.config.get_misc('reports', 'workers', 4),
+                max_per_user=tools.config.get_misc('reports', 'max_per_user', 0))
+        self.expiry = float(tools.config.get_misc('reports', 'expiry', 3600))
 
     def dispatch(self, method, auth, params):
         (db, uid, passwd ) = params[0:3]
@@ -1024,56 +1225,79 @@ class report_spool(dbExportDispatch, baseExportService):
         return res
 
     def stats(self, _pre_msg=None):
-        ret = baseExportService.stats(self, _pre_msg='%d reports' % len(self._reports))
+        self._expire()
+        ret = baseExportService.stats(self, _pre_msg='%d reports, %s' % \
+                    (len(self._reports), self.scheduler.stats()))
+        ret += '\n    rml cache: ' + rmlcache.stats()
         for id, r in self._reports.items():
             if not r:
                 continue
             ret += '\n    [%d] ' % id
-            if r.is_alive() or not r.state:
+            if r.is_alive():
                 ret += 'running '
+            elif not r.state:
+                ret += 'queued '
             else:
                 ret += 'finished '
             ret += repr(r)
         return ret
 
+    def _expire(self):
+        """Drop finished reports that nobody came to fetch"""
+        if not self.expiry:
+            return
+        limit = time.time() - self.expiry
+        self.id_protect.acquire()
+        try:
+            for id, r in self._reports.items():
+                if r.state and r.finished and r.finished < limit:
+                    del self._reports[id]
+                    r.discard()
+                    self._logger.info('Report %r expired without being fetched', r)
+        finally:
+            self.id_protect.release()
+
     def exp_report(self, db, uid, object, ids, datas=None, context=None):
         if not datas:
             datas={}
         if not context:
             context={}
+        self._expire()
 
         self.id_protect.acquire()
         self.id += 1
         id = self.id
         self.id_protect.release()
 
-        self._reports[id] = _report_spool_job(id, db, uid, object, ids, datas=datas, context=context)
-        self._reports[id].start()
+        job = _report_spool_job(id, db, uid, object, ids, datas=datas,
+                    context=context, priority=context.get('report_priority', 10))
+        self._reports[id] = job
+        self.scheduler.push(job)
         return id
 
     def _check_report(self, report_id):
         report = self._reports[report_id]
         exc = report.exception
         if exc:
+            self.id_protect.acquire()
+            self._reports.pop(report_id, None)
+            self.id_protect.release()
+            report.discard()
             self.abortResponse(1, exc.__class__.__name__, 'warning', exc.message)
         res = {'state': report.state }
         if res['state']:
-            if tools.config['reportgz']:
+            res2 = report.get_result()
+            if res2 and tools.config['reportgz']:
                 import zlib
-                res2 = zlib.compress(report.result)
+                res2 = zlib.compress(res2)
                 res['code'] = 'zlib'
-            else:
-                #CHECKME: why is this needed???
-                if isinstance(report.result, unicode):
-                    res2 = report.result.encode('latin1', 'replace')
-                else:
-                    res2 = report.result
             if res2:
                 res['result'] = base64.encodestring(res2)
             res['format'] = report.format
             self.id_protect.acquire()
             del self._reports[report_id]
             self.id_protect.release()
+            report.discard()
         return res
 
     def exp_report_get(self, db, uid, report_id):
@@ -1098,6 +1322,9 @@ class report_spool(dbExportDispatch, baseExportService):
         if report_id in self._reports:
             report = self._reports[report_id]
             if report.uid == uid or uid == 1:
+                if not report.state and self.scheduler.remove(report):
+                    report.cancel()
+                    return True
                 if report.is_alive() and not report.state:
                     report.stop()
                     report.join(timeout=timeout)
@@ -1116,4 +1343,3 @@ report_spool()
 
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
-
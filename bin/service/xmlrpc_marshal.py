@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+#.apidoc title: XML-RPC marshalling
+
+""" Faster marshalling of the XML-RPC responses
+
+    `dump_response()` writes the same XML as xmlrpclib.dumps(), but with a
+    single function and one write per value for the plain types, instead of
+    the method calls of xmlrpclib.Marshaller, which dominate the cost of the
+    large responses. The other types (DateTime, Binary, datetime, objects)
+    are still written by xmlrpclib.Marshaller.
+
+    The requests are parsed by the expat parser of xmlrpclib, fed with the
+    chunks of the body as they are read, and the responses are compressed
+    as they are marshalled by a `ResponseWriter`.
+"""
+
+import sys
+import xmlrpclib
+import zlib
+
+MAXINT = xmlrpclib.MAXINT
+MININT = xmlrpclib.MININT
+
+# write() calls buffered before the response is compressed
+_BATCH_SIZE = 1024
+
+def _escape(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def dump_response(params, write, encoding=None, allow_none=False):
+    """ Writes the methodResponse of params, a singleton tuple or a Fault,
+        as xmlrpclib.dumps(params, methodresponse=True) would """
+    if not encoding:
+        encoding = 'utf-8'
+    memo = {}
+    marshaller = []
+    # the "<member><name>" lines, for the keys seen so far
+    members = {}
+
+    def scalar(value, t):
+        """ The XML of value if it is of a plain, non-container type """
+        if t is str:
+            return "<value><string>%s</string></value>\n" % _escape(value)
+        elif t is unicode:
+            return "<value><string>%s</string></value>\n" % \
+                   _escape(value).encode(encoding, 'xmlcharrefreplace')
+        elif t is int or t is long:
+            if value > MAXINT or value < MININT:
+                raise OverflowError, "int exceeds XML-RPC limits"
+            return "<value><int>%d</int></value>\n" % value
+        elif t is bool:
+            return value and "<value><boolean>1</boolean></value>\n" \
+                          or "<value><boolean>0</boolean></value>\n"
+        elif value is None:
+            if not allow_none:
+                raise TypeError, "cannot marshal None unless allow_none is enabled"
+            return "<value><nil/></value>"
+        elif t is float:
+            return "<value><double>%s</double></value>\n" % repr(value)
+        return None
+
+    def member(k):
+        if type(k) is str:
+            name = _escape(k)
+        elif type(k) is unicode:
+            name = _escape(k).encode(encoding, 'xmlcharrefreplace')
+        else:
+            raise TypeError, "dictionary key must be string"
+        res = members[k] = "<member>\n<name>%s</name>\n" % name
+        return res
+
+    def dump(value):
+        t = type(value)
+        if t is list or t is tuple:
+            i = id(value)
+            if i in memo:
+                raise TypeError, "cannot marshal recursive sequences"
+            memo[i] = None
+            write("<value><array><data>\n")
+            for v in value:
+                x = scalar(v, type(v))
+                if x is None:
+                    dump(v)
+                else:
+                    write(x)
+            write("</data></array></value>\n")
+            del memo[i]
+        elif t is dict:
+            i = id(value)
+            if i in memo:
+                raise TypeError, "cannot marshal recursive dictionaries"
+            memo[i] = None
+            write("<value><struct>\n")
+            for k, v in value.iteritems():
+                m = members.get(k)
+                if m is None:
+                    m = member(k)
+                x = scalar(v, type(v))
+                if x is None:
+                    write(m)
+                    dump(v)
+                    write("</member>\n")
+                else:
+                    write(m + x + "</member>\n")
+            write("</struct></value>\n")
+            del memo[i]
+        else:
+            x = scalar(value, t)
+            if x is not None:
+                write(x)
+                return
+            if not marshaller:
+                marshaller.append(xmlrpclib.Marshaller(encoding, allow_none))
+            # the private dispatcher of the Marshaller, which knows the
+            # wrappers and objects
+            marshaller[0]._Marshaller__dump(value, write)
+
+    if encoding != 'utf-8':
+        write("<?xml version='1.0' encoding='%s'?>\n" % str(encoding))
+    else:
+        write("<?xml version='1.0'?>\n")
+    write("<methodResponse>\n")
+    if isinstance(params, xmlrpclib.Fault):
+        write("<fault>\n")
+        dump({'faultCode': params.faultCode, 'faultString': params.faultString})
+        write("</fault>\n")
+    else:
+        assert isinstance(params, tuple) and len(params) == 1, \
+               "response tuple must be a singleton"
+        write("<params>\n<param>\n")
+        dump(params[0])
+        write("</param>\n</params>\n")
+    write("</methodResponse>\n")
+
+def dumps(params, encoding=None, allow_none=False):
+    """ Same as xmlrpclib.dumps(params, methodresponse=True) """
+    out = []
+    dump_response(params, out.append, encoding, allow_none)
+    return ''.join(out)
+
+def loads(chunks, use_datetime=0):
+    """ Same as xmlrpclib.loads(''.join(chunks)), without joining them """
+    parser, unmarshaller = xmlrpclib.getparser(use_datetime=use_datetime)
+    # one data event per text node, rather than per line or buffer
+    expat = getattr(parser, '_parser', None)
+    if expat is not None:
+        expat.buffer_text = True
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return unmarshaller.close(), unmarshaller.getmethodname()
+
+
+class ResponseWriter(object):
+    """ Collects the chunks of a response, written by dump_response()
+
+        With compress, the response is compressed in the gzip format as
+        it is written, once it is larger than min_size.
+    """
+
+    def __init__(self, compress=False, min_size=512, level=6):
+        self._compress = compress
+        self._min_size = min_size
+        self._level = level
+        self.reset()
+
+    def reset(self):
+        """ Drops what was written so far """
+        self._pending = []
+        self._chunks = []
+        self._size = 0
+        self._compressor = None
+
+    @property
+    def compressed(self):
+        return self._compressor is not None
+
+    def write(self, data):
+        self._pending.append(data)
+        if len(self._pending) >= _BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        data = ''.join(self._pending)
+        del self._pending[:]
+        if self._compressor is not None:
+            self._chunks.append(self._compressor.compress(data))
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._compress and self._size > self._min_size:
+            self._compressor = zlib.compressobj(self._level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._chunks = [self._compressor.compress(''.join(self._chunks))]
+
+    def close(self):
+        """ Returns the list of the chunks of the response """
+        self._flush()
+        if self._compressor is not None:
+            self._chunks.append(self._compressor.flush())
+        return self._chunks
+
+
+def marshaled_dispatch(chunks, dispatch_method, writer, allow_none=False, encoding=None):
+    """ Dispatches the XML-RPC request in chunks, and writes its response
+        to writer, like SimpleXMLRPCDispatcher._marshaled_dispatch() """
+    try:
+        params, method = loads(chunks)
+        response = (dispatch_method(method, params),)
+        dump_response(response, writer.write, encoding, allow_none)
+        return
+    except xmlrpclib.Fault, fault:
+        pass
+    except:
+        # report exception back to server
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        fault = xmlrpclib.Fault(1, "%s:%s" % (exc_type, exc_value))
+    writer.reset()
+    dump_response(fault, writer.write, encoding, allow_none)
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
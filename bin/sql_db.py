@@ -67,10 +67,12 @@ psycopg2.extensions.register_type(psycopg2.extensions.new_type((700, 701, 1700,)
 
 import tools
 from tools.func import wraps, frame_codeinfo
+from tools import profiler
 from netsvc import Agent
 from datetime import datetime as mdt
 from datetime import timedelta
 import threading
+import time
 from inspect import currentframe
 
 import re
@@ -167,6 +169,8 @@ class Cursor(object):
         self.sql_log = self.__logger.isEnabledFor(logging.DEBUG_SQL)
 
         self.sql_log_count = 0
+        # plain count of all queries, always kept (unlike sql_log_count)
+        self.query_count = 0
         self.__closed = True    # avoid the call of close() (by __del__) if an exception
                                 # is raised by any of the following initialisations
         self._pool = pool
@@ -213,7 +217,8 @@ class Cursor(object):
     def execute(self, query, params=None, debug=False, log_exceptions=True, _fast=False):
         """ Execute some SQL command
             @param debug   Verbosely log the query being sent (not results, yet)
-            @param log_exceptions ignored, left there mainly for API compatibility with trunk
+            @param log_exceptions log the failures of the query, unset it
+                   when they are expected and handled by the caller
         """
             
         if params and not _fast:
@@ -224,23 +229,32 @@ class Cursor(object):
 
         if self.sql_log or debug:
             now = mdt.now()
+        profile = profiler.current()
+        if profile is not None:
+            start = time.time()
 
         # The core of query execution
         try:
             params = params or None
             res = self._obj.execute(query, params)
         except OperationalError, oe:
-            self.__logger.exception("Postgres Operational error: %s", oe)
+            if log_exceptions:
+                self.__logger.exception("Postgres Operational error: %s", oe)
             self.status = False
             raise
         except psycopg2.ProgrammingError, pe:
-            self.__logger.exception("Programming error: %s, in query %s" % (pe, query))
-            self.__logger.error("bad query: %s" % query)
-            self.__logger.error("params: %s" % (params,))
+            if log_exceptions:
+                self.__logger.exception("Programming error: %s, in query %s" % (pe, query))
+                self.__logger.error("bad query: %s" % query)
+                self.__logger.error("params: %s" % (params,))
             raise
         except Exception:
-            self.__logger.exception("bad query: %s\nparams: %s" % (query,params))
+            if log_exceptions:
+                self.__logger.exception("bad query: %s\nparams: %s" % (query,params))
             raise
+        self.query_count += 1
+        if profile is not None:
+            profile.add_query(query, time.time() - start)
 
         if self.sql_log or debug:
             delay = mdt.now() - now
@@ -21,3 +21,11 @@
 
 from test_osv import *
 from test_translate import *
+from test_netsvc import *
+from test_netrpc import *
+from test_xmlrpc_marshal import *
+from test_ir_attachment import *
+from test_rmlcache import *
+from test_ir_ui_menu import *
+from test_ir_values import *
+from test_report_scheduler import *
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import base64
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import tools
+from osv import osv
+from addons.base.ir import ir_attachment
+
+class AttachmentCursor(object):
+    """ Keeps the (store_fname, file_size) written by the filestore """
+    dbname = 'test_attachment'
+
+    def __init__(self):
+        self.rows = {}
+        self.result = []
+
+    def execute(self, query, params=None):
+        if query.startswith('UPDATE ir_attachment SET store_fname=%s'):
+            fname, size, id = params[:2] + params[-1:]
+            self.rows[id] = (fname, size)
+        elif query.startswith('SELECT DISTINCT store_fname'):
+            self.result = [(fname,) for fname, size in self.rows.values()]
+        elif query.startswith('SELECT store_fname, db_datas'):
+            self.result = [(self.rows[params[0]][0], None)]
+        else:
+            raise AssertionError('unexpected query: %s' % query)
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0]
+
+class FilestoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.get_misc = tools.config.get_misc
+        def get_misc(sect, key, default=None):
+            if (sect, key) == ('attachment', 'location'):
+                return self.location
+            return self.get_misc(sect, key, default)
+        tools.config.get_misc = get_misc
+        self.model = object.__new__(ir_attachment.ir_attachment)
+        self.checks = []
+        self.model._check_chunk_access = lambda cr, uid, id, mode, context=None: \
+                self.checks.append((id, mode))
+        self.cr = AttachmentCursor()
+        self.store = os.path.join(self.location, self.cr.dbname)
+
+    def tearDown(self):
+        tools.config.get_misc = self.get_misc
+        shutil.rmtree(self.location)
+
+    def test_write_dedup(self):
+        self.model._data_set(self.cr, 1, 1, 'datas', base64.b64encode('content'), None)
+        self.model._data_set(self.cr, 1, 2, 'datas', base64.b64encode('content'), None)
+        self.model._data_set(self.cr, 1, 3, 'datas', base64.b64encode('other'), None)
+        rows = self.cr.rows
+        self.assertEquals(rows[1], rows[2])
+        self.assertNotEquals(rows[1][0], rows[3][0])
+        self.assertEquals(rows[1][1], len('content'))
+        self.assertEquals(self.model._file_read(self.cr, rows[1][0]), 'content')
+        # no temporary file left
+        self.assertEquals(sorted(os.listdir(self.store)),
+                          sorted(set(fname[:2] for fname, size in rows.values())))
+
+    def test_chunks(self):
+        content = ''.join(chr(i % 256) for i in range(1000))
+        self.model._chunk_size = 300
+        self.model.write_chunk(self.cr, 1, 1, base64.b64encode(content[:600]), 0, last=False)
+        self.assertRaises(osv.except_osv, self.model.write_chunk,
+                          self.cr, 1, 1, base64.b64encode(content[900:]), 900)
+        self.model.write_chunk(self.cr, 1, 1, base64.b64encode(content[600:]), 600)
+        self.assertEquals(self.cr.rows[1][1], 1000)
+        self.assertEquals(self.checks, [(1, 'write')] * 3)
+        chunks = []
+        offset = 0
+        while True:
+            chunk = base64.b64decode(self.model.read_chunk(self.cr, 1, 1, offset))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        self.assertEquals(map(len, chunks), [300, 300, 300, 100])
+        self.assertEquals(''.join(chunks), content)
+        self.assertEquals(self.checks[3:], [(1, 'read')] * 5)
+
+    def test_gc(self):
+        self.model._data_set(self.cr, 1, 1, 'datas', base64.b64encode('used'), None)
+        self.model._data_set(self.cr, 1, 2, 'datas', base64.b64encode('unused'), None)
+        self.model._data_set(self.cr, 1, 3, 'datas', base64.b64encode('recent'), None)
+        used = os.path.join(self.store, self.cr.rows[1][0])
+        unused = os.path.join(self.store, self.cr.rows.pop(2)[0])
+        recent = os.path.join(self.store, self.cr.rows.pop(3)[0])
+        self.model.write_chunk(self.cr, 1, 4, base64.b64encode('upload'), 0, last=False)
+        upload = os.path.join(self.model._staging_dir(self.cr), '4-1')
+        fd, tmp = tempfile.mkstemp(dir=self.store, prefix='.tmp')
+        os.close(fd)
+        old = time.time() - self.model._file_gc_delay - 60
+        for path in (used, unused, upload, tmp):
+            os.utime(path, (old, old))
+        self.model._file_gc(self.cr, 1)
+        self.assertEquals([os.path.exists(path) for path in (used, unused, recent, upload, tmp)],
+                          [True, False, True, False, False])
+
+    def test_chunk_access(self):
+        calls = []
+        class Access(object):
+            def check(self, cr, uid, model, mode, context=None):
+                calls.append(('access', model, mode))
+        class Pool(object):
+            def get(self, name):
+                return Access()
+        model = object.__new__(ir_attachment.ir_attachment)
+        model._name = 'ir.attachment'
+        model.pool = Pool()
+        model.check_access_rule = lambda cr, uid, ids, mode, context=None: \
+                calls.append(('rule', ids, mode))
+        model.check = lambda cr, uid, ids, mode, context=None: \
+                calls.append(('document', ids, mode))
+        model._check_chunk_access(self.cr, 1, 7, 'read')
+        self.assertEquals(calls, [('access', 'ir.attachment', 'read'),
+                                  ('rule', [7], 'read'), ('document', [7], 'read')])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+from addons.base.ir import ir_ui_menu
+
+# menu id: (parent id, action, groups)
+MENUS = {
+    1: (None, None, []),
+    2: (1, None, []),
+    3: (1, None, []),
+    4: (2, None, [99]),
+    5: (2, 'ir.actions.act_window,10', []),
+    6: (3, 'ir.actions.act_window,11', []),
+    7: (None, None, []),
+}
+ACTION_MODELS = {10: 'hidden.model', 11: 'visible.model'}
+
+class MenuCursor(object):
+    dbname = 'test_menu'
+
+    def execute(self, query, params):
+        ids = params[0]
+        if query.startswith('SELECT menu_id, gid FROM ir_ui_menu_group_rel'):
+            self.result = [(id, gid) for id in ids for gid in MENUS[id][2]]
+        elif query.startswith('SELECT parent_id, id FROM ir_ui_menu'):
+            self.result = [(parent_id, id) for id, (parent_id, action, groups) in MENUS.items()
+                           if parent_id in ids]
+        else:
+            raise AssertionError('unexpected query: %s' % query)
+
+    def fetchall(self):
+        return self.result
+
+class Users(object):
+    def read(self, cr, uid, id, fields):
+        return {'groups_id': [1]}
+
+class Actions(object):
+    def read(self, cr, uid, ids, fields, context=None):
+        return [{'id': id, 'res_model': ACTION_MODELS[id]} for id in ids]
+
+class Access(object):
+    def check(self, cr, uid, model, raise_exception=True):
+        return model != 'hidden.model'
+
+class Pool(object):
+    def get(self, name):
+        return {'res.users': Users(), 'ir.actions.act_window': Actions(),
+                'ir.model.access': Access()}[name]
+
+class MenuVisibilityTestCase(unittest.TestCase):
+
+    def test_hidden_children(self):
+        menu = object.__new__(ir_ui_menu.ir_ui_menu)
+        menu._cache = {}
+        menu.pool = Pool()
+        menu._action = lambda cr, uid, ids, name, arg, context=None: \
+                dict((id, MENUS[id][1]) for id in ids)
+        cr = MenuCursor()
+        # 2 only has hidden children, 7 has none
+        self.assertEquals(menu._filter_visible_menus(cr, 2, [1, 2, 3, 7]), [1, 3])
+        self.assertEquals(menu._filter_visible_menus(cr, 2, [4, 5, 6]), [6])
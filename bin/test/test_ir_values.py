@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+from addons.base.ir import ir_values
+
+class ValuesCursor(object):
+    def __init__(self, name=None):
+        self.name = name
+
+class ValuesCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.model = object.__new__(ir_values.ir_values)
+        self.model._writers = ir_values.weakref.WeakKeyDictionary()
+        self.model._cache_generation = 0
+        self.model.clear_cache()
+        self.queries = []
+        def _get_values(cr, uid, key, key2, models, meta, res_id_req, key2_req):
+            self.queries.append(cr.name)
+            return [(1, 'name', 'value', False, None)]
+        self.model._get_values = _get_values
+
+    def get(self, cr):
+        return self.model.get(cr, 1, 'default', False, ['res.partner'])
+
+    def test_cached(self):
+        cr = ValuesCursor()
+        self.assertEquals(self.get(cr), [(1, 'name', 'value')])
+        self.assertEquals(self.get(cr), [(1, 'name', 'value')])
+        self.assertEquals(len(self.queries), 1)
+
+    def test_not_cached_during_writes(self):
+        writer, reader = ValuesCursor('writer'), ValuesCursor('reader')
+        self.get(reader)
+        self.model._values_written(writer)
+        # neither the changes, which may be rolled back, nor the values
+        # they replace are cached
+        self.get(writer)
+        self.get(writer)
+        self.get(reader)
+        self.assertEquals(self.queries, ['reader', 'writer', 'writer', 'reader'])
+        # the transaction is over
+        del writer
+        self.get(reader)
+        self.get(reader)
+        self.assertEquals(len(self.queries), 5)
+
+    def test_changed_while_reading(self):
+        writer, reader = ValuesCursor('writer'), ValuesCursor('reader')
+        get_values = self.model._get_values
+        def _get_values(*args):
+            # changed and committed meanwhile
+            self.model._values_written(writer)
+            self.model._writers.clear()
+            return get_values(*args)
+        self.model._get_values = _get_values
+        self.get(reader)
+        self.model._get_values = get_values
+        self.get(reader)
+        self.assertEquals(len(self.queries), 2)
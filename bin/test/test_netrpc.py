@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import socket
+import threading
+import time
+import unittest
+import tiny_socket
+from service.netrpc_server import TinySocketClientThread
+
+class SleepyClientThread(TinySocketClientThread):
+    """ Answers (service, method, delay, result) requests with result,
+        after delay seconds """
+
+    def dispatch(self, service_name, method, params):
+        time.sleep(params[0])
+        return params[1]
+
+class NetRPCTestCase(unittest.TestCase):
+
+    def connect(self, negotiate=True):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = tiny_socket.mysocket()
+        client.sock.connect(listener.getsockname())
+        sock, address = listener.accept()
+        listener.close()
+        thread = SleepyClientThread(sock, [])
+        thread.threads.append(thread)
+        thread.daemon = True
+        thread.start()
+        if negotiate:
+            client.negotiate()
+        return client, thread
+
+    def test_version_1(self):
+        client, thread = self.connect(negotiate=False)
+        self.assertEquals(client.version, 1)
+        for i in range(3):
+            client.mysend(['db', 'get', 0, i])
+            self.assertEquals(client.myreceive(), i)
+        client.disconnect()
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+
+    def test_pipelined(self):
+        client, thread = self.connect()
+        self.assertEquals(client.version, tiny_socket.VERSION)
+        start = time.time()
+        # the first requests answer last
+        for i in range(8):
+            client.mysend(['db', 'get', 0.4 - i * 0.05, 'x' * (i * 50000)], request_id=i)
+        results = {}
+        for i in range(8):
+            result = client.myreceive()
+            results[client.request_id] = result
+        self.assert_(time.time() - start < 1.0, "requests were not run concurrently")
+        self.assertEquals(results, dict((i, 'x' * (i * 50000)) for i in range(8)))
+        self.assertEquals(client.request_id, 0)
+        self.assert_(len(thread._workers) <= 8)
+        client.disconnect()
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+
+    def pair(self, max_size):
+        """ A sender and a receiver of version 3 frames, the receiver
+            accepting messages up to max_size bytes """
+        a, b = socket.socketpair()
+        sender = tiny_socket.mysocket(a)
+        receiver = tiny_socket.mysocket(b, max_size=max_size)
+        for ts in (sender, receiver):
+            ts.version = 3
+            ts._negotiated = True
+        sender.peer_accept = tiny_socket.FLAG_ZLIB
+        return sender, receiver
+
+    def test_max_size(self):
+        sender, receiver = self.pair(1000)
+        sender.mysend('x' * 500)
+        self.assertEquals(receiver.myreceive(), 'x' * 500)
+        sender.mysend('x' * 2000)
+        self.assertRaises(tiny_socket.ProtocolError, receiver.myreceive)
+
+    def test_max_inflated_size(self):
+        sender, receiver = self.pair(1000)
+        # compressed to a few hundred bytes
+        sender.mysend('x' * 100000)
+        self.assertRaises(tiny_socket.Myexception, receiver.myreceive)
+        # the stream is still readable
+        sender.mysend('y')
+        self.assertEquals(receiver.myreceive(), 'y')
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import random
+import threading
+import time
+import unittest
+from netsvc import Agent
+
+class AgentTestCase(unittest.TestCase):
+
+    def schedule(self, db_name, count, delay, start=0):
+        """ Schedules count alarms within delay seconds after start,
+            returns the list of their (planned time, run time, number of
+            threads), filled as they run """
+        fired = []
+        now = time.time()
+        def alarm(timestamp):
+            fired.append((timestamp, time.time(), threading.activeCount()))
+        for i in range(count):
+            timestamp = now + start + random.uniform(0, delay)
+            Agent.setAlarm(alarm, timestamp, db_name, timestamp)
+        return fired
+
+    def wait(self, fired, count, timeout):
+        deadline = time.time() + timeout
+        while len(fired) < count and time.time() < deadline:
+            time.sleep(0.05)
+
+    def test_timing_and_threads(self):
+        threads = threading.activeCount()
+        fired = self.schedule('test_agent_timing', 5000, 1.0)
+        self.wait(fired, 5000, 10.0)
+        self.assertEquals(len(fired), 5000)
+        delays = sorted(run - planned for planned, run, _ in fired)
+        self.assert_(delays[0] >= 0, "alarm run too early")
+        self.assert_(delays[len(delays) // 2] < 0.05, "median delay: %.3fs" % delays[len(delays) // 2])
+        self.assert_(delays[-1] < 0.5, "maximum delay: %.3fs" % delays[-1])
+        self.assert_(max(count for _, _, count in fired) <= threads + Agent._max_workers)
+
+    def test_cancel(self):
+        fired = self.schedule('test_agent_cancel', 1000, 0.2, 0.5)
+        kept = self.schedule('test_agent_keep', 1000, 0.2, 0.5)
+        cancelled = Agent.setAlarm(lambda: kept.append(None), time.time() + 0.5, 'test_agent_keep')
+        Agent.cancel('test_agent_cancel')
+        Agent.cancelAlarm(cancelled)
+        self.wait(kept, 1000, 5.0)
+        time.sleep(0.2)
+        self.assertEquals(len(fired), 0)
+        self.assertEquals(len(kept), 1000)
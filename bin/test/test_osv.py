@@ -19,8 +19,16 @@
 #
 ##############################################################################
 
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
 import unittest
+from netsvc import Agent
 from osv.query import Query
+from osv import fields, orm
 
 class QueryTestCase(unittest.TestCase):
 
@@ -62,3 +70,229 @@ class QueryTestCase(unittest.TestCase):
         query.tables.append('"product_product"')
         self.assertRaises(AssertionError, query.join, ("product_template", "product_category", "categ_id", "id"), outer=False)
 
+
+class InsertCursor(object):
+    """ Takes the ids of the inserted rows from a counter, and returns
+        them in reverse order """
+    IN_MAX = 3
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+        self.queries = []
+
+    def execute(self, query, params, debug=False):
+        self.queries.append(query)
+        rows = len(re.findall(r'\(%s[^)]*\)', query.split('VALUES')[1]))
+        self.result = [(self.counter.next(),) for i in range(rows)][::-1]
+
+    def fetchall(self):
+        return self.result
+
+class CreateMultiTestCase(unittest.TestCase):
+
+    def test_ids_in_order(self):
+        model = object.__new__(orm.orm)
+        model._table = 'test'
+        model._debug = False
+        # (vals, columns, formats, params, upd_todo), as _create_prepare()
+        prepared = []
+        for i, columns in enumerate(['a', 'a', 'b', 'a', 'a', 'a', 'a', 'a', 'b']):
+            prepared.append(({}, ['"%s"' % columns], ['%s'], [i], []))
+        cr = InsertCursor()
+        self.assertEquals(model._insert_prepared(cr, prepared), range(1, 10))
+        # runs of consecutive rows with the same columns, up to IN_MAX rows
+        self.assertEquals(len(cr.queries), 5)
+
+class Cursor(object):
+    dbname = 'test_parent_store'
+
+class ParentStoreTestCase(unittest.TestCase):
+
+    def test_renumber_after_cancel(self):
+        model = object.__new__(orm.orm)
+        model._name = 'test.parent.store'
+        cr = Cursor()
+        key = (cr.dbname, model._name)
+        try:
+            model._parent_store_renumber_later(cr)
+            task = orm._parent_store_pending[key]
+            model._parent_store_renumber_later(cr)
+            self.assert_(orm._parent_store_pending[key] is task)
+            # closing the database cancels its tasks
+            Agent.cancel(cr.dbname)
+            model._parent_store_renumber_later(cr)
+            self.assert_(orm._parent_store_pending[key] is not task)
+            self.failIf(Agent.cancelled(orm._parent_store_pending[key]))
+        finally:
+            Agent.cancel(cr.dbname)
+            orm._parent_store_pending.pop(key, None)
+
+@unittest.skipUnless(os.environ.get('OPENERP_TEST_DB'),
+                     "OPENERP_TEST_DB must name a database with the base module")
+class ParentStoreConcurrencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import pooler
+        self.db, pool = pooler.get_db_and_pool(os.environ['OPENERP_TEST_DB'], pooljobs=False)
+        self.model = pool.get('res.partner.category')
+        self.gap = self.model._parent_store_gap
+        self.model._parent_store_gap = 16
+        cr = self.db.cursor()
+        try:
+            self.root = self.model.create(cr, 1, {'name': 'test_parent_store'})
+            self.model._parent_store_compute(cr)
+            cr.commit()
+        finally:
+            cr.close()
+
+    def tearDown(self):
+        self.model._parent_store_gap = self.gap
+        cr = self.db.cursor()
+        try:
+            ids = self.model.search(cr, 1, [('id', 'child_of', self.root)])
+            self.model.unlink(cr, 1, ids)
+            cr.commit()
+        finally:
+            cr.close()
+
+    def test_concurrent_creates(self):
+        cr1, cr2 = self.db.cursor(), self.db.cursor()
+        ids = []
+        def create():
+            ids.append(self.model.create(cr2, 1, {'name': 'b', 'parent_id': self.root}))
+            cr2.commit()
+        try:
+            ids.append(self.model.create(cr1, 1, {'name': 'a', 'parent_id': self.root}))
+            thread = threading.Thread(target=create)
+            thread.start()
+            thread.join(0.5)
+            self.assert_(thread.isAlive(), "the second placement did not wait for the first one")
+            cr1.commit()
+            thread.join()
+        finally:
+            cr1.close()
+            cr2.close()
+        cr = self.db.cursor()
+        try:
+            cr.execute('SELECT parent_left, parent_right FROM res_partner_category '
+                       'WHERE id IN %s ORDER BY parent_left', (tuple(ids),))
+            (left1, right1), (left2, right2) = cr.fetchall()
+        finally:
+            cr.close()
+        self.assert_(right1 < left2, "overlapping intervals")
+
+class MemoryCursor(object):
+    def execute(self, query, params=None, debug=False):
+        pass
+
+class OrmMemoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.model = object.__new__(orm.orm_memory)
+        self.model.datas = {}
+        self.model._uid_ids = {}
+        self.model._access_heap = []
+        self.model._name = 'test.memory'
+        self.model._debug = False
+        self.model._columns = {}
+        self.model._max_hours = self.model._max_count = None
+        self.model.check_id = 0
+        self.cr = MemoryCursor()
+
+    def add(self, id, uid, date_access):
+        """ Adds a record as create() does """
+        self.model.datas[id] = {'internal.date_access': date_access,
+                                'internal.create_uid': uid}
+        self.model._uid_ids.setdefault(uid, set()).add(id)
+        heapq.heappush(self.model._access_heap, (date_access, id))
+
+    def test_pop_oldest(self):
+        for id in range(1, 6):
+            self.add(id, 1, id * 10)
+        # read since it was pushed, and unlinked
+        self.model.datas[1]['internal.date_access'] = 60
+        del self.model.datas[3]
+        self.assertEquals(self.model._pop_oldest(), 2)
+        self.assertEquals(self.model._pop_oldest(45), 4)
+        self.assertEquals(self.model._pop_oldest(45), None)
+        self.assertEquals(self.model._pop_oldest(), 5)
+        self.assertEquals(self.model._pop_oldest(), 1)
+        self.assertEquals(self.model._pop_oldest(), None)
+
+    def test_vaccum(self):
+        now = time.time()
+        for id in range(1, 6):
+            self.add(id, id % 2 + 2, now - 7200 + id)
+        for id in range(6, 11):
+            self.add(id, 2, now + id)
+        self.model._max_hours = 1
+        self.model.vaccum(self.cr, 1, force=True)
+        self.assertEquals(sorted(self.model.datas), range(6, 11))
+        # the user 3 has no record left
+        self.assertEquals(self.model._uid_ids, {2: set(range(6, 11))})
+        self.model._max_count = 2
+        self.model.vaccum(self.cr, 1, force=True)
+        self.assertEquals(sorted(self.model.datas), [9, 10])
+
+    def test_heap_rebuild(self):
+        for id in range(1, 101):
+            self.add(id, 2, id)
+        self.model.unlink(self.cr, 1, range(1, 91))
+        self.assertEquals(len(self.model._access_heap), 100)
+        self.model.vaccum(self.cr, 1, force=True)
+        self.assertEquals(sorted(self.model._access_heap), [(id, id) for id in range(91, 101)])
+
+    def test_search(self):
+        for id in range(1, 6):
+            self.add(id, id % 2 + 2, id)
+        search = self.model._search
+        self.assertEquals(search(self.cr, 3, []), [1, 3, 5])
+        self.assertEquals(search(self.cr, 3, [], offset=1, limit=1), [3])
+        self.assertEquals(search(self.cr, 3, [], offset=1, count=True), 2)
+        self.assertEquals(search(self.cr, 2, [], limit=1), [2])
+        self.assertEquals(search(self.cr, 4, []), [])
+        self.assertEquals(search(self.cr, 1, [], offset=3), [4, 5])
+
+class PrefetchRecord(orm.browse_record):
+    """ Readable when the id is odd """
+    checked = []
+
+    def _readable_ids(self, obj, ids):
+        self.checked.append(sorted(ids))
+        return [id for id in ids if id % 2]
+
+class PrefetchModel(object):
+    def __init__(self, name):
+        self._name = name
+        self.pool = self
+
+    def get(self, name):
+        return PrefetchModel(name)
+
+class BrowsePrefetchTestCase(unittest.TestCase):
+
+    def record(self, cache, model, id=None):
+        record = object.__new__(PrefetchRecord)
+        record._cache = cache
+        record._table = PrefetchModel(model)
+        record._table_name = model
+        record._id = id
+        return record
+
+    def test_rules_checked_when_read(self):
+        checked = PrefetchRecord.checked
+        del checked[:]
+        cache = orm.browse_cache()
+        source = self.record(cache, 'test.source')
+        source._prefetch_relations([('target_id', fields.many2one('test.target', 'Target'))],
+                                   [{'id': 1, 'target_id': (2, 'Two')},
+                                    {'id': 3, 'target_id': 3}, {'id': 5, 'target_id': 4}])
+        self.assertEquals(sorted(cache['test.target']), [2, 3, 4])
+        self.assertEquals(checked, [])
+        # the record accessed is read in any case
+        target = self.record(cache, 'test.target', 2)
+        self.assertEquals(target._ids_to_read([2, 3, 4]), [2, 3])
+        self.assertEquals(checked, [[2, 3, 4]])
+        target._id = 3
+        self.assertEquals(target._ids_to_read([3, 4]), [3])
+        self.assertEquals(checked, [[2, 3, 4]])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+from service.web_services import report_scheduler
+
+class Job(object):
+    def __init__(self, uid, priority):
+        self.uid = uid
+        self.priority = priority
+
+class ReportSchedulerTestCase(unittest.TestCase):
+
+    def test_priority_within_user(self):
+        scheduler = report_scheduler()
+        # no workers, the jobs are picked by hand
+        scheduler._start_workers = lambda: None
+        first = Job(1, 10)
+        scheduler.push(first)
+        urgent = Job(2, -1000)
+        scheduler.push(Job(2, 10))
+        scheduler.push(urgent)
+        # the priorities of a user do not take precedence over the others
+        self.assert_(scheduler._pick() is first)
+        self.assert_(scheduler._pick() is urgent)
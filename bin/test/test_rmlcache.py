@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+from reportlab.lib.fonts import tt2ps
+from report.render.rml2pdf import rmlcache
+
+class FontMappingTestCase(unittest.TestCase):
+
+    def test_remapped(self):
+        # a document maps the face, another one remaps it
+        rmlcache.map_font('TestFace', 'Helvetica')
+        rmlcache.map_font('TestFace', 'Courier', 'bold')
+        self.assertEquals(tt2ps('TestFace', 1, 0), 'Courier')
+        self.assertEquals(tt2ps('TestFace', 0, 0), 'Helvetica')
+        # the first one renders again
+        rmlcache.map_font('TestFace', 'Helvetica')
+        for bold in (0, 1):
+            for italic in (0, 1):
+                self.assertEquals(tt2ps('TestFace', bold, italic), 'Helvetica')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+import xmlrpclib
+import zlib
+from service import xmlrpc_marshal
+
+class XMLRPCMarshalTestCase(unittest.TestCase):
+
+    rows = [{'id': i, 'name': u'Partner \xe9 <%d> & co' % i, 'ref': 'R%d' % i,
+             'customer': bool(i % 2), 'credit': i * 1.5, 'category_id': [1, 2L, 3],
+             'parent_id': i % 3 and (i, 'P %d' % i) or False,
+             'date': xmlrpclib.DateTime('20100101T10:00:00'),
+             u'k\xe9y': xmlrpclib.Binary('a\x00b')} for i in range(300)]
+
+    def test_same_as_xmlrpclib(self):
+        for params in [(self.rows,), ([],), ('',), ({'a': None},),
+                       xmlrpclib.Fault(3, 'bad <value>')]:
+            for encoding in (None, 'iso-8859-1'):
+                self.assertEquals(xmlrpc_marshal.dumps(params, encoding, True),
+                        xmlrpclib.dumps(params, methodresponse=1, encoding=encoding, allow_none=True))
+
+    def test_errors(self):
+        for params, error in [(({'a': None},), TypeError), (([2**40],), OverflowError),
+                              (({1: 2},), TypeError), ((object(),), TypeError)]:
+            self.assertRaises(error, xmlrpc_marshal.dumps, params)
+
+    def test_loads(self):
+        request = xmlrpclib.dumps(('db', 1, 'res.partner', 'write', range(100),
+                                   {'name': u'x\xe9' * 1000}), 'execute')
+        chunks = [request[i:i + 100] for i in range(0, len(request), 100)]
+        self.assertEquals(xmlrpc_marshal.loads(chunks), xmlrpclib.loads(request))
+
+    def test_dispatch(self):
+        expected = xmlrpclib.dumps((self.rows,), methodresponse=1)
+        for compress in (False, True):
+            writer = xmlrpc_marshal.ResponseWriter(compress=compress)
+            xmlrpc_marshal.marshaled_dispatch([xmlrpclib.dumps((), 'read')],
+                    lambda method, params: self.rows, writer)
+            response = ''.join(writer.close())
+            self.assertEquals(writer.compressed, compress)
+            if compress:
+                response = zlib.decompress(response, 16 + zlib.MAX_WBITS)
+            self.assertEquals(response, expected)
+
+        # a fault replaces what was written before the error, and is
+        # small enough to be sent as is
+        writer = xmlrpc_marshal.ResponseWriter(compress=True)
+        xmlrpc_marshal.marshaled_dispatch([xmlrpclib.dumps((), 'read')],
+                lambda method, params: self.rows + [object()], writer)
+        response = ''.join(writer.close())
+        self.assertFalse(writer.compressed)
+        self.assertRaises(xmlrpclib.Fault, xmlrpclib.loads, response)
+
+        # small responses are not compressed
+        writer = xmlrpc_marshal.ResponseWriter(compress=True)
+        xmlrpc_marshal.marshaled_dispatch(['<bad'], None, writer)
+        self.assertFalse(writer.compressed)
+        self.assertRaises(xmlrpclib.Fault, xmlrpclib.loads, ''.join(writer.close()))
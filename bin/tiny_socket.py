@@ -20,12 +20,54 @@
 ##############################################################################
 
 import socket
+import struct
+import threading
 import cPickle
 import cStringIO
 import marshal
+import zlib
 
 #.apidoc title: Net-RPC classes
 
+""" Net-RPC framing
+
+    Version 1 frames are an 8 chars ASCII length, a '0' or '1' exception
+    flag, and a protocol 0 pickle of [message, traceback].
+
+    Version 2 is negotiated by the client, with a hello message in place
+    of the first frame: 8 bytes, the MAGIC, the highest version and the
+    FLAG_* options it supports. The server answers with the same message,
+    for the version and options both sides support. A version 1 server
+    replies with a version 1 error frame instead, after which the client
+    keeps using version 1.
+
+    Version 2 frames are a 4 bytes length and a byte of FLAG_* options,
+    followed by [message, traceback] in the highest pickle protocol, or
+    marshal'ed when the receiver accepts it and the data is plain,
+    compressed with zlib when large enough and accepted by the receiver.
+
+    Version 3 adds a 4 bytes request id to the version 2 header, so that
+    a client may send several requests without waiting for the responses,
+    which the server sends back with the id of their request, as they
+    complete.
+"""
+
+MAGIC = '\x00NRP'
+VERSION = 3
+
+FLAG_EXCEPTION = 1
+FLAG_ZLIB = 2
+FLAG_MARSHAL = 4
+
+_hello = struct.Struct('!4sBB2x')
+_header = struct.Struct('!IB')
+_header3 = struct.Struct('!IBI')
+
+# payloads larger than that are compressed, if the receiver accepts it
+ZLIB_THRESHOLD = 64 * 1024
+# largest message accepted, before and after inflation
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
 class Myexception(Exception):
     """
     custom exception object store
@@ -39,9 +81,17 @@ class Myexception(Exception):
         self.faultString = faultString
         self.args = (faultCode, faultString)
 
+class ProtocolError(Myexception):
+    """ The message could not be read, nor the next ones: the connection
+        must be closed """
+
 class mysocket:
 
-    def __init__(self, sock=None):
+    def __init__(self, sock=None, accept=FLAG_ZLIB, max_size=MAX_FRAME_SIZE):
+        """ accept: the FLAG_* encodings accepted from the other end, the
+            server should not accept marshal from untrusted clients
+            max_size: size of the largest message received, compressed or
+            not """
         if sock is None:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         else:
@@ -50,44 +100,125 @@ class mysocket:
         # prepare this socket for long operations: it may block for infinite
         # time, but should exit as soon as the net is down
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        
-    def connect(self, host, port=False):
+        self.accept = accept
+        self.max_size = max_size
+        # version of the framing, and encodings accepted by the other end
+        self.version = 1
+        self.peer_accept = 0
+        self._negotiated = False
+        # id of the last request received, for version 3
+        self.request_id = 0
+        # responses may be sent by several threads at once
+        self._send_lock = threading.Lock()
+
+    def connect(self, host, port=False, negotiate=True):
         if not port:
             protocol, buf = host.split('//')
             host, port = buf.split(':')
         self.sock.connect((host, int(port)))
-        
+        if negotiate:
+            self.negotiate()
+
+    def negotiate(self):
+        """ Asks the server for the highest version of the framing """
+        self._negotiated = True
+        self.sock.sendall(_hello.pack(MAGIC, VERSION, self.accept))
+        buf = self._recv(_hello.size)
+        if buf[:4] == MAGIC:
+            magic, self.version, self.peer_accept = _hello.unpack(str(buf))
+        else:
+            # a version 1 server, which sends an error frame back
+            self._recv(int(str(buf)) + 1)
+
     def disconnect(self):
         self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
-        
-    def mysend(self, msg, exception=False, traceback=None):
-        msg = cPickle.dumps([msg,traceback])
-        self.sock.sendall('%8d%s%s' % (len(msg), exception and "1" or "0", msg))
-            
-    def myreceive(self):
-        buf=''
-        while len(buf) < 8:
-            chunk = self.sock.recv(8 - len(buf))
-            if not chunk:
+
+    def _recv(self, size):
+        """ Receives exactly size bytes, in a bytearray """
+        buf = bytearray(size)
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            count = self.sock.recv_into(view[pos:], size - pos)
+            if not count:
                 raise socket.timeout
-            buf += chunk
-        size = int(buf)
-        buf = self.sock.recv(1)
-        if buf != "0":
-            exception = buf
+            pos += count
+        return buf
+
+    def mysend(self, msg, exception=False, traceback=None, request_id=0):
+        if self.version < 2:
+            msg = cPickle.dumps([msg,traceback])
+            self.sock.sendall('%8d%s%s' % (len(msg), exception and "1" or "0", msg))
+            return
+
+        flags = exception and FLAG_EXCEPTION or 0
+        data = None
+        if self.peer_accept & FLAG_MARSHAL and not exception:
+            try:
+                data = marshal.dumps([msg, traceback])
+                flags |= FLAG_MARSHAL
+            except ValueError:
+                # not plain data
+                pass
+        if data is None:
+            data = cPickle.dumps([msg, traceback], cPickle.HIGHEST_PROTOCOL)
+        if len(data) > ZLIB_THRESHOLD and self.peer_accept & FLAG_ZLIB:
+            data = zlib.compress(data, 1)
+            flags |= FLAG_ZLIB
+        if self.version < 3:
+            header = _header.pack(len(data), flags)
         else:
-            exception = False
-        msg = ''
-        while len(msg) < size:
-            chunk = self.sock.recv(size-len(msg))
-            if not chunk:
-                raise socket.timeout
-            msg = msg + chunk
-        msgio = cStringIO.StringIO(msg)
-        unpickler = cPickle.Unpickler(msgio)
-        unpickler.find_global = None
-        res = unpickler.load()
+            header = _header3.pack(len(data), flags, request_id)
+        self._send_lock.acquire()
+        try:
+            self.sock.sendall(header)
+            self.sock.sendall(data)
+        finally:
+            self._send_lock.release()
+
+    def myreceive(self):
+        if self.version < 2:
+            buf = self._recv(8)
+            if not self._negotiated:
+                self._negotiated = True
+                if buf[:4] == MAGIC:
+                    # a client asking for a newer version
+                    magic, version, self.peer_accept = _hello.unpack(str(buf))
+                    self.version = min(version, VERSION)
+                    self.peer_accept &= FLAG_ZLIB | FLAG_MARSHAL
+                    self.sock.sendall(_hello.pack(MAGIC, self.version, self.accept))
+                    return self.myreceive()
+        if self.version < 2:
+            size = int(str(buf))
+            exception = self._recv(1) != "0"
+            flags = exception and FLAG_EXCEPTION or 0
+        elif self.version < 3:
+            size, flags = _header.unpack(str(self._recv(_header.size)))
+            exception = flags & FLAG_EXCEPTION
+        else:
+            size, flags, self.request_id = _header3.unpack(str(self._recv(_header3.size)))
+            exception = flags & FLAG_EXCEPTION
+        if size > self.max_size:
+            # not read, the stream is lost
+            raise ProtocolError('Net-RPC protocol error',
+                                'message of %d bytes, larger than %d' % (size, self.max_size))
+        msg = buffer(self._recv(size))
+
+        if flags & ~self.accept & (FLAG_ZLIB | FLAG_MARSHAL):
+            raise Myexception('Net-RPC protocol error', 'unexpected encoding: %d' % flags)
+        if flags & FLAG_ZLIB:
+            inflater = zlib.decompressobj()
+            msg = inflater.decompress(msg, self.max_size)
+            if inflater.unconsumed_tail:
+                raise Myexception('Net-RPC protocol error',
+                                  'message inflated to more than %d bytes' % self.max_size)
+        if flags & FLAG_MARSHAL:
+            res = marshal.loads(msg)
+        else:
+            unpickler = cPickle.Unpickler(cStringIO.StringIO(msg))
+            unpickler.find_global = None
+            res = unpickler.load()
 
         if isinstance(res[0],Exception):
             if exception:
@@ -61,6 +61,7 @@ except ImportError:
 import netsvc
 from config import config
 from lru import LRU
+import profiler
 
 _logger = logging.getLogger('tools')
 
@@ -921,6 +922,10 @@ class cache(object):
                 else:
                     notincache[id] = key
 
+            profile = profiler.current()
+            if profile is not None:
+                profile.add_cache(len(result), len(notincache))
+
             if notincache:
                 if self.multi:
                     kwargs2[self.multi] = notincache.keys()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+#.apidoc title: Per-request profiler
+
+""" Sampled profiling of the RPC requests
+
+    A sampled request gets a `RequestProfile`, attached to its thread for
+    the duration of the call, which the cursors and the caches report to.
+    When the request is over, its profile is kept in memory (see
+    `get_profiles()`, exposed as common.get_rpc_profiles) and written to
+    the profiler log file, if any.
+
+    Options, in the [profiler] section of the configuration file:
+        rate       fraction of the requests to profile (default 0, off)
+        keep       number of profiles kept in memory (default 100)
+        top        number of queries listed per profile (default 10)
+        logfile    rolling log file of the profiles (default none)
+        log_size   size of the log file before rolling it (default 10MB)
+        cprofile   also run the sampled requests under cProfile
+        dump_dir   where to write the cProfile dumps
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import logging.handlers
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+from config import config
+
+__all__ = ['profile_call', 'current', 'get_profiles', 'set_rate']
+
+_local = threading.local()
+_lock = threading.Lock()
+_profiles = []
+_rate = float(config.get_misc('profiler', 'rate', 0))
+_logger = None
+
+_re_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_re_lists = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+_re_spaces = re.compile(r"\s+")
+
+def normalize_query(query):
+    """ Strips the literals and the length of the IN lists from query,
+        so that the queries which only differ by them are counted together
+    """
+    query = _re_literals.sub('%s', query)
+    query = _re_lists.sub('(%s)', query)
+    return _re_spaces.sub(' ', query).strip()
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_CLOCK_THREAD_CPUTIME_ID = 3
+try:
+    _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or 'libc.so.6',
+                                 use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    if _clock_gettime(_CLOCK_THREAD_CPUTIME_ID, ctypes.byref(_timespec())):
+        raise OSError(ctypes.get_errno(), 'clock_gettime')
+except (OSError, AttributeError):
+    _clock_gettime = None
+
+def _cpu_time():
+    """ CPU time of the current thread, or of the whole process when the
+        platform has no thread clock (then the other threads busy
+        meanwhile are counted too) """
+    if _clock_gettime is not None:
+        t = _timespec()
+        _clock_gettime(_CLOCK_THREAD_CPUTIME_ID, ctypes.byref(t))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    t = os.times()
+    return t[0] + t[1]
+
+
+class RequestProfile(object):
+    """ The measures of one RPC request """
+
+    def __init__(self, label):
+        self.label = label
+        self.start = time.time()
+        self.wall = 0.0
+        self.cpu = _cpu_time()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.queries = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.dump = None
+
+    def add_query(self, query, delay):
+        self.query_count += 1
+        self.sql_time += delay
+        st = self.queries.get(query)
+        if st is None:
+            self.queries[query] = [1, delay]
+        else:
+            st[0] += 1
+            st[1] += delay
+
+    def add_cache(self, hits, misses):
+        self.cache_hits += hits
+        self.cache_misses += misses
+
+    def stop(self):
+        self.wall = time.time() - self.start
+        self.cpu = _cpu_time() - self.cpu
+
+    def top_queries(self, count):
+        """ The `count` slowest queries, once normalized, as a list of
+            (query, number of executions, total time) """
+        normalized = {}
+        for query, (num, delay) in self.queries.iteritems():
+            st = normalized.setdefault(normalize_query(query), [0, 0.0])
+            st[0] += num
+            st[1] += delay
+        res = [(k, v[0], v[1]) for k, v in normalized.iteritems()]
+        res.sort(key=lambda x: x[2], reverse=True)
+        return res[:count]
+
+    def as_dict(self):
+        top = int(config.get_misc('profiler', 'top', 10))
+        return {
+            'label': self.label,
+            'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start)),
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'queries': self.query_count,
+            'sql_time': self.sql_time,
+            'top_queries': [list(x) for x in self.top_queries(top)],
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'dump': self.dump or False,
+        }
+
+
+def current():
+    """ The profile of the request being run by this thread, if sampled """
+    return getattr(_local, 'profile', None)
+
+def set_rate(rate):
+    global _rate
+    _rate = float(rate)
+
+def get_profiles(limit=None):
+    """ The last profiles, most recent first """
+    _lock.acquire()
+    try:
+        res = _profiles[::-1]
+    finally:
+        _lock.release()
+    if limit:
+        res = res[:limit]
+    return [p.as_dict() for p in res]
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger('rpc.profile')
+        logfile = config.get_misc('profiler', 'logfile', False)
+        if logfile:
+            handler = logging.handlers.RotatingFileHandler(logfile,
+                    maxBytes=int(config.get_misc('profiler', 'log_size', 10 * 1024 * 1024)),
+                    backupCount=5)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            _logger.addHandler(handler)
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+    return _logger
+
+def _record(profile):
+    _lock.acquire()
+    try:
+        _profiles.append(profile)
+        del _profiles[:-int(config.get_misc('profiler', 'keep', 100))]
+    finally:
+        _lock.release()
+
+    logger = _get_logger()
+    if logger.isEnabledFor(logging.INFO):
+        msg = "%s: %.1fms wall, %.1fms cpu, %d queries in %.1fms, cache %d/%d" % \
+                (profile.label, profile.wall * 1000, profile.cpu * 1000,
+                 profile.query_count, profile.sql_time * 1000,
+                 profile.cache_hits, profile.cache_hits + profile.cache_misses)
+        for query, num, delay in profile.top_queries(int(config.get_misc('profiler', 'top', 10))):
+            msg += "\n    %8.1fms %5d x %s" % (delay * 1000, num, query)
+        if profile.dump:
+            msg += "\n    profile dumped to %s" % profile.dump
+        logger.info(msg)
+
+def _run_cprofile(profile, fn, args):
+    import cProfile
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(fn, *args)
+    finally:
+        dump_dir = config.get_misc('profiler', 'dump_dir',
+                os.path.join(tempfile.gettempdir(), 'openerp-profiles'))
+        if not os.path.isdir(dump_dir):
+            os.makedirs(dump_dir)
+        profile.dump = os.path.join(dump_dir, '%s-%s.prof' % (
+                time.strftime('%Y%m%d-%H%M%S', time.localtime(profile.start)),
+                re.sub(r'[^\w.-]+', '_', profile.label)))
+        prof.dump_stats(profile.dump)
+
+def profile_call(label, fn, *args):
+    """ Calls fn(*args), profiling it if the request is sampled """
+    if not _rate or current() is not None or random.random() >= _rate:
+        return fn(*args)
+    profile = RequestProfile(label)
+    _local.profile = profile
+    try:
+        if config.get_misc('profiler', 'cprofile', False):
+            return _run_cprofile(profile, fn, args)
+        return fn(*args)
+    finally:
+        _local.profile = None
+        profile.stop()
+        _record(profile)
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
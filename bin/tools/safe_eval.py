@@ -37,6 +37,7 @@ condition/math builtins.
 from opcode import HAVE_ARGUMENT, opmap, opname
 from types import CodeType
 import logging
+from lru import LRU
 
 __all__ = ['test_expr', 'literal_eval', 'safe_eval', 'const_eval' ]
 
@@ -116,6 +117,18 @@ def test_expr(expr, allowed_codes, mode="eval"):
     return code_obj
 
 
+# Checked code objects of the expressions already seen: the same report
+# expressions, domains and attrs are evaluated over and over.
+_code_cache = LRU(4096)
+
+def _compile_safe(expr, mode):
+    key = (expr, mode)
+    try:
+        return _code_cache[key]
+    except KeyError:
+        code_obj = _code_cache[key] = test_expr(expr, _SAFE_OPCODES, mode=mode)
+        return code_obj
+
 def const_eval(expr):
     """const_eval(expression) -> value
 
@@ -282,7 +295,7 @@ def safe_eval(expr, globals_dict=None, locals_dict=None, mode="eval", nocopy=Fal
                 'set' : set
             }
     )
-    return eval(test_expr(expr,_SAFE_OPCODES, mode=mode), globals_dict, locals_dict)
+    return eval(_compile_safe(expr, mode), globals_dict, locals_dict)
 
 import logging
 import traceback